@@ -0,0 +1,143 @@
+import os, re, time, shutil, hashlib, tempfile, threading
+from collections import OrderedDict
+from typing import Iterable
+
+
+# Generated File Storage
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ArtifactStore:
+    """
+    Files the tools generate, kept per session and addressed by the hash of their content, so concurrent sessions never
+    overwrite each other's downloads. Bytes are held in memory, least recently used ones spill to `directory` once
+    they exceed `memory_bytes`, and artifacts not read for `ttl` seconds are dropped from both.
+    """
+    def __init__(self, directory: str = "artifacts", memory_bytes: int = 64 * 2**20, ttl: float = 86400) -> None:
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.ttl = ttl
+        self._memory: OrderedDict[tuple[str, str], tuple[bytes, float]] = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self._purged = time.time()
+
+    def put(self, session: str, data: bytes, key: str | None = None) -> str:
+        # `key` lets an artifact be addressed by the content it was generated from (a PDF by its template hash)
+        key = key or content_hash(data)
+
+        with self._lock:
+            self._remember((session, key), data)
+
+        if time.time() - self._purged > min(self.ttl, 60): self.purge()
+        return key
+
+    def put_chunks(self, session: str, chunks: Iterable[bytes]) -> str:
+        # Streams an artifact in, once it outgrows the memory budget the rest goes straight to disk
+        digest, buffer, spill = hashlib.sha256(), bytearray(), None
+
+        try:
+            for chunk in chunks:
+                digest.update(chunk)
+                if spill is None and len(buffer) + len(chunk) > self.memory_bytes:
+                    os.makedirs(self.directory, exist_ok=True)
+                    spill = tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False)
+                    spill.write(buffer)
+                    buffer = bytearray()
+                if spill: spill.write(chunk)
+                else: buffer += chunk
+        except BaseException:
+            if spill:
+                spill.close()
+                os.remove(spill.name)
+            raise
+
+        key = digest.hexdigest()
+        if spill is None: return self.put(session, bytes(buffer), key)
+
+        spill.close()
+        path = self._path(session, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(spill.name, path)
+        return key
+
+    def get(self, session: str, key: str) -> bytes | None:
+        with self._lock:
+            if (entry := self._memory.get((session, key))) is not None:
+                self._memory[(session, key)] = (entry[0], time.time())
+                self._memory.move_to_end((session, key))
+                return entry[0]
+
+            path = self._path(session, key)
+            if path is None or not os.path.exists(path) or time.time() - os.path.getmtime(path) > self.ttl: return None
+            with open(path, "rb") as file: data = file.read()
+            os.utime(path)
+            # Read back into memory, the spilled copy stays in case it is evicted again
+            self._remember((session, key), data)
+            return data
+
+    def exists(self, session: str, key: str) -> bool:
+        # Like `get` without reading the bytes or keeping the artifact alive
+        with self._lock:
+            if (session, key) in self._memory: return True
+        path = self._path(session, key)
+        return path is not None and os.path.exists(path) and time.time() - os.path.getmtime(path) <= self.ttl
+
+    def discard(self, session: str) -> None:
+        with self._lock:
+            for entry in [entry for entry in self._memory if entry[0] == session]: self._forget(entry)
+        shutil.rmtree(self._session_directory(session), ignore_errors=True)
+
+    def purge(self) -> None:
+        now = self._purged = time.time()
+
+        with self._lock:
+            for entry in [entry for entry, (_, used) in self._memory.items() if now - used > self.ttl]:
+                self._forget(entry)
+
+        if not os.path.isdir(self.directory): return
+        for session_directory in os.scandir(self.directory):
+            if not session_directory.is_dir(): continue
+            for file in os.scandir(session_directory.path):
+                if now - file.stat().st_mtime > self.ttl:
+                    try: os.remove(file.path)
+                    except FileNotFoundError: pass
+            try: os.rmdir(session_directory.path)
+            except OSError: pass
+
+    def memory_size(self) -> int:
+        with self._lock: return self._memory_size
+
+    def _remember(self, entry: tuple[str, str], data: bytes) -> None:
+        if entry in self._memory: self._forget(entry)
+        # Too large to ever fit, it would only push every other artifact out first
+        if len(data) > self.memory_bytes: return self._spill(entry, data)
+        self._memory[entry] = (data, time.time())
+        self._memory_size += len(data)
+
+        while self._memory_size > self.memory_bytes and self._memory:
+            spilled, (spilled_data, _) = self._memory.popitem(last=False)
+            self._memory_size -= len(spilled_data)
+            self._spill(spilled, spilled_data)
+
+    def _forget(self, entry: tuple[str, str]) -> None:
+        data, _ = self._memory.pop(entry)
+        self._memory_size -= len(data)
+
+    def _spill(self, entry: tuple[str, str], data: bytes) -> None:
+        path = self._path(*entry)
+        if path is None: return
+        if os.path.exists(path): return os.utime(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as file: file.write(data)
+        os.replace(temporary, path)
+
+    def _session_directory(self, session: str) -> str:
+        # Thread ids come from the browser, only their hash names a directory
+        return os.path.join(self.directory, content_hash(session.encode("utf-8"))[:32])
+
+    def _path(self, session: str, key: str) -> str | None:
+        if not re.fullmatch(r"[0-9a-f]{64}", key): return None
+        return os.path.join(self._session_directory(session), key)
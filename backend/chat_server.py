@@ -1,11 +1,16 @@
-from typing import Annotated, TypedDict
+import os, json
+from typing import Annotated, NotRequired, TypedDict
 from dotenv import load_dotenv
 from .storage import Storage
 from .llms import Model
-from .prompts import CHATBOT_PROMPT
-from langchain_core.messages import SystemMessage, BaseMessage
+from .tools import agent_tools
+from .prompts import prompt_registry, CHATBOT_PROMPT_ID, CONVERSATION_SUMMARY_PROMPT
+from .utilities import build_once, ContextWindow, timed_tool_node
+from langchain_core.messages import SystemMessage, HumanMessage, BaseMessage
+from langgraph.constants import TAG_NOSTREAM
 from langgraph.graph import StateGraph, START
-from langgraph.prebuilt import ToolNode, tools_condition
+from langgraph.graph.state import CompiledStateGraph
+from langgraph.prebuilt import tools_condition
 from langgraph.graph.message import add_messages
 from langsmith import traceable
 
@@ -16,33 +21,61 @@ load_dotenv()
 # Graph state schema
 class ChatState(TypedDict):
     messages: Annotated[list[BaseMessage], add_messages]
+    prompt: NotRequired[str] # Prompt registry id of the persona, pinned on the thread's first turn
+    summary: NotRequired[str] # Rolling summary of the turns that no longer fit the context budget
+    summarized: NotRequired[int] # Number of history messages the summary covers
 
-# AI instances
-model = Model()
+# AI instances (built on first use, the token budget applies to local models)
+model = build_once(Model, None, 512)
+
+def summarize_turns(summary: str, messages: list[BaseMessage]) -> str:
+    # Folds the messages that dropped out of the context window into the previous summary
+    transcript = "\n".join(
+        f"{message.type}: {message.text or json.dumps(getattr(message, 'tool_calls', []))}" for message in messages
+    )
+    request = f"Current summary:\n{summary or '(empty)'}\n\nNew messages:\n{transcript}"
+    # Runs inside the chat node, untagged its tokens would be streamed to the user as part of the reply
+    summarizer = model().llm.with_config(tags=[TAG_NOSTREAM])
+    return summarizer.invoke([SystemMessage(CONVERSATION_SUMMARY_PROMPT), HumanMessage(request)]).text.strip()
+
+@build_once
+def chat_context() -> ContextWindow:
+    return ContextWindow(
+        model().count_tokens, model().context_tokens, summarize_turns, int(os.environ.get("CHAT_SUMMARY_TOKENS", 512)),
+        model().prompt_overhead
+    )
 
 # Graph Nodes
 @traceable(name="chat_function")
 def chat_function(state: ChatState) -> dict:
-    messages = state["messages"]
+    # The persona (rendered from its registry id), the rolling summary and the most recent turns that fit the budget
+    prompt_id = state.get("prompt") or CHATBOT_PROMPT_ID
+    messages, update = chat_context().fit(
+        prompt_registry.render(prompt_id), state["messages"], state.get("summary", ""), state.get("summarized", 0)
+    )
+    if "prompt" not in state: update["prompt"] = prompt_id
 
-    if len(messages) and not isinstance(messages[0], SystemMessage):
-        system_prompt = SystemMessage(CHATBOT_PROMPT)
-        messages.insert(0, system_prompt)
+    response = model().model.invoke(messages)
+    return {"messages": [response], **update}
 
-    response = model.model.invoke(messages)
-    return {"messages": [response]}
-
-tool_node = ToolNode(model.tools)
+tool_node = timed_tool_node(agent_tools)
 
 
 # Graph
-graph = StateGraph(ChatState)
+@build_once
+def get_chatbot() -> CompiledStateGraph:
+    graph = StateGraph(ChatState)
+
+    graph.add_node("chat_node", chat_function)
+    graph.add_node("tools", tool_node)
 
-graph.add_node("chat_node", chat_function)
-graph.add_node("tools", tool_node)
+    graph.add_edge(START, "chat_node")
+    graph.add_conditional_edges("chat_node", tools_condition)
+    graph.add_edge("tools", "chat_node")
 
-graph.add_edge(START, "chat_node")
-graph.add_conditional_edges("chat_node", tools_condition)
-graph.add_edge("tools", "chat_node")
+    return graph.compile(Storage("database").storage)
 
-chatbot = graph.compile(Storage("database").storage)
+def __getattr__(name: str):
+    # Keeps `from backend.chat_server import chatbot` working, building the graph only when it is asked for
+    if name == "chatbot": return get_chatbot()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,855 @@
+import asyncio, copy, functools, hashlib, json, queue, threading, warnings, weakref
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+import torch
+from transformers import DynamicCache, LogitsProcessor, StoppingCriteria
+
+
+# CPU Inference
+def configure_threads(num_threads: int) -> None:
+    # Each worker process gets its own share of the cores instead of every process claiming all of them
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(max(1, num_threads // 2))
+    except RuntimeError:
+        pass  # Only settable before the first inter-op parallel work in this process
+
+def quantize_int8(client: torch.nn.Module) -> torch.nn.Module:
+    # Linear weights are stored as int8 and activations are quantized on the fly, which suits memory-bound CPU decoding
+    return torch.ao.quantization.quantize_dynamic(client, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def compile_forward(client: torch.nn.Module, warm_up: Callable[[], Any]) -> bool:
+    # Compilation happens lazily on the first call, so run it now and keep the eager forward if the backend fails
+    eager_forward = client.forward
+    client.forward = torch.compile(eager_forward, dynamic=True)
+
+    try:
+        warm_up()
+        return True
+    except Exception as error:
+        client.forward = eager_forward
+        warnings.warn(f"torch.compile failed, falling back to eager mode: {error}")
+        return False
+
+
+# Streaming
+class GenerationThread(threading.Thread):
+    # Runs `generate` off the caller's thread; a failure still ends the streamer so consumers never hang
+    def __init__(self, target: Callable, *args: Any, streamer: Any, **kwargs: Any) -> None:
+        super().__init__(daemon=True)
+        self._generation = functools.partial(target, *args, streamer=streamer, **kwargs)
+        self._streamer = streamer
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+    def run(self) -> None:
+        try:
+            self.result = self._generation()
+        except BaseException as error:
+            self.error = error
+            self._streamer.end()
+
+    def join(self, timeout: Optional[float] = None) -> Any:
+        super().join(timeout)
+        if self.error: raise self.error
+        return self.result
+
+
+class CancelledCriteria(StoppingCriteria):
+    # Lets another thread stop a running generation at its next token
+    def __init__(self, cancelled: threading.Event) -> None:
+        self.cancelled = cancelled
+
+    def __call__(self, input_ids: torch.LongTensor, scores: Optional[torch.FloatTensor], **kwargs: Any) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.cancelled.is_set(), device=input_ids.device)
+
+
+class TextStoppingCriteria(StoppingCriteria):
+    # Stops once the text generated after the prompt satisfies `is_finished` (a stop sequence, a closed tool call, ...)
+    def __init__(self, tokenizer: Any, prompt_length: int, is_finished: Callable[[str], bool]) -> None:
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.is_finished = is_finished
+
+    def __call__(self, input_ids: torch.LongTensor, scores: Optional[torch.FloatTensor], **kwargs: Any) -> torch.BoolTensor:
+        return torch.tensor([
+            self.is_finished(self.tokenizer.decode(row[self.prompt_length:], skip_special_tokens=True)) for row in input_ids
+        ], device=input_ids.device)
+
+
+# Async Admission
+class GenerationRejected(RuntimeError):
+    pass
+
+class GenerationExecutor:
+    """
+    Runs blocking generations for async callers on a dedicated pool. At most `max_in_flight` run at once, at most
+    `max_queued` wait for a slot and none waits longer than `queue_timeout` seconds; anything beyond that is rejected
+    instead of piling up. Cancelling the awaiting task sets the generation's cancel event so it stops at its next token.
+    """
+
+    def __init__(self, max_in_flight: int, max_queued: int, queue_timeout: float) -> None:
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.completed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self._in_flight = 0
+        self._waiters: deque[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_in_flight, thread_name_prefix="generation")
+
+    async def _acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        with self._lock:
+            if self._in_flight < self.max_in_flight and not self._waiters:
+                self._in_flight += 1
+                return
+            if len(self._waiters) >= self.max_queued:
+                self.rejected += 1
+                raise GenerationRejected(f"Generation queue is full ({self.max_queued} waiting)")
+
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(waiter[1], self.queue_timeout)
+        except (TimeoutError, asyncio.CancelledError) as error:
+            # A waiter no longer queued was already handed a slot, even if the wake-up lost the race
+            with self._lock:
+                queued = waiter in self._waiters
+                if queued: self._waiters.remove(waiter)
+                if queued and isinstance(error, TimeoutError): self.rejected += 1
+
+            if isinstance(error, asyncio.CancelledError):
+                if not queued: self._release()
+                raise
+            if queued: raise GenerationRejected(f"No generation slot within {self.queue_timeout}s") from None
+
+    def _release(self, *_: Any) -> None:
+        with self._lock:
+            while self._waiters:
+                loop, waiter = self._waiters.popleft()
+                try:
+                    loop.call_soon_threadsafe(lambda: waiter.done() or waiter.set_result(None))
+                    return
+                except RuntimeError:
+                    continue
+
+            self._in_flight -= 1
+
+    async def run(self, function: Callable[[], Any], cancelled: threading.Event) -> Any:
+        await self._acquire()
+        future = self._pool.submit(function)
+        future.add_done_callback(self._release)
+
+        try:
+            result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            cancelled.set()
+            with self._lock: self.cancelled += 1
+            raise
+
+        with self._lock: self.completed += 1
+        return result
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "queued": len(self._waiters),
+                "max_in_flight": self.max_in_flight,
+                "max_queued": self.max_queued,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "cancelled": self.cancelled
+            }
+
+
+# Prefix KV-Cache
+def cache_nbytes(past_key_values: DynamicCache) -> int:
+    return sum(layer.keys.nbytes + layer.values.nbytes for layer in past_key_values.layers if layer.keys is not None)
+
+class PrefixCache:
+    """LRU store of `past_key_values` for stable prompt prefixes, bounded by a memory budget."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[DynamicCache, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(input_ids: torch.Tensor, length: int) -> str:
+        return hashlib.blake2b(input_ids[0, :length].cpu().numpy().tobytes(), digest_size=16).hexdigest()
+
+    def lookup(self, input_ids: torch.Tensor, boundaries: list[int]) -> tuple[int, Optional[DynamicCache]]:
+        # Returns the longest cached prefix and a private copy of its cache that `generate` may extend in place
+        if self.max_bytes <= 0: return 0, None
+
+        with self._lock:
+            for boundary in sorted(set(boundaries), reverse=True):
+                key = self._key(input_ids, boundary)
+
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return boundary, copy.deepcopy(self._entries[key][0])
+
+            self.misses += 1
+
+        return 0, DynamicCache()
+
+    def store(self, input_ids: torch.Tensor, boundaries: list[int], past_key_values: Optional[DynamicCache]) -> None:
+        if past_key_values is None or self.max_bytes <= 0: return
+        cached_length = past_key_values.get_seq_length()
+
+        for boundary in sorted(set(boundaries)):
+            if boundary <= 0 or boundary > cached_length: continue
+            key = self._key(input_ids, boundary)
+
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    continue
+
+            prefix = copy.deepcopy(past_key_values)
+            prefix.crop(boundary)
+            size = cache_nbytes(prefix)
+            if size > self.max_bytes: continue
+
+            with self._lock:
+                if key in self._entries: continue
+                self._entries[key] = (prefix, size)
+                self.used_bytes += size
+
+                while self.used_bytes > self.max_bytes:
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self.used_bytes -= evicted_size
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "used_bytes": self.used_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+
+# Speculative Decoding
+class SpeculativeCounter(StoppingCriteria):
+    """
+    Counts one generation's drafted tokens and verifying passes, without hooks on the modules other sessions share.
+    Assisted decoding checks the stopping criteria twice a round: on the draft's candidates, then on the tokens the
+    target model kept from its single verifying forward pass.
+    """
+    def __init__(self, prompt_length: int) -> None:
+        self.length = prompt_length
+        self.drafted_tokens = 0
+        self.target_forward_passes = 0
+        self._candidates = True
+
+    def __call__(self, input_ids: torch.LongTensor, scores: Optional[torch.FloatTensor], **kwargs: Any) -> torch.BoolTensor:
+        if self._candidates:
+            self.drafted_tokens += input_ids.shape[1] - self.length
+        else:
+            self.target_forward_passes += 1
+            self.length = input_ids.shape[1]
+        self._candidates = not self._candidates
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+class SpeculativeStats:
+    """
+    Acceptance of draft tokens, derived from each generation's counts: every target pass verifies one round of
+    proposals and contributes one token of its own, so the rest of the output was accepted.
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.generated_tokens = 0
+        self.drafted_tokens = 0
+        self.accepted_tokens = 0
+        self.target_forward_passes = 0
+        self._lock = threading.Lock()
+
+    def record(self, generated_tokens: int, target_forward_passes: int, drafted_tokens: int) -> dict[str, Any]:
+        accepted_tokens = min(max(generated_tokens - target_forward_passes, 0), drafted_tokens)
+
+        with self._lock:
+            self.calls += 1
+            self.generated_tokens += generated_tokens
+            self.drafted_tokens += drafted_tokens
+            self.accepted_tokens += accepted_tokens
+            self.target_forward_passes += target_forward_passes
+
+        return {
+            "generated_tokens": generated_tokens,
+            "drafted_tokens": drafted_tokens,
+            "accepted_tokens": accepted_tokens,
+            "target_forward_passes": target_forward_passes,
+            "acceptance_rate": accepted_tokens / drafted_tokens if drafted_tokens else 0.0
+        }
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "generated_tokens": self.generated_tokens,
+                "drafted_tokens": self.drafted_tokens,
+                "accepted_tokens": self.accepted_tokens,
+                "acceptance_rate": self.accepted_tokens / self.drafted_tokens if self.drafted_tokens else 0.0,
+                "tokens_per_target_pass": (
+                    self.generated_tokens / self.target_forward_passes if self.target_forward_passes else 0.0
+                )
+            }
+
+
+# Continuous Batching
+def eos_token_ids(client: Any, tokenizer: Any) -> set[int]:
+    token_ids = client.generation_config.eos_token_id
+    if not isinstance(token_ids, list): token_ids = [token_ids]
+    return {token for token in token_ids + [tokenizer.eos_token_id] if token is not None}
+
+class GenerationRequest:
+    def __init__(
+        self, input_ids: torch.Tensor, max_new_tokens: int, streamer: Any = None, logits_processor: Any = None,
+        stopping_criteria: Any = None
+    ) -> None:
+        self.input_ids = input_ids[0]
+        self.max_new_tokens = max_new_tokens
+        self.streamer = streamer
+        self.logits_processor = logits_processor
+        self.stopping_criteria = stopping_criteria
+        self.generated: list[int] = []
+        self.future: Future = Future()
+
+    def sequence(self) -> torch.Tensor:
+        generated = torch.tensor(self.generated, dtype=self.input_ids.dtype, device=self.input_ids.device)
+        return torch.cat([self.input_ids, generated]).unsqueeze(0)
+
+    def is_stopped(self) -> bool:
+        if self.stopping_criteria is None: return False
+        return bool(self.stopping_criteria(self.sequence(), None).all())
+
+class BatchScheduler:
+    """
+    Shares one model between concurrent callers. Requests are admitted between decode steps, prefilled together
+    (left padded with an attention mask) and merged into the running batch, so one forward pass decodes a token for
+    every active request. Decoding is greedy.
+    """
+
+    _schedulers: "weakref.WeakKeyDictionary[Any, BatchScheduler]" = weakref.WeakKeyDictionary()
+    _schedulers_lock = threading.Lock()
+
+    def __init__(self, client: Any, max_batch_size: int, pad_token_id: int, eos_token_ids: set[int]) -> None:
+        self.client = client
+        self.max_batch_size = max_batch_size
+        self.pad_token_id = pad_token_id
+        self.eos_token_ids = eos_token_ids
+        self.steps = 0
+        self.decoded_rows = 0
+        self.completed = 0
+        self._queue: queue.Queue[GenerationRequest] = queue.Queue()
+        self._active: list[GenerationRequest] = []
+        self._cache: Optional[DynamicCache] = None
+        self._attention_mask: Optional[torch.Tensor] = None
+        self._positions: Optional[torch.Tensor] = None
+        self._next_tokens: Optional[torch.Tensor] = None
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    @classmethod
+    def for_model(cls, client: Any, tokenizer: Any, max_batch_size: int) -> "BatchScheduler":
+        # One scheduler per set of weights, shared by every LocalModel using them
+        with cls._schedulers_lock:
+            if client not in cls._schedulers:
+                eos_ids = eos_token_ids(client, tokenizer)
+                pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else min(eos_ids)
+                cls._schedulers[client] = cls(client, max_batch_size, pad_token_id, eos_ids)
+
+            return cls._schedulers[client]
+
+    def submit(self, input_ids: torch.Tensor, max_new_tokens: int, streamer: Any = None, **kwargs: Any) -> Future:
+        request = GenerationRequest(input_ids, max_new_tokens, streamer, **kwargs)
+        self._queue.put(request)
+        return request.future
+
+    def generate(self, input_ids: torch.Tensor, max_new_tokens: int, streamer: Any = None, **kwargs: Any) -> torch.Tensor:
+        return self.submit(input_ids, max_new_tokens, streamer, **kwargs).result()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "batch_size": len(self._active),
+            "max_batch_size": self.max_batch_size,
+            "steps": self.steps,
+            "average_batch_size": self.decoded_rows / self.steps if self.steps else 0.0,
+            "completed": self.completed
+        }
+
+    def _run(self) -> None:
+        while True:
+            admitted = []
+
+            try:
+                # Block only while idle, otherwise pick up whatever arrived during the last decode step
+                if not self._active: admitted.append(self._queue.get())
+                while len(self._active) + len(admitted) < self.max_batch_size:
+                    admitted.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            try:
+                with torch.no_grad():
+                    if admitted: self._prefill(admitted)
+                    if self._active: self._decode()
+            except BaseException as error:
+                for request in self._active + [request for request in admitted if request not in self._active]:
+                    if request.streamer: request.streamer.end()
+                    if not request.future.done(): request.future.set_exception(error)
+                self._active, self._cache = [], None
+
+    def _prefill(self, requests: list[GenerationRequest]) -> None:
+        length = max(len(request.input_ids) for request in requests)
+        device = requests[0].input_ids.device
+        input_ids = torch.full((len(requests), length), self.pad_token_id, dtype=torch.long, device=device)
+        attention_mask = torch.zeros((len(requests), length), dtype=torch.long, device=device)
+
+        for row, request in enumerate(requests):
+            input_ids[row, length - len(request.input_ids):] = request.input_ids
+            attention_mask[row, length - len(request.input_ids):] = 1
+            if request.streamer: request.streamer.put(request.input_ids.unsqueeze(0).cpu())
+
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+        cache = DynamicCache()
+        output = self.client(
+            input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids, past_key_values=cache,
+            use_cache=True
+        )
+        next_tokens = self._select(requests, output.logits[:, -1, :])
+        self._merge(requests, cache, attention_mask, attention_mask.sum(-1), next_tokens)
+        self._emit(next_tokens[-len(requests):], len(self._active) - len(requests))
+
+    def _decode(self) -> None:
+        self._attention_mask = torch.cat([self._attention_mask, self._attention_mask.new_ones((len(self._active), 1))], 1)
+        output = self.client(
+            input_ids=self._next_tokens.unsqueeze(-1), attention_mask=self._attention_mask,
+            position_ids=self._positions.unsqueeze(-1), past_key_values=self._cache, use_cache=True
+        )
+        self._positions = self._positions + 1
+        self._next_tokens = self._select(self._active, output.logits[:, -1, :])
+        self.steps += 1
+        self.decoded_rows += len(self._active)
+        self._emit(self._next_tokens, 0)
+
+    @staticmethod
+    def _select(requests: list[GenerationRequest], scores: torch.Tensor) -> torch.Tensor:
+        # Each request may bring its own logits processor (e.g. constrained decoding); it only sees its own row
+        for row, request in enumerate(requests):
+            if request.logits_processor is None: continue
+            scores[row] = request.logits_processor(request.sequence(), scores[row:row + 1])[0]
+        return scores.argmax(-1)
+
+    def _merge(
+        self, requests: list[GenerationRequest], cache: DynamicCache, attention_mask: torch.Tensor,
+        positions: torch.Tensor, next_tokens: torch.Tensor
+    ) -> None:
+        if not self._active:
+            self._active, self._cache, self._attention_mask = list(requests), cache, attention_mask
+            self._positions, self._next_tokens = positions, next_tokens
+            return
+
+        # Left pad the shorter of the two batches so both share one sequence axis, then stack them
+        length = max(self._attention_mask.shape[1], attention_mask.shape[1])
+        pad = lambda tensor, dim: torch.nn.functional.pad(tensor, (0, 0) * dim + (length - tensor.shape[-dim - 1], 0))
+
+        for active_layer, new_layer in zip(self._cache.layers, cache.layers):
+            active_layer.keys = torch.cat([pad(active_layer.keys, 1), pad(new_layer.keys, 1)])
+            active_layer.values = torch.cat([pad(active_layer.values, 1), pad(new_layer.values, 1)])
+
+        self._attention_mask = torch.cat([pad(self._attention_mask, 0), pad(attention_mask, 0)])
+        self._positions = torch.cat([self._positions, positions])
+        self._next_tokens = torch.cat([self._next_tokens, next_tokens])
+        self._active.extend(requests)
+
+    def _emit(self, tokens: torch.Tensor, offset: int) -> None:
+        for row, token in enumerate(tokens.tolist(), offset):
+            request = self._active[row]
+            request.generated.append(token)
+            if request.streamer: request.streamer.put(torch.tensor([token]))
+
+        finished = [
+            row for row, request in enumerate(self._active)
+            if request.generated and (
+                request.generated[-1] in self.eos_token_ids or len(request.generated) >= request.max_new_tokens
+                or request.is_stopped()
+            )
+        ]
+        if not finished: return
+
+        for row in finished:
+            request = self._active[row]
+            if request.streamer: request.streamer.end()
+            request.future.set_result(request.sequence())
+            self.completed += 1
+
+        keep = [row for row in range(len(self._active)) if row not in finished]
+        self._active = [self._active[row] for row in keep]
+        if not self._active:
+            self._cache = None
+            return
+
+        keep = torch.tensor(keep, device=self._attention_mask.device)
+        self._cache.batch_select_indices(keep)
+        self._attention_mask = self._attention_mask[keep]
+        self._positions = self._positions[keep]
+        self._next_tokens = self._next_tokens[keep]
+
+        # Drop padding columns no remaining request attends to
+        start = int((self._attention_mask.sum(0) > 0).nonzero()[0])
+        if start:
+            self._attention_mask = self._attention_mask[:, start:]
+            for layer in self._cache.layers:
+                layer.keys = layer.keys[:, :, start:, :]
+                layer.values = layer.values[:, :, start:, :]
+
+
+# Constrained Decoding
+class JsonSchemaConstraint:
+    """
+    Character level automaton accepting the compact JSON serialisation of a JSON schema: properties in declared order,
+    `": "` and `", "` separators and no other whitespace. States are immutable tuples so candidates can be tried freely.
+    """
+
+    def __init__(self, schema: dict) -> None:
+        self.definitions = schema.get("$defs", {})
+        self._nodes: dict[str, tuple] = {}
+        self.root = self._compile(schema)
+
+    def _compile(self, schema: dict) -> tuple:
+        if "$ref" in schema: return ("ref", schema["$ref"].split("/")[-1])
+        if "const" in schema: return ("alts", (json.dumps(schema["const"]),))
+        if "enum" in schema: return ("alts", tuple(json.dumps(value) for value in schema["enum"]))
+        for key in ("anyOf", "oneOf"):
+            if key in schema: return ("union", tuple(self._compile(option) for option in schema[key]))
+
+        schema_type = schema.get("type")
+        if isinstance(schema_type, list):
+            return ("union", tuple(self._compile({**schema, "type": option}) for option in schema_type))
+
+        if schema_type == "object" and schema.get("properties"):
+            items = []
+            for index, (name, value) in enumerate(schema["properties"].items()):
+                items += [("{" if index == 0 else ", ") + json.dumps(name) + ": ", self._compile(value)]
+            return ("seq", tuple(items + ["}"]))
+
+        if schema_type == "array": return ("array", self._compile(schema.get("items", {})))
+        if schema_type == "string": return ("string",)
+        if schema_type in ("integer", "number"): return ("number", schema_type == "integer")
+        if schema_type == "boolean": return ("alts", ("true", "false"))
+        if schema_type == "null": return ("alts", ("null",))
+        return ("any",)
+
+    def _resolve(self, name: str) -> tuple:
+        # References compile on first use so recursive schemas stay finite
+        if name not in self._nodes: self._nodes[name] = self._compile(self.definitions[name])
+        return self._nodes[name]
+
+    def initial_state(self) -> tuple:
+        return self._enter((), self.root)
+
+    def is_complete(self, state: tuple) -> bool:
+        return state == ()
+
+    def minimal_text(self, node: tuple) -> str:
+        # Shortest serialisation of a node, used to close the document when the token budget runs out
+        kind = node[0]
+        if kind == "ref": return self.minimal_text(self._resolve(node[1]))
+        if kind == "seq": return "".join(item if isinstance(item, str) else self.minimal_text(item) for item in node[1])
+        if kind == "array": return "[]"
+        if kind == "string": return '""'
+        if kind == "number": return "0"
+        if kind == "alts": return min(node[1], key=len)
+        if kind == "union": return min((self.minimal_text(option) for option in node[1]), key=len)
+        return "null"
+
+    def closing_text(self, state: tuple) -> str:
+        text = ""
+
+        for frame in reversed(state):
+            kind = frame[0]
+            if kind == "literal": text += frame[1][frame[2]:]
+            elif kind == "seq": text += self.minimal_text(("seq", frame[1][frame[2] + 1:]))
+            elif kind == "string": text += ('""', '"', 'n"', '0000"', '000"', '00"', '0"')[frame[1]]
+            elif kind == "number": text += "" if frame[2] in (2, 3, 5, 8) else "0"
+            elif kind == "alts": text += min((option[frame[2]:] for option in frame[1]), key=len)
+            elif kind == "array":
+                text += {"open": "[]", "comma": " " + self.minimal_text(frame[1]) + "]"}.get(frame[2], "]")
+            elif kind == "object": text += {"open": "{}", "key": ": null}", "comma": ' "": null}'}.get(frame[1], "}")
+            else: text += self.minimal_text(frame)
+
+        return text
+
+    def advance(self, state: Optional[tuple], text: str) -> Optional[tuple]:
+        for character in text:
+            if state is None: return None
+            state = self._feed(state, character)
+        return state
+
+    def _enter(self, stack: tuple, node: tuple) -> tuple:
+        kind = node[0]
+        if kind == "ref": return self._enter(stack, self._resolve(node[1]))
+        if kind == "seq": return self._enter_item(stack, node[1], 0)
+        if kind == "array": return stack + (("array", node[1], "open"),)
+        if kind == "string": return stack + (("string", 0),)
+        if kind == "number": return stack + (("number", node[1], 0),)
+        if kind == "alts": return stack + (("alts", node[1], 0),)
+        return stack + (node,)
+
+    def _enter_item(self, stack: tuple, items: tuple, index: int) -> tuple:
+        stack = stack + (("seq", items, index),)
+        item = items[index]
+        return stack + (("literal", item, 0),) if isinstance(item, str) else self._enter(stack, item)
+
+    def _complete(self, stack: tuple) -> tuple:
+        # The top frame finished, so let its parent move on
+        if not stack: return stack
+        frame, rest = stack[-1], stack[:-1]
+
+        if frame[0] == "seq":
+            _, items, index = frame
+            return self._complete(rest) if index + 1 == len(items) else self._enter_item(rest, items, index + 1)
+        if frame[0] == "array": return rest + (("array", frame[1], "after"),)
+        if frame[0] == "object" and frame[1] == "key":
+            return self._enter(rest + (("object", "value"),), ("seq", (": ", ("any",))))
+        if frame[0] == "object": return rest + (("object", "after"),)
+        return self._complete(rest)
+
+    def _feed(self, stack: tuple, character: str) -> Optional[tuple]:
+        while stack:
+            frame, rest = stack[-1], stack[:-1]
+            kind = frame[0]
+
+            if kind == "literal":
+                _, text, position = frame
+                if text[position] != character: return None
+                if position + 1 == len(text): return self._complete(rest)
+                return rest + (("literal", text, position + 1),)
+
+            if kind == "string":
+                stage = frame[1]
+                if stage == 0: return rest + (("string", 1),) if character == '"' else None
+                if stage == 1:
+                    if character == '"': return self._complete(rest)
+                    if character == "\\": return rest + (("string", 2),)
+                    return None if ord(character) < 0x20 else stack
+                if stage == 2:
+                    if character == "u": return rest + (("string", 3),)
+                    return rest + (("string", 1),) if character in '"\\/bfnrt' else None
+                if character not in "0123456789abcdefABCDEF": return None
+                return rest + (("string", 1 if stage == 6 else stage + 1),)
+
+            if kind == "number":
+                next_stage = self._number_stage(frame[2], character, frame[1])
+                if next_stage is not None: return rest + (("number", frame[1], next_stage),)
+                # A number only ends when a character that cannot extend it arrives; hand that to the parent
+                if frame[2] not in (2, 3, 5, 8): return None
+                stack = self._complete(rest)
+                continue
+
+            if kind == "alts":
+                _, options, position = frame
+                options = tuple(option for option in options if len(option) > position and option[position] == character)
+                if not options: return None
+                if all(len(option) == position + 1 for option in options): return self._complete(rest)
+                return rest + (("alts", options, position + 1),)
+
+            if kind == "union":
+                for option in frame[1]:
+                    state = self._feed(self._enter(rest, option), character)
+                    if state is not None: return state
+                return None
+
+            if kind == "any":
+                if character == "{": stack = rest + (("object", "open"),)
+                elif character == "[": stack = rest + (("array", ("any",), "open"),)
+                elif character == '"': stack = self._enter(rest, ("string",))
+                elif character == "-" or character.isdigit(): stack = self._enter(rest, ("number", False))
+                else: stack = self._enter(rest, ("alts", ("true", "false", "null")))
+                continue
+
+            if kind == "array":
+                _, item, phase = frame
+                if phase == "open": return rest + (("array", item, "first"),) if character == "[" else None
+                if phase == "first":
+                    if character == "]": return self._complete(rest)
+                    stack = self._enter(rest + (("array", item, "item"),), item)
+                    continue
+                if phase == "after":
+                    if character == "]": return self._complete(rest)
+                    return rest + (("array", item, "comma"),) if character == "," else None
+                if phase == "comma" and character == " ": return self._enter(rest + (("array", item, "item"),), item)
+                return None
+
+            if kind == "object":
+                phase = frame[1]
+                if phase == "open": return rest + (("object", "first"),) if character == "{" else None
+                if phase == "first":
+                    if character == "}": return self._complete(rest)
+                    stack = self._enter(rest + (("object", "key"),), ("string",))
+                    continue
+                if phase == "after":
+                    if character == "}": return self._complete(rest)
+                    return rest + (("object", "comma"),) if character == "," else None
+                if phase == "comma" and character == " ": return self._enter(rest + (("object", "key"),), ("string",))
+                return None
+
+            return None
+
+        # The root value is closed, nothing may follow it
+        return None
+
+    @staticmethod
+    def _number_stage(stage: int, character: str, integer: bool) -> Optional[int]:
+        # -? (0 | [1-9][0-9]*) (. [0-9]+)? ([eE] [+-]? [0-9]+)?
+        digit = character.isdigit() and character.isascii()
+        if stage in (0, 1) and character == "0": return 3
+        if stage in (0, 1) and digit: return 2
+        if stage == 0 and character == "-": return 1
+        if stage in (2, 4, 5, 6, 7, 8) and digit: return {2: 2, 4: 5, 5: 5, 6: 8, 7: 8, 8: 8}[stage]
+        if integer: return None
+        if stage in (2, 3) and character == ".": return 4
+        if stage in (2, 3, 5) and character in "eE": return 6
+        if stage == 6 and character in "+-": return 7
+        return None
+
+
+class JsonSchemaLogitsProcessor(LogitsProcessor):
+    """
+    Masks every token that cannot extend the output towards a document accepted by a `JsonSchemaConstraint`. The
+    `top_k` highest scoring candidates are checked first and the search widens fourfold until a token fits, so the
+    usual step costs little however large the vocabulary. When the remaining token budget only just covers the shortest
+    way to close the document, the output is steered to close it. Once the root object closes, only end-of-sequence
+    tokens remain. If no token in the whole vocabulary fits, the row is released to decode unconstrained (with a warning),
+    so the caller's parser reports the invalid output rather than receiving a document cut short by end-of-sequence.
+    """
+
+    _token_texts: "weakref.WeakKeyDictionary[Any, dict[int, str]]" = weakref.WeakKeyDictionary()
+
+    def __init__(
+        self, constraint: JsonSchemaConstraint, tokenizer: Any, eos_token_ids: set[int], max_new_tokens: int,
+        top_k: int = 16
+    ) -> None:
+        self.constraint = constraint
+        self.tokenizer = tokenizer
+        self.eos_token_ids = eos_token_ids
+        self.max_new_tokens = max_new_tokens
+        self.top_k = top_k
+        self.special_token_ids = set(tokenizer.all_special_ids)
+        self.states: Optional[list[Optional[tuple]]] = None
+        self.prompt_length = 0
+        self.consumed = 0
+        self._tokens: list[list[int]] = []
+        self._history: list[list[Optional[tuple]]] = []
+        # Rows whose document no token could continue, they decode without the constraint from then on
+        self.released: set[int] = set()
+
+        if tokenizer not in self._token_texts: self._token_texts[tokenizer] = {}
+        self.texts = self._token_texts[tokenizer]
+        self.anchor_ids = tokenizer.encode("a", add_special_tokens=False)[-1:]
+        self.anchor = tokenizer.decode(self.anchor_ids)
+
+    def token_text(self, token: int) -> str:
+        # Decode after an anchor so tokenizers that strip a leading space on their own still report it
+        if token not in self.texts:
+            self.texts[token] = self.tokenizer.decode(self.anchor_ids + [token])[len(self.anchor):]
+        return self.texts[token]
+
+    def sync(self, input_ids: torch.LongTensor) -> None:
+        if self.states is None:
+            self.prompt_length = input_ids.shape[1]
+            self._tokens = [[] for _ in range(input_ids.shape[0])]
+            self._history = [[self.constraint.initial_state()] for _ in range(input_ids.shape[0])]
+
+        # Speculative decoding scores candidates that may be rejected, so rewind to the longest common prefix first
+        for row, tokens in enumerate(input_ids[:, self.prompt_length:].tolist()):
+            known, history = self._tokens[row], self._history[row]
+            common = 0
+            while common < min(len(known), len(tokens)) and known[common] == tokens[common]: common += 1
+            del known[common:], history[common + 1:]
+
+            for token in tokens[common:]:
+                state = history[-1]
+                if token not in self.eos_token_ids and state is not None:
+                    state = self.constraint.advance(state, self.token_text(token))
+                known.append(token)
+                history.append(state)
+
+        self.states = [history[-1] for history in self._history]
+        self.consumed = input_ids.shape[1] - self.prompt_length
+
+    def is_complete(self, row: int) -> bool:
+        return self.states is not None and self.states[row] is not None and self.constraint.is_complete(self.states[row])
+
+    def _allowed(self, state: Optional[tuple], scores: torch.FloatTensor) -> Optional[list[int]]:
+        if state is None or self.constraint.is_complete(state): return sorted(self.eos_token_ids)
+        closing = self.constraint.closing_text(state)
+        closing = closing if self.max_new_tokens - self.consumed <= len(closing) else None
+        ranked, start, end = torch.argsort(scores, descending=True).tolist(), 0, self.top_k
+        allowed = []
+
+        while not allowed and start < len(ranked):
+            for token in ranked[start:end]:
+                if token in self.special_token_ids or token in self.eos_token_ids: continue
+                text = self.token_text(token)
+                if not text or "�" in text: continue
+                if closing is not None:
+                    if closing.startswith(text): allowed.append(token)
+                elif self.constraint.advance(state, text) is not None:
+                    allowed.append(token)
+            start, end = end, end * 4
+
+        return allowed or None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        self.sync(input_ids)
+        masked = torch.full_like(scores, float("-inf"))
+
+        for row, state in enumerate(self.states):
+            allowed = None if row in self.released else self._allowed(state, scores[row])
+            if allowed is None:
+                if row not in self.released:
+                    warnings.warn(
+                        f"No token continues the JSON document after {self.consumed} tokens, decoding unconstrained"
+                    )
+                    self.released.add(row)
+                masked[row] = scores[row]
+                continue
+            allowed = torch.tensor(allowed, device=scores.device)
+            masked[row, allowed] = scores[row, allowed]
+
+        return masked
+
+
+class JsonCompleteCriteria(StoppingCriteria):
+    # Ends generation on the token that closes the root object instead of waiting for an end-of-sequence token
+    def __init__(self, processor: JsonSchemaLogitsProcessor) -> None:
+        self.processor = processor
+
+    def __call__(self, input_ids: torch.LongTensor, scores: Optional[torch.FloatTensor], **kwargs: Any) -> torch.BoolTensor:
+        self.processor.sync(input_ids)
+        return torch.tensor(
+            [self.processor.is_complete(row) for row in range(input_ids.shape[0])], device=input_ids.device
+        )
@@ -1,108 +1,390 @@
-import os, uuid, json, torch, re
-from typing import Any, Optional, List, Sequence
-from .tools import search_internet, generate_csv_tool, generate_pdf_tool
+import os, uuid, json, torch, re, asyncio, threading, functools, tiktoken
+from operator import itemgetter
+from typing import Any, Callable, Optional, List, Sequence, Iterator, AsyncIterator
+from .tools import agent_tools
+from .inference import (
+    PrefixCache, GenerationThread, BatchScheduler, JsonSchemaConstraint, JsonSchemaLogitsProcessor,
+    JsonCompleteCriteria, SpeculativeCounter, SpeculativeStats, GenerationExecutor, CancelledCriteria, TextStoppingCriteria,
+    eos_token_ids, configure_threads, quantize_int8, compile_forward
+)
 from pydantic import BaseModel, Field
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import (
+    AutoModelForCausalLM, AutoTokenizer, TextIteratorStreamer, AsyncTextIteratorStreamer, LogitsProcessorList,
+    StoppingCriteriaList
+)
 from langchain_openai.chat_models import ChatOpenAI
 from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
 from langchain_core.language_models.chat_models import BaseChatModel
-from langchain_core.runnables import RunnableConfig, Runnable
-from langchain_core.messages import AIMessage, BaseMessage, ToolCall
+from langchain_core.runnables import RunnableConfig, Runnable, RunnableMap, RunnablePassthrough
+from langchain_core.output_parsers import JsonOutputParser, PydanticOutputParser
+from langchain_core.output_parsers.openai_tools import JsonOutputKeyToolsParser, PydanticToolsParser
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolCall
+from langchain_core.messages.tool import tool_call_chunk
 from langchain_core.language_models import LanguageModelInput
-from langchain_core.outputs import ChatResult, ChatGeneration
+from langchain_core.outputs import ChatResult, ChatGeneration, ChatGenerationChunk
 from langchain_core.utils.function_calling import convert_to_openai_tool
 from langchain_core.tools import BaseTool
 
 
+def default_device() -> str:
+    return "mps" if torch.backends.mps.is_available() else "cpu"
+
+
 class LocalModel(BaseChatModel):
     client: Any = Field(default=None, exclude=True)
     tokenizer: Any = Field(default=None, exclude=True)
     fine_tune: bool = Field(default=False)
+    prefix_cache: Any = Field(default=None, exclude=True)
+    scheduler: Any = Field(default=None, exclude=True)
+    draft_client: Any = Field(default=None, exclude=True)
+    draft_tokenizer: Any = Field(default=None, exclude=True)
+    speculative_stats: Any = Field(default=None, exclude=True)
+    executor: Any = Field(default=None, exclude=True)
+    constrained_decoding: bool = Field(default=True)
+    max_new_tokens: int = Field(default=256)
+    quantization: Optional[str] = Field(default=None)
+    compiled: bool = Field(default=False)
     DEVICE: torch.device = Field(default="cpu", exclude=True)
 
-    def __init__(self, model: str, fine_tune: bool = False) -> None:
+    def __init__(
+        self, model: str, fine_tune: bool = False, dtype: Optional[str] = None, device: Optional[str] = None,
+        draft_model: Optional[str] = None
+    ) -> None:
         super().__init__()
         self.fine_tune = fine_tune
+        self.constrained_decoding = os.environ.get("LLM_CONSTRAINED_DECODING", "true").lower() != "false"
+        self.prefix_cache = PrefixCache(int(os.environ.get("LLM_PREFIX_CACHE_MB", 512)) * 1024 * 1024)
+        self.DEVICE = torch.device(device or default_device())
+
+        # CPU hosts: a per-worker thread budget, int8 weights (loaded as float32 first) and an optional compiled forward
+        if os.environ.get("LLM_NUM_THREADS"): configure_threads(int(os.environ["LLM_NUM_THREADS"]))
+        if self.DEVICE.type == "cpu" and os.environ.get("LLM_QUANTIZATION") == "int8":
+            self.quantization, dtype = "int8", None
+
+        self.tokenizer, self.client = self._load(model, dtype)
 
-        if torch.backends.mps.is_available():
-            self.DEVICE = torch.device("mps")
+        # A small draft model proposes tokens the full model verifies in one pass (greedy output is unchanged)
+        draft_model = draft_model or os.environ.get("LLM_DRAFT_MODEL_NAME")
+        if draft_model and not fine_tune:
+            self.draft_tokenizer, self.draft_client = self._load(draft_model, dtype)
+            self.speculative_stats = SpeculativeStats()
 
+        # Concurrent sessions share batched decode steps instead of queueing whole generations
+        max_batch_size = int(os.environ.get("LLM_MAX_BATCH_SIZE", 1))
+        if max_batch_size > 1 and not fine_tune:
+            self.scheduler = BatchScheduler.for_model(self.client, self.tokenizer, max_batch_size)
+
+        # Async callers run on a bounded pool of their own and are shed once it is saturated
+        self.executor = GenerationExecutor(
+            int(os.environ.get("LLM_MAX_IN_FLIGHT", 2)), int(os.environ.get("LLM_MAX_QUEUED", 16)),
+            float(os.environ.get("LLM_QUEUE_TIMEOUT", 30))
+        )
+    
+    def _load(self, model: str, dtype: Optional[str]) -> tuple[Any, Any]:
         try:
-            self.tokenizer = AutoTokenizer.from_pretrained(model, local_files_only=True)
-            self.client = AutoModelForCausalLM.from_pretrained(model, local_files_only=True).to(self.DEVICE)
+            tokenizer = AutoTokenizer.from_pretrained(model, local_files_only=True)
+            client = AutoModelForCausalLM.from_pretrained(model, local_files_only=True, dtype=dtype).to(self.DEVICE)
         except:
-            self.tokenizer = AutoTokenizer.from_pretrained(model)
-            self.client = AutoModelForCausalLM.from_pretrained(model).to(self.DEVICE)
-    
+            tokenizer = AutoTokenizer.from_pretrained(model)
+            client = AutoModelForCausalLM.from_pretrained(model, dtype=dtype).to(self.DEVICE)
+
+        if self.quantization == "int8": client = quantize_int8(client)
+        if os.environ.get("LLM_COMPILE", "false").lower() == "true":
+            warm_up_ids = tokenizer("Hello", return_tensors="pt")["input_ids"].to(self.DEVICE)
+            with torch.no_grad():
+                compiled = compile_forward(client, lambda: client.generate(warm_up_ids, max_new_tokens=4))
+            if self.client is None: self.compiled = compiled
+
+        return tokenizer, client
+
     @property
     def _llm_type(self) -> str:
         return "local"
 
+    def stats(self) -> dict:
+        return {
+            "prefix_cache": self.prefix_cache.stats(),
+            "scheduler": self.scheduler.stats() if self.scheduler else None,
+            "speculative": self.speculative_stats.stats() if self.speculative_stats else None,
+            "executor": self.executor.stats(),
+            "runtime": {"quantization": self.quantization, "compiled": self.compiled, "threads": torch.get_num_threads()}
+        }
+
     def invoke(
         self, input: LanguageModelInput, config: Optional[RunnableConfig] = None,
         *, stop: Optional[list[str]] = None, **kwargs: Any,
     ) -> AIMessage:
         return super().invoke(input, config, stop=stop, **kwargs)
     
-    def _generate(
-        self,
-        messages: List[BaseMessage],
-        **kwargs: Any,
-    ) -> ChatResult:
-        conversation_context = ""
-        generated_texts_list = []
-        tools_block = {
-            "available_tools": [convert_to_openai_tool(tool) for tool in kwargs.get("tools", [])],
-            "tool_config": kwargs.get("tool_config")
-        }
+    @staticmethod
+    def tools_prompt(tools: Sequence[Any], tool_config: Any = None) -> str:
+        # Appended to every system message, the tool definitions are part of the prompt the model reads
+        tools_json = json.dumps({
+            "available_tools": [convert_to_openai_tool(tool) for tool in tools], "tool_config": tool_config
+        }, indent=2)
+        return f"\n# Available Tools\nYou have access to the following tools. To call a tool, respond with a JSON object inside a ```json code block using this format:\n{{\n\"tool\": \"tool_name\",\n\"parameters\": {{ \"param1\": \"value1\" }}\n}}\n\n## Tool Definitions:\n{tools_json}\n"
+
+    def _build_segments(self, messages: List[BaseMessage], **kwargs: Any) -> List[str]:
+        # One segment per message so that every message boundary is a reusable cache prefix
+        segments = []
+        tools_prompt = self.tools_prompt(kwargs.get("tools", []), kwargs.get("tool_config"))
 
         for message in messages:
             if message.type == "human":
-                conversation_context += f"User: {message.content}\n"
+                segments.append(f"User: {message.content}\n")
             elif message.type == "ai":
-                conversation_context += f"Assistant: {message.content}\n"
+                segments.append(f"Assistant: {message.content}\n")
             elif message.type == "system":
-                conversation_context += f"System: {message.content}\n"
-                tools_json = json.dumps(tools_block, indent=2)
-                conversation_context += f"\n# Available Tools\nYou have access to the following tools. To call a tool, respond with a JSON object inside a ```json code block using this format:\n{{\n\"tool\": \"tool_name\",\n\"parameters\": {{ \"param1\": \"value1\" }}\n}}\n\n## Tool Definitions:\n{tools_json}\n"
+                segments.append(f"System: {message.content}\n{tools_prompt}")
 
-        tokenized_input = self.tokenizer(conversation_context, return_tensors="pt").to(self.DEVICE)
+        # Structured output goes last so the persona and conversation prefixes stay shared with unstructured calls
+        response_format = kwargs.get("response_format")
+        if response_format:
+            segments.append(
+                f"\n# Response Format\nRespond only with a JSON object that matches this JSON schema:\n"
+                f"{json.dumps(response_format['json_schema'])}\n"
+            )
+
+        return segments or [""]
+
+    def _token_budget(self, input_ids: torch.Tensor, max_new_tokens: Optional[int] = None) -> int:
+        # Callers may bind their own budget; it never exceeds what the context window has left after the prompt
+        max_new_tokens = max_new_tokens or self.max_new_tokens
+        context_length = getattr(self.client.config, "max_position_embeddings", None)
+        if isinstance(context_length, int): max_new_tokens = max(1, min(max_new_tokens, context_length - input_ids.shape[1]))
+        return max_new_tokens
+
+    def _is_finished(self, message: str, stop: Optional[List[str]], tools: Optional[list]) -> bool:
+        if stop and any(sequence in message for sequence in stop): return True
+        return bool(tools) and message.count("```") >= 2 and bool(self._parse_tool_calls(message)[0])
+
+    @staticmethod
+    def _truncate(message: str, stop: Optional[List[str]]) -> str:
+        # Stop sequences end the answer and are not part of it
+        for sequence in stop or []:
+            if sequence in message: message = message[:message.index(sequence)]
+        return message
+
+    def _generation_kwargs(
+        self, input_ids: torch.Tensor, cancelled: Optional[threading.Event] = None, stop: Optional[List[str]] = None,
+        **kwargs: Any
+    ) -> dict:
+        generation_kwargs = {"max_new_tokens": self._token_budget(input_ids, kwargs.get("max_new_tokens"))}
+        stopping_criteria = StoppingCriteriaList([CancelledCriteria(cancelled)] if cancelled else [])
+
+        response_format = kwargs.get("response_format")
+        if response_format:
+            processor = JsonSchemaLogitsProcessor(
+                JsonSchemaConstraint(response_format["json_schema"]), self.tokenizer,
+                eos_token_ids(self.client, self.tokenizer), generation_kwargs["max_new_tokens"]
+            )
+            generation_kwargs["logits_processor"] = LogitsProcessorList([processor])
+            stopping_criteria.append(JsonCompleteCriteria(processor))
+
+        # Nothing after a stop sequence or a closed tool call is used, so do not spend decode steps on it
+        tools = None if response_format else kwargs.get("tools")
+        if stop or tools:
+            stopping_criteria.append(TextStoppingCriteria(
+                self.tokenizer, input_ids.shape[1], functools.partial(self._is_finished, stop=stop, tools=tools)
+            ))
+
+        if stopping_criteria: generation_kwargs["stopping_criteria"] = stopping_criteria
+        return generation_kwargs
+
+    def _encode(self, segments: List[str]) -> tuple[torch.Tensor, List[int]]:
+        input_ids = []
+        boundaries = []
+        length = 0
+
+        for index, segment in enumerate(segments):
+            segment_ids = self.tokenizer(segment, return_tensors="pt", add_special_tokens=index == 0)["input_ids"]
+            length += segment_ids.shape[1]
+            input_ids.append(segment_ids)
+            boundaries.append(length)
+
+        return torch.cat(input_ids, dim=1).to(self.DEVICE), boundaries
+
+    def _speculative_kwargs(self, **generate_kwargs: Any) -> dict:
+        if self.draft_client is None: return {}
+        text_config = lambda client: client.config.get_text_config()
+        if text_config(self.client).vocab_size == text_config(self.draft_client).vocab_size:
+            return {"assistant_model": self.draft_client}
+
+        # Constraints track token ids of the target vocabulary, which a draft with its own tokenizer does not share
+        if "logits_processor" in generate_kwargs: return {}
+        return {
+            "assistant_model": self.draft_client, "tokenizer": self.tokenizer, "assistant_tokenizer": self.draft_tokenizer
+        }
+
+    def _run_generation(
+        self, input_ids: torch.Tensor, boundaries: List[int], generation_info: Optional[dict] = None,
+        max_new_tokens: Optional[int] = None, **generate_kwargs: Any
+    ) -> torch.Tensor:
+        max_new_tokens = max_new_tokens or self.max_new_tokens
 
         if self.fine_tune:
+            return self.client.generate(input_ids, max_new_tokens=max_new_tokens, num_return_sequences=1, **generate_kwargs)
+
+        if self.scheduler:
+            return self.scheduler.generate(input_ids, max_new_tokens=max_new_tokens, **generate_kwargs)
+
+        # Reuse the KV-cache of the longest already-seen prefix (persona + tools, then earlier turns)
+        _, past_key_values = self.prefix_cache.lookup(input_ids, boundaries[:-1])
+        speculative_kwargs = self._speculative_kwargs(**generate_kwargs)
+        # Counted per request, concurrent generations share the draft and target modules
+        counter = SpeculativeCounter(input_ids.shape[1]) if speculative_kwargs else None
+        if counter:
+            generate_kwargs["stopping_criteria"] = StoppingCriteriaList([
+                *generate_kwargs.get("stopping_criteria", []), counter
+            ])
+
+        with torch.no_grad():
             llm_response = self.client.generate(
-                tokenized_input["input_ids"], max_new_tokens=256, num_return_sequences=1
+                input_ids, past_key_values=past_key_values, max_new_tokens=max_new_tokens, num_return_sequences=1,
+                **speculative_kwargs, **generate_kwargs
             )
-        else:
-            with torch.no_grad():
-                llm_response = self.client.generate(
-                    tokenized_input["input_ids"], max_new_tokens=256, num_return_sequences=1
-                )
-        
-        input_length = tokenized_input["input_ids"].shape[1]
-        message = self.tokenizer.decode(llm_response[0][input_length:], skip_special_tokens=True)
-        json_match = re.search(r"```json\s*(.*?)\s*```", message, re.DOTALL)
 
-        if json_match:
-            try:
-                data = json.loads(json_match.group(1))
-                tool_call = ToolCall(
-                    name=data["tool"],
-                    args=data["parameters"],
-                    id=str(uuid.uuid4())
-                )
-                generated_texts_list.append(ChatGeneration(
-                    message=AIMessage(content=message, tool_calls=[tool_call]), generation_info={}
-                ))
-            except Exception as e:
-                generated_texts_list.append(
-                    ChatGeneration(message=AIMessage(content=message), generation_info={"error": str(e)})
-                )
-        else:
-            generated_texts_list.append(
-                ChatGeneration(message=AIMessage(content=message, generation_info={}))
+        if speculative_kwargs and generation_info is not None:
+            generation_info["speculative"] = self.speculative_stats.record(
+                llm_response.shape[1] - input_ids.shape[1], counter.target_forward_passes, counter.drafted_tokens
             )
-        
-        return ChatResult(generations=generated_texts_list)
+
+        self.prefix_cache.store(input_ids, [boundaries[0], input_ids.shape[1]], past_key_values)
+        return llm_response
+
+    def _parse_tool_calls(self, message: str) -> tuple[List[ToolCall], dict]:
+        json_match = re.search(r"```json\s*(.*?)\s*```", message, re.DOTALL)
+        if not json_match: return [], {}
+
+        try:
+            data = json.loads(json_match.group(1))
+            return [ToolCall(name=data["tool"], args=data["parameters"], id=str(uuid.uuid4()))], {}
+        except Exception as e:
+            return [], {"error": str(e)}
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        cancelled: Optional[threading.Event] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        input_ids, boundaries = self._encode(self._build_segments(messages, **kwargs))
+        generation_info, generation_kwargs = {}, self._generation_kwargs(input_ids, cancelled, **kwargs)
+        llm_response = self._run_generation(input_ids, boundaries, generation_info, **generation_kwargs)
+        if any(getattr(processor, "released", None) for processor in generation_kwargs.get("logits_processor", [])):
+            generation_info["constraint_released"] = True
+        message = self.tokenizer.decode(llm_response[0][input_ids.shape[1]:], skip_special_tokens=True)
+        message = self._truncate(message, kwargs.get("stop"))
+        tool_calls, parse_info = self._parse_tool_calls(message)
+        generation_info.update(parse_info)
+
+        return ChatResult(generations=[ChatGeneration(
+            message=AIMessage(content=message, tool_calls=tool_calls), generation_info=generation_info
+        )])
+
+    def _releasable(self, message: str, stop: Optional[List[str]]) -> tuple[str, bool]:
+        # Streamed text stops before a stop sequence and holds back a tail that might still turn into one
+        if not stop: return message, False
+        truncated = self._truncate(message, stop)
+        if len(truncated) < len(message): return truncated, True
+        return message[:len(message) - max(len(sequence) for sequence in stop) + 1], False
+
+    def _tool_call_chunk(self, message: str, generation_info: dict) -> ChatGenerationChunk:
+        # The fenced tool call can only be parsed once the whole answer has been streamed
+        tool_calls, parse_info = self._parse_tool_calls(message)
+        generation_info = {**generation_info, **parse_info}
+        tool_call_chunks = [
+            tool_call_chunk(name=tool_call["name"], args=json.dumps(tool_call["args"]), id=tool_call["id"], index=index)
+            for index, tool_call in enumerate(tool_calls)
+        ]
+        return ChatGenerationChunk(
+            message=AIMessageChunk(content="", tool_call_chunks=tool_call_chunks), generation_info=generation_info
+        )
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        input_ids, boundaries = self._encode(self._build_segments(messages, **kwargs))
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        generation_info = {}
+        cancelled = threading.Event()
+        worker = GenerationThread(
+            self._run_generation, input_ids, boundaries, generation_info, streamer=streamer,
+            **self._generation_kwargs(input_ids, cancelled, stop, **kwargs)
+        )
+        worker.start()
+        message, emitted = "", 0
+
+        try:
+            for text in streamer:
+                if not text: continue
+                message += text
+                released, stopped = self._releasable(message, stop)
+                if len(released) > emitted: yield ChatGenerationChunk(message=AIMessageChunk(content=released[emitted:]))
+                emitted = len(released)
+                if stopped: break
+
+            worker.join()
+        finally:
+            # The consumer stopped iterating (closed the generator), so stop decoding for it too
+            if worker.is_alive(): cancelled.set()
+
+        message = self._truncate(message, stop)
+        if len(message) > emitted: yield ChatGenerationChunk(message=AIMessageChunk(content=message[emitted:]))
+        yield self._tool_call_chunk(message, generation_info)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        input_ids, boundaries = self._encode(self._build_segments(messages, **kwargs))
+        streamer = AsyncTextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        generation_info = {}
+        cancelled = threading.Event()
+        generation = asyncio.ensure_future(self.executor.run(functools.partial(
+            self._run_generation, input_ids, boundaries, generation_info, streamer=streamer,
+            **self._generation_kwargs(input_ids, cancelled, stop, **kwargs)
+        ), cancelled))
+        # A rejected or failed generation never reaches the streamer, so end it here or the consumer would hang
+        generation.add_done_callback(lambda task: (task.cancelled() or task.exception()) and streamer.end())
+        message, emitted = "", 0
+
+        try:
+            async for text in streamer:
+                if not text: continue
+                message += text
+                released, stopped = self._releasable(message, stop)
+                if len(released) > emitted: yield ChatGenerationChunk(message=AIMessageChunk(content=released[emitted:]))
+                emitted = len(released)
+                if stopped: break
+
+            await generation
+        finally:
+            # The consumer stopped early (closed or cancelled), so stop decoding for it too
+            if not generation.done(): generation.cancel()
+
+        message = self._truncate(message, stop)
+        if len(message) > emitted: yield ChatGenerationChunk(message=AIMessageChunk(content=message[emitted:]))
+        yield self._tool_call_chunk(message, generation_info)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        cancelled = threading.Event()
+        return await self.executor.run(
+            functools.partial(self._generate, messages, cancelled, stop=stop, **kwargs), cancelled
+        )
     
     def bind_tools(
         self, tools: Sequence[dict[str, Any] | BaseTool], **kwargs: Any
@@ -110,10 +392,80 @@ class LocalModel(BaseChatModel):
         formatted_tools = [convert_to_openai_tool(tool) for tool in tools]
         return self.bind(tools=formatted_tools, **kwargs)
 
+    def with_structured_output(
+        self, schema: dict | type, *, include_raw: bool = False, **kwargs: Any
+    ) -> Runnable[LanguageModelInput, dict | BaseModel]:
+        # Decode straight into the schema instead of hoping a small model formats a tool call correctly. Other keyword
+        # arguments (e.g. max_new_tokens) are bound for every call
+        is_pydantic = isinstance(schema, type) and issubclass(schema, BaseModel)
+
+        if not self.constrained_decoding:
+            llm = self.bind_tools([schema], tool_choice="any", **kwargs)
+            output_parser = (
+                PydanticToolsParser(tools=[schema], first_tool_only=True) if is_pydantic else
+                JsonOutputKeyToolsParser(key_name=convert_to_openai_tool(schema)["function"]["name"], first_tool_only=True)
+            )
+        else:
+            json_schema = schema.model_json_schema() if is_pydantic else schema
+            output_parser = PydanticOutputParser(pydantic_object=schema) if is_pydantic else JsonOutputParser()
+            llm = self.bind(response_format={"type": "json_schema", "json_schema": json_schema}, **kwargs)
+
+        if not include_raw: return llm | output_parser
+
+        parser_assign = RunnablePassthrough.assign(parsed=itemgetter("raw") | output_parser, parsing_error=lambda _: None)
+        parser_none = RunnablePassthrough.assign(parsed=lambda _: None)
+        parser_with_fallback = parser_assign.with_fallbacks([parser_none], exception_key="parsing_error")
+        return RunnableMap(raw=llm) | parser_with_fallback
+
+
+class LocalModelRegistry:
+    # Loads each (model, dtype, device) once per process; Model instances only add lightweight tool/schema bindings
+    def __init__(self) -> None:
+        self._models: dict[tuple[str, str, str], LocalModel] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model: str, dtype: Optional[str] = None, device: Optional[str] = None) -> LocalModel:
+        key = (model, dtype or "default", device or default_device())
+
+        with self._lock:
+            if key not in self._models:
+                self._models[key] = LocalModel(model, dtype=dtype, device=key[2])
+
+            return self._models[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+
+local_models = LocalModelRegistry()
+
+
+# Remote token counters by model name, resolved on the first count (the encoding may need a download) and then reused
+_remote_counters: dict[str, Callable[[str], int]] = {}
+_remote_counters_lock = threading.Lock()
+
+def _remote_counter(model: str) -> Callable[[str], int]:
+    # tiktoken's encoding for the model (o200k_base for names it does not know, such as Gemini), else about four
+    # characters per token when the encoding cannot be downloaded; the fallback is cached too, so offline stays fast
+    with _remote_counters_lock:
+        if model not in _remote_counters:
+            try:
+                try: encoding = tiktoken.encoding_for_model(model)
+                except KeyError: encoding = tiktoken.get_encoding("o200k_base")
+                _remote_counters[model] = lambda text: len(encoding.encode(text, disallowed_special=()))
+            except Exception:
+                _remote_counters[model] = lambda text: len(text) // 4 + 1
+        return _remote_counters[model]
+
+def token_counter(model: str, tokenizer: Any = None) -> Callable[[str], int]:
+    # The local model's own tokenizer, else the remote model's counter, looked up only once something is counted
+    if tokenizer is not None: return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+    return lambda text: _remote_counter(model)(text)
+
 
 class Model:
-    def __init__(self, output_schema: BaseModel = None) -> None:
-        self.tools = [search_internet, generate_csv_tool, generate_pdf_tool]
+    def __init__(self, output_schema: BaseModel = None, max_new_tokens: Optional[int] = None) -> None:
+        self.tools = list(agent_tools)
         self.tools_by_name = {tool.name: tool for tool in self.tools}
 
         if os.environ.get("OPENAI_API_KEY"):
@@ -121,25 +473,48 @@ class Model:
         elif os.environ.get("GOOGLE_API_KEY"):
             self.model = self._set_gemini_model(output_schema)
         else:
-            self.model = self._set_local_model(output_schema)
+            self.model = self._set_local_model(output_schema, max_new_tokens)
+
+        # Unbound chat model (e.g. for summaries), its token counter and the prompt tokens a conversation may use, of
+        # which `prompt_overhead` (the tool definitions sent along with every conversation) takes its share
+        self.count_tokens = token_counter(os.environ.get("LLM_MODEL_NAME", ""), getattr(self.llm, "tokenizer", None))
+        self.context_tokens = self._context_tokens(max_new_tokens)
+        self.prompt_overhead = self._prompt_overhead(output_schema)
     
     def _set_openai_model(self, output_schema: BaseModel) -> ChatOpenAI:
-        model = ChatOpenAI(model = os.environ.get("LLM_MODEL_NAME", ""))
+        model = self.llm = ChatOpenAI(model = os.environ.get("LLM_MODEL_NAME", ""))
         model = model.bind_tools(self.tools)
 
         if output_schema: model = model.with_structured_output(output_schema)
         return model
     
     def _set_gemini_model(self, output_schema: BaseModel) -> ChatGoogleGenerativeAI:
-        model = ChatGoogleGenerativeAI(model = os.environ.get("LLM_MODEL_NAME", ""))
+        model = self.llm = ChatGoogleGenerativeAI(model = os.environ.get("LLM_MODEL_NAME", ""))
         model = model.bind_tools(self.tools)
 
         if output_schema: model = model.with_structured_output(output_schema)
         return model
     
-    def _set_local_model(self, output_schema: BaseModel) -> LocalModel:
-        model = LocalModel(model = os.environ.get("LLM_MODEL_NAME", ""))
-        model = model.bind_tools(self.tools)
+    def _set_local_model(self, output_schema: BaseModel, max_new_tokens: Optional[int]) -> LocalModel:
+        # Structured output replaces the tool bindings, so each branch binds the node's token budget itself
+        model = self.llm = local_models.get(os.environ.get("LLM_MODEL_NAME", ""), os.environ.get("LLM_DTYPE") or None)
+        budget = {"max_new_tokens": max_new_tokens} if max_new_tokens else {}
 
-        if output_schema: model = model.with_structured_output(output_schema)
-        return model
+        if output_schema: return model.with_structured_output(output_schema, **budget)
+        return model.bind_tools(self.tools, **budget)
+
+    def _prompt_overhead(self, output_schema: Optional[BaseModel]) -> str:
+        if isinstance(self.llm, LocalModel):
+            if output_schema: return self.llm.tools_prompt([]) + json.dumps(output_schema.model_json_schema())
+            return self.llm.tools_prompt(self.tools)
+        return "" if output_schema else json.dumps([convert_to_openai_tool(tool) for tool in self.tools])
+
+    def _context_tokens(self, max_new_tokens: Optional[int]) -> int:
+        # CHAT_CONTEXT_TOKENS, capped for local models by their position window minus the reply they may generate
+        budget = int(os.environ.get("CHAT_CONTEXT_TOKENS") or 16000)
+        window = getattr(getattr(self.llm, "client", None), "config", None)
+        window = getattr(window, "max_position_embeddings", None)
+
+        if isinstance(self.llm, LocalModel) and isinstance(window, int):
+            budget = min(budget, window - (max_new_tokens or self.llm.max_new_tokens))
+        return max(budget, 0)
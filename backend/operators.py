@@ -3,40 +3,57 @@ from .llms import Model
 from .schemas import (
     HeadlinesSchema, StoriesSchema, QueryState, InterviewState, QuestionsSchema, EvaluationSchema
 )
-from .prompts import NEWSBOT_ANCHOR_PROMPT, NEWSBOT_JOURNALIST_PROMPT, NEWSBOT_REPORTER_PROMPT, INTERVIEWBOT_PROMPT
-from .utilities import load_interview_rules
-from langchain_core.messages import AIMessage, SystemMessage, ToolMessage, HumanMessage, RemoveMessage
-from langgraph.prebuilt import ToolNode
+from .prompts import (
+    prompt_registry, NEWSBOT_ANCHOR_PROMPT_ID, NEWSBOT_JOURNALIST_PROMPT_ID, NEWSBOT_REPORTER_PROMPT_ID,
+    INTERVIEWBOT_PROMPT_ID
+)
+from .utilities import load_interview_rules, build_once, with_system_prompt, timed_tool_node
+from .tools import agent_tools
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage, HumanMessage, RemoveMessage
 from langgraph.graph.message import REMOVE_ALL_MESSAGES
 from langgraph.types import interrupt
 
 
-# NewsBot AI instances
-reporter_model = Model(HeadlinesSchema)
-journalist_model = Model(StoriesSchema)
-anchor_model = Model()
+# NewsBot AI instances (built on first use, token budgets apply to local models)
+reporter_model = build_once(Model, HeadlinesSchema, 768)
+journalist_model = build_once(Model, StoriesSchema, 1024)
+anchor_model = build_once(Model, None, 512)
 
-# InterviewBot AI instances
-questioner_model = Model(QuestionsSchema)
-evaluator_model = Model(EvaluationSchema)
-reporting_model = Model()
+# InterviewBot AI instances (built on first use, token budgets apply to local models)
+questioner_model = build_once(Model, QuestionsSchema, 512)
+evaluator_model = build_once(Model, EvaluationSchema, 1024)
+reporting_model = build_once(Model, None, 256)
 
 
 # Graph Node Operators/Functions
-tool_node = ToolNode(reporter_model.tools)
-reporting_tool_node = ToolNode(reporting_model.tools)
+# Tool calls of one message run concurrently with per-tool timeouts, the anchor's searches live in `queries`
+tool_node = timed_tool_node(agent_tools)
+reporting_tool_node = timed_tool_node(agent_tools)
+query_tool_node = timed_tool_node(agent_tools, messages_key="queries")
+
+# Persona for each newsbot segment, state only keeps the id of the selected one
+news_prompt_ids = {
+    "headlines": NEWSBOT_REPORTER_PROMPT_ID,
+    "stories": NEWSBOT_JOURNALIST_PROMPT_ID,
+    "summary": NEWSBOT_ANCHOR_PROMPT_ID
+}
 
 # NewsBot Functions
-def headlines_function(state: QueryState) -> dict:
+def news_messages(state: QueryState) -> list[BaseMessage]:
     messages = state["messages"]
-    headlines = reporter_model.model.invoke(messages)
+    if not state.get("prompt"): return messages
+    return with_system_prompt(prompt_registry.render(state["prompt"]), messages)
+
+def headlines_function(state: QueryState) -> dict:
+    messages = news_messages(state)
+    headlines = reporter_model().model.invoke(messages)
     headlines_json = headlines.model_dump_json(indent = 2)
 
     return {"messages": [AIMessage(headlines_json)]}
 
 def stories_function(state: QueryState) -> dict:
-    messages = state["messages"]
-    stories = journalist_model.model.invoke(messages)
+    messages = news_messages(state)
+    stories = journalist_model().model.invoke(messages)
     stories_json = stories.model_dump_json(indent = 2)
 
     return {"messages": [AIMessage(stories_json)]}
@@ -46,57 +63,56 @@ def query_function(state: QueryState) -> dict:
     queries = state.get("queries", [])
 
     if not queries or isinstance(messages[-1], HumanMessage):
-        response = anchor_model.model.invoke(messages)
+        response = anchor_model().model.invoke(news_messages(state))
         return {"messages": [response], "queries": [messages[-1], response]}
     else:
-        response = anchor_model.model.invoke(queries)
+        response = anchor_model().model.invoke(queries)
         return {"queries": [response]}
 
 def news_perception_function(state: QueryState) -> dict:
     messages = state["messages"]
     queries = state.get("queries", [])
     segment = state.get("segment", "")
-    system_prompt = None
-
-    if segment == "headlines":
-        system_prompt = SystemMessage(NEWSBOT_REPORTER_PROMPT)
-    elif segment == "stories":
-        system_prompt = SystemMessage(NEWSBOT_JOURNALIST_PROMPT)
-    elif segment == "summary":
-        system_prompt = SystemMessage(NEWSBOT_ANCHOR_PROMPT)
-        
+    update = {"prompt": news_prompt_ids[segment]} if segment in news_prompt_ids else {}
+
+    if segment == "summary":
+        update["queries"] = []
+
         if isinstance(messages[-1], ToolMessage):
-            state["queries"].append(messages[-1])
-        
-        if not queries or isinstance(messages[-1], HumanMessage):
-            state["queries"].append(RemoveMessage(id=REMOVE_ALL_MESSAGES))
+            update["queries"].append(messages[-1])
 
-    if system_prompt:
-        if not messages or messages[0].content != system_prompt.content:
-            state["messages"].insert(0, system_prompt)
+        if not queries or isinstance(messages[-1], HumanMessage):
+            update["queries"].append(RemoveMessage(id=REMOVE_ALL_MESSAGES))
 
-    return state
+    return update
 
 def custom_tool_node(state: QueryState) -> dict:
     if "queries" in state:
         last_message = state["queries"][-1]
+        if hasattr(last_message, "tool_calls") and len(last_message.tool_calls) > 0: return query_tool_node.invoke(state)
 
-        if hasattr(last_message, "tool_calls") and len(last_message.tool_calls) > 0:
-            tool_messages = []
+    return tool_node.invoke(state)
 
-            for tool_call in last_message.tool_calls:
-                tool_name = tool_call["name"]
-                tool_to_run = reporter_model.tools_by_name[tool_name]
-                result = tool_to_run.invoke(tool_call["args"])
-                if isinstance(result, dict) or isinstance(result, list): result = json.dumps(result, indent=2)
-                tool_messages.append(ToolMessage(content=result, tool_call_id=tool_call["id"]))
 
-            return {"queries": tool_messages}
+# InterviewBot Functions
+def interview_messages(state: InterviewState) -> list[BaseMessage]:
+    # The interview prompt is filled from the candidate's details (the second message) and the selected rules
+    messages = state["messages"]
+    if not state.get("prompt"): return messages
 
-    return tool_node.invoke(state)
+    user_information = json.loads(messages[1].content)
+    rules = state["rules"]
+    system_prompt = prompt_registry.render(
+        state["prompt"],
+        role=user_information["role"],
+        companies=user_information["companies"],
+        time_frame=rules.get("time_frame"),
+        no_of_questions=rules.get("no_of_questions"),
+        questions_type=rules.get("questions_type")
+    )
 
+    return with_system_prompt(system_prompt, messages)
 
-# InterviewBot Functions
 def candidate_information_collection_function(state: InterviewState) -> dict:
     if state.get("phase") == "reporting": return state
     user_name = interrupt("Please enter your full name")
@@ -111,8 +127,8 @@ def candidate_information_collection_function(state: InterviewState) -> dict:
     return {"messages": [HumanMessage(user_information)]}
 
 def question_generation_function(state: InterviewState) -> dict:
-    messages = state["messages"]
-    questions = questioner_model.model.invoke(messages)
+    messages = interview_messages(state)
+    questions = questioner_model().model.invoke(messages)
     questions_json = questions.model_dump_json(indent = 2)
 
     return {"messages": [AIMessage(questions_json)], "questions": questions.questions}
@@ -128,38 +144,27 @@ def answer_collection_function(state: InterviewState) -> dict:
     return {"messages": [HumanMessage(json.dumps(answers))], "answers": answers}
 
 def evaluation_function(state: InterviewState) -> dict:
-    messages = state["messages"]
-    evaluation = evaluator_model.model.invoke(messages)
+    messages = interview_messages(state)
+    evaluation = evaluator_model().model.invoke(messages)
     evaluation_json = evaluation.model_dump_json(indent = 2)
 
     return {"messages": [AIMessage(evaluation_json)]}
 
 def interview_perception_function(state: InterviewState) -> dict:
-    messages = state["messages"]
     interview_rules = load_interview_rules()
     rules = interview_rules.get(
         state["rules"]["format"],
         {"format": "short", "time_frame": 1, "no_of_questions": 5}
     )
-    user_information = json.loads(messages[1].content)
-    system_prompt = SystemMessage(INTERVIEWBOT_PROMPT.format(
-        role=user_information["role"],
-        companies=user_information["companies"],
-        time_frame=rules.get("time_frame"),
-        no_of_questions=rules.get("no_of_questions"),
-        questions_type=rules.get("questions_type")
-    ))
 
-    if system_prompt: state["messages"].insert(0, system_prompt)
-    state["rules"] = rules
-
-    return state
+    # Pinned for the thread, so the reporting phase renders the same version as the interview
+    return {"rules": rules, "prompt": state.get("prompt") or INTERVIEWBOT_PROMPT_ID}
 
 def phase_router_function(state: InterviewState) -> str:
     if state.get("phase") == "reporting": return "reporting_node"
     else: return "perception_node"
 
 def reporting_function(state: InterviewState) -> dict:
-    messages = state["messages"]
-    response = reporting_model.model.invoke(messages)
+    messages = interview_messages(state)
+    response = reporting_model().model.invoke(messages)
     return {"messages": [response]}
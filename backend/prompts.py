@@ -154,6 +154,12 @@ CHATBOT_PROMPT = f"""
     the CSV must be professional, high-quality, and structurally perfect, free of all conversational
     filler, jokes, or sarcasm.
 """
+CONVERSATION_SUMMARY_PROMPT = """
+    You maintain a running summary of a conversation between a user and an AI assistant. You are given the current
+    summary (possibly empty) and the messages that followed it. Return an updated summary that keeps the user's goals,
+    preferences, facts, decisions, open questions and the names of any files created with tools, dropping small talk.
+    Write it in the third person as concise plain text of at most a few short paragraphs, without any preamble.
+"""
 NEWSBOT_BASE_PROMPT = f"""
     Today is {datetime.now()}. You are a News AI Assistant, designed for advanced, objective news gathering, comparative
     analysis, and professional summarization. Your persona is that of a diligent, unbiased news analyst and
@@ -283,3 +289,36 @@ INTERVIEWBOT_PROMPT = """
     **key reasons why** (e.g., "Lacks deep knowledge in Distributed Transactions," "System design lacked metrics and
     failure analysis.").
 """
+
+
+# Prompt Registry
+class PromptRegistry:
+    """
+    Versioned system prompts. Graph state stores only a prompt id ("chatbot@1") and nodes render the text when they
+    call the model, so checkpoints never carry the prompt and editing one needs no migration of stored threads.
+    Registered versions keep resolving for the threads pinned to them; a retired version falls back to the latest.
+    """
+    def __init__(self) -> None:
+        self._templates: dict[str, str] = {}
+        self._latest: dict[str, int] = {}
+
+    def register(self, name: str, version: int, template: str) -> str:
+        self._templates[f"{name}@{version}"] = template
+        self._latest[name] = max(version, self._latest.get(name, version))
+        return f"{name}@{version}"
+
+    def latest(self, name: str) -> str:
+        return f"{name}@{self._latest[name]}"
+
+    def render(self, prompt_id: str, **values: object) -> str:
+        # Only templates such as the interview prompt take values, the others may contain literal braces
+        name, _, _ = prompt_id.partition("@")
+        template = self._templates.get(prompt_id) or self._templates[self.latest(name)]
+        return template.format(**values) if values else template
+
+prompt_registry = PromptRegistry()
+CHATBOT_PROMPT_ID = prompt_registry.register("chatbot", 1, CHATBOT_PROMPT)
+NEWSBOT_REPORTER_PROMPT_ID = prompt_registry.register("newsbot-reporter", 1, NEWSBOT_REPORTER_PROMPT)
+NEWSBOT_JOURNALIST_PROMPT_ID = prompt_registry.register("newsbot-journalist", 1, NEWSBOT_JOURNALIST_PROMPT)
+NEWSBOT_ANCHOR_PROMPT_ID = prompt_registry.register("newsbot-anchor", 1, NEWSBOT_ANCHOR_PROMPT)
+INTERVIEWBOT_PROMPT_ID = prompt_registry.register("interviewbot", 1, INTERVIEWBOT_PROMPT)
@@ -0,0 +1,136 @@
+import io, csv, hashlib, itertools, threading, multiprocessing
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Any, Callable, Iterator, Sequence
+from .artifacts import ArtifactStore
+
+
+# PDF Rendering Workers
+_font_config = None
+_resource_cache = None
+
+def _start_worker() -> None:
+    # Fonts are parsed once per worker, later jobs reuse them and the images/stylesheets already fetched
+    global _font_config, _resource_cache
+    from weasyprint.text.fonts import FontConfiguration
+    _font_config, _resource_cache = FontConfiguration(), {}
+
+def render_pdf(template: str) -> bytes:
+    from weasyprint import HTML
+    if _font_config is None: _start_worker()
+    return HTML(string=template).write_pdf(font_config=_font_config, cache=_resource_cache)
+
+def template_hash(template: str) -> str:
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()
+
+
+class PdfRenderer:
+    """
+    Renders HTML templates to PDF on a pool of worker processes, so WeasyPrint neither blocks the session nor holds
+    the server's GIL. A PDF is written straight into the session's artifacts in `store`, under its job name (the hash
+    of its template): submitting a template the session already rendered (or is rendering) costs nothing, the job name
+    is a handle the UI polls, and finished PDFs expire with the session's other artifacts.
+    """
+    def __init__(
+        self, store: ArtifactStore, workers: int = 2, executor: Executor | None = None,
+        render: Callable[[str], bytes] = render_pdf
+    ) -> None:
+        self.store = store
+        self.render = render
+        # Spawned workers stay light (this module only), forking a threaded server could deadlock them
+        self.executor = executor or ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn"), initializer=_start_worker
+        )
+        self._jobs: dict[tuple[str, str], Future] = {}
+        # Templates of jobs that have not reached the store yet, a failed job is retried from here
+        self._templates: dict[tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session: str, template: str) -> str:
+        job = template_hash(template)
+
+        with self._lock:
+            pending = self._jobs.get((session, job))
+            # Failed jobs are retried, finished ones are served from the store
+            if (pending and not (pending.done() and pending.exception())) or self.store.exists(session, job): return job
+            # Resolved once the PDF is in the store, not when the worker returns its bytes
+            self._jobs[(session, job)] = written = Future()
+            self._templates[(session, job)] = template
+
+        try:
+            rendered = self.executor.submit(self.render, template)
+        except Exception as error:
+            # A broken pool fails the job instead of leaving it rendering forever
+            written.set_exception(error)
+            return job
+
+        rendered.add_done_callback(lambda rendered: self._write(session, job, rendered, written))
+        return job
+
+    def status(self, session: str, job: str) -> str:
+        with self._lock: written = self._jobs.get((session, job))
+        if written is None: return "ready" if self.store.exists(session, job) else "missing"
+        return "failed" if written.done() and written.exception() else "rendering"
+
+    def error(self, session: str, job: str) -> BaseException | None:
+        with self._lock: written = self._jobs.get((session, job))
+        return written.exception() if written and written.done() else None
+
+    def retry(self, session: str, job: str) -> bool:
+        # Renders a failed job again, False once its template is gone (rendered meanwhile or never submitted here)
+        with self._lock: template = self._templates.get((session, job))
+        if template is None: return False
+        self.submit(session, template)
+        return True
+
+    def wait(self, session: str, job: str, timeout: float | None = None) -> bytes | None:
+        # Blocks until the job's PDF is in the store and returns it, raising the render error if it failed
+        with self._lock: written = self._jobs.get((session, job))
+        if written: written.result(timeout)
+        return self.store.get(session, job)
+
+    def _write(self, session: str, job: str, rendered: Future, written: Future) -> None:
+        try:
+            self.store.put(session, rendered.result(), job)
+        except BaseException as error:
+            written.set_exception(error)
+            return
+
+        with self._lock:
+            self._jobs.pop((session, job), None)
+            self._templates.pop((session, job), None)
+        written.set_result(job)
+
+
+# CSV Rendering
+def csv_chunks(data: dict[str, Any] | Sequence[dict[str, Any]], chunk_size: int = 2**16) -> Iterator[bytes]:
+    """
+    Streams `data` as UTF-8 CSV in chunks of about `chunk_size` bytes without building a table first. `data` is either
+    a dict of equal-length columns (scalars repeat on every row) or a list of records (missing fields stay empty).
+    """
+    if isinstance(data, dict):
+        columns = [value if isinstance(value, (list, tuple)) else None for value in data.values()]
+        lengths = {len(column) for column in columns if column is not None}
+        if len(lengths) > 1: raise ValueError("All columns must be of the same length")
+        length = lengths.pop() if lengths else 1
+        header = list(data)
+        rows = zip(*[
+            column if column is not None else itertools.repeat(value, length)
+            for column, value in zip(columns, data.values())
+        ])
+    else:
+        # Columns in the order their fields first appear, like a DataFrame built from records
+        header = list(dict.fromkeys(key for record in data for key in record))
+        rows = ([record.get(key) for key in header] for record in data)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(header)
+
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue().encode("utf-8")
@@ -9,6 +9,7 @@ class QueryState(TypedDict):
     messages: Annotated[list[BaseMessage], add_messages]
     segment: str
     queries: Annotated[list[BaseMessage], add_messages]
+    prompt: str # Prompt registry id of the segment's persona, rendered when the model is called
 
 class HeadlinesItemSchema(BaseModel):
     location: str = Field(
@@ -45,6 +46,7 @@ class InterviewState(TypedDict):
     answers: list
     rules: dict
     phase: str
+    prompt: str # Prompt registry id of the interviewer persona, rendered when the model is called
 
 class QuestionsItemSchema(BaseModel):
     question: str = Field(
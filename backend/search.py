@@ -0,0 +1,140 @@
+import os, time, sqlite3, threading, unicodedata
+from concurrent.futures import Future
+from typing import Annotated, Any, Callable, Optional
+from pydantic import BaseModel, Field
+from langchain_core.tools import BaseTool, StructuredTool
+from langgraph.prebuilt import InjectedState
+
+
+# Search Result Caching
+DEFAULT_SEARCH_TTLS = {"headlines": 600, "stories": 3600, "summary": 1800, "default": 1800}
+
+def search_ttls() -> dict[str, float]:
+    # SEARCH_CACHE_TTL_<SEGMENT> overrides the seconds a result is reused for that newsbot segment (0 disables caching)
+    return {
+        segment: float(os.environ.get(f"SEARCH_CACHE_TTL_{segment.upper()}", ttl))
+        for segment, ttl in DEFAULT_SEARCH_TTLS.items()
+    }
+
+def normalize_query(query: str) -> str:
+    # Case, Unicode forms and spacing rarely change what a search engine returns, punctuation can ("node.js", "$100")
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+class SearchCache:
+    """
+    SQLite store of search results keyed by normalized query. Rows keep the time they were fetched, so every reader
+    applies its own TTL: a stories search may reuse a result a headlines search fetched, but not the other way round.
+    """
+    def __init__(self, path: str = "search_cache.db") -> None:
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache "
+                "(key TEXT PRIMARY KEY, result TEXT NOT NULL, fetched REAL NOT NULL)"
+            )
+
+    def get(self, key: str, ttl: float) -> str | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT result FROM search_cache WHERE key = ? AND fetched > ?", (key, time.time() - ttl)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, result: str) -> None:
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO search_cache (key, result, fetched) VALUES (?, ?, ?)",
+                (key, result, time.time())
+            )
+
+    def purge(self, max_age: float) -> int:
+        with self.lock:
+            cursor = self.connection.execute("DELETE FROM search_cache WHERE fetched <= ?", (time.time() - max_age,))
+            return cursor.rowcount
+
+    def __len__(self) -> int:
+        with self.lock: return self.connection.execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+
+    def close(self) -> None:
+        with self.lock: self.connection.close()
+
+
+class CachedSearch:
+    """
+    Serves searches from a SearchCache and falls back to `provider` (any callable from query to result text, e.g. the
+    DuckDuckGo tool). Identical searches in flight at the same time share one provider call.
+    """
+    def __init__(
+        self, provider: Callable[[str], str], cache: SearchCache, ttls: dict[str, float] | None = None
+    ) -> None:
+        self.provider = provider
+        self.cache = cache
+        self.ttls = ttls or dict(DEFAULT_SEARCH_TTLS)
+        self._in_flight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0, "provider_seconds": 0.0}
+        self._searches = 0
+
+    def search(self, query: str, segment: str | None = None) -> str:
+        key = normalize_query(query)
+        ttl = self.ttls.get(segment or "default", self.ttls["default"])
+
+        if ttl > 0 and (result := self.cache.get(key, ttl)) is not None:
+            self._record("hits")
+            return result
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader: future = self._in_flight[key] = Future()
+            self._stats["misses" if leader else "coalesced"] += 1
+
+        if not leader: return future.result()
+        start = time.perf_counter()
+
+        try:
+            result = self.provider(query)
+            self.cache.set(key, result)
+            future.set_result(result)
+            return result
+        except BaseException as error:
+            self._record("errors")
+            future.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                self._stats["provider_seconds"] += time.perf_counter() - start
+                self._searches += 1
+                purge = self._searches % 100 == 0
+            # Expired rows are dropped now and then instead of on every write
+            if purge: self.cache.purge(max(self.ttls.values()))
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock: stats = dict(self._stats)
+        served = stats["hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_rate"] = (stats["hits"] + stats["coalesced"]) / served if served else None
+        stats["entries"] = len(self.cache)
+        return stats
+
+    def _record(self, counter: str) -> None:
+        with self._lock: self._stats[counter] += 1
+
+
+class SearchInput(BaseModel):
+    query: str = Field(description="search query to look up")
+    # Graph state injected by ToolNode (hidden from the model), its newsbot segment selects the cache TTL
+    state: Annotated[Optional[dict], InjectedState] = None
+
+def cached_search_tool(tool: BaseTool, search: Callable[[], CachedSearch]) -> StructuredTool:
+    # Keeps the wrapped tool's name and description, so prompts and bound tool schemas do not change
+    def search_internet(query: str, state: Optional[dict] = None) -> str:
+        return search().search(query, (state or {}).get("segment"))
+
+    return StructuredTool.from_function(
+        search_internet, name=tool.name, description=tool.description, args_schema=SearchInput
+    )
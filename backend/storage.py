@@ -1,32 +1,1201 @@
-import sqlite3, os, psycopg
-from pymongo import MongoClient
-from typing import Literal
+import sqlite3, json, os, sys, time, uuid, queue, itertools, asyncio, hashlib, argparse, threading, contextlib, pathlib
+from abc import ABC, abstractmethod
+import aiosqlite
+import psycopg
+import zstandard
+from dotenv import load_dotenv
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+from datetime import datetime
+from pymongo import MongoClient, UpdateOne
+from typing import Literal, Any, AsyncIterator, Iterator, Callable, Sequence
+from langchain_core.runnables import RunnableConfig
+from langchain_core.messages import RemoveMessage, convert_to_messages
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
 from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 from langgraph.checkpoint.mongodb import MongoDBSaver
+from langgraph.checkpoint.mongodb.utils import loads_metadata, dumps_metadata
 from langgraph.checkpoint.postgres import PostgresSaver
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver, Checkpoint, CheckpointMetadata, CheckpointTuple, ChannelVersions, WRITES_IDX_MAP,
+    get_checkpoint_id
+)
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+
+# Settings every connection handed to a Postgres checkpointer needs
+POSTGRES_CONNECTION_KWARGS = {"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row}
+
+def postgres_pool_settings() -> dict[str, Any]:
+    return {
+        "min_size": int(os.environ.get("POSTGRES_POOL_MIN_SIZE", 1)),
+        "max_size": int(os.environ.get("POSTGRES_POOL_MAX_SIZE", 10)),
+        "timeout": float(os.environ.get("POSTGRES_POOL_TIMEOUT", 30)),
+        "max_idle": float(os.environ.get("POSTGRES_POOL_MAX_IDLE", 300)),
+    }
+
+def mongo_client_settings() -> dict[str, Any]:
+    # Pool, timeouts and write concern of the MongoDB client (a blank write concern keeps the server default)
+    settings = {
+        "minPoolSize": int(os.environ.get("MONGODB_POOL_MIN_SIZE", 0)),
+        "maxPoolSize": int(os.environ.get("MONGODB_POOL_MAX_SIZE", 50)),
+        "waitQueueTimeoutMS": int(float(os.environ.get("MONGODB_POOL_TIMEOUT", 30)) * 1000),
+        "maxIdleTimeMS": int(float(os.environ.get("MONGODB_POOL_MAX_IDLE", 300)) * 1000),
+        "serverSelectionTimeoutMS": int(float(os.environ.get("MONGODB_SERVER_TIMEOUT", 10)) * 1000),
+        "socketTimeoutMS": int(float(os.environ.get("MONGODB_SOCKET_TIMEOUT", 30)) * 1000),
+    }
+    if write_concern := os.environ.get("MONGODB_WRITE_CONCERN", ""):
+        settings["w"] = int(write_concern) if write_concern.isdigit() else write_concern
+    return settings
+
+
+class DictionaryStore(ABC):
+    """
+    Keeps the zstd dictionaries of one checkpoint database next to its checkpoints. Blobs name their dictionary by id,
+    so every host reading the database (or a fresh disk after a redeploy) must find them in the database itself.
+    """
+    @abstractmethod
+    def load(self, key: str) -> bytes | None: ...
+    @abstractmethod
+    def save(self, key: str, data: bytes, created: float) -> None: ...
+    # The most recently trained dictionary, imported raw-content dictionaries (created 0) are only kept for reading
+    @abstractmethod
+    def latest(self) -> tuple[str, bytes] | None: ...
+
+class SqliteDictionaryStore(DictionaryStore):
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with contextlib.closing(sqlite3.connect(path)) as connection, connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoint_dictionaries "
+                "(key TEXT PRIMARY KEY, data BLOB NOT NULL, created REAL NOT NULL)"
+            )
+
+    def load(self, key: str) -> bytes | None:
+        with contextlib.closing(sqlite3.connect(self.path)) as connection:
+            row = connection.execute("SELECT data FROM checkpoint_dictionaries WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def save(self, key: str, data: bytes, created: float) -> None:
+        with contextlib.closing(sqlite3.connect(self.path)) as connection, connection:
+            connection.execute("INSERT OR IGNORE INTO checkpoint_dictionaries VALUES (?, ?, ?)", (key, data, created))
+
+    def latest(self) -> tuple[str, bytes] | None:
+        with contextlib.closing(sqlite3.connect(self.path)) as connection:
+            return connection.execute(
+                "SELECT key, data FROM checkpoint_dictionaries WHERE created > 0 ORDER BY created DESC LIMIT 1"
+            ).fetchone()
+
+    def __str__(self) -> str: return f"the checkpoint_dictionaries table of {self.path}"
+
+class PostgresDictionaryStore(DictionaryStore):
+    # Short-lived connections, dictionaries are read once per process and the async savers have no sync pool
+    def __init__(self, uri: str | None) -> None:
+        self.uri = uri or ""
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoint_dictionaries "
+                "(key TEXT PRIMARY KEY, data BYTEA NOT NULL, created DOUBLE PRECISION NOT NULL)"
+            )
+
+    def _connect(self) -> psycopg.Connection:
+        return psycopg.connect(self.uri, autocommit=True)
+
+    def load(self, key: str) -> bytes | None:
+        with self._connect() as connection:
+            row = connection.execute("SELECT data FROM checkpoint_dictionaries WHERE key = %s", (key,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def save(self, key: str, data: bytes, created: float) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO checkpoint_dictionaries VALUES (%s, %s, %s) ON CONFLICT (key) DO NOTHING",
+                (key, data, created)
+            )
+
+    def latest(self) -> tuple[str, bytes] | None:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT key, data FROM checkpoint_dictionaries WHERE created > 0 ORDER BY created DESC LIMIT 1"
+            ).fetchone()
+        return (row[0], bytes(row[1])) if row else None
+
+    def __str__(self) -> str: return "the checkpoint_dictionaries table of the Postgres database"
+
+class MongoDictionaryStore(DictionaryStore):
+    def __init__(self, collection: Any) -> None:
+        self.collection = collection
+
+    def load(self, key: str) -> bytes | None:
+        document = self.collection.find_one({"_id": key}, {"data": 1})
+        return bytes(document["data"]) if document else None
+
+    def save(self, key: str, data: bytes, created: float) -> None:
+        self.collection.update_one({"_id": key}, {"$setOnInsert": {"data": data, "created": created}}, upsert=True)
+
+    def latest(self) -> tuple[str, bytes] | None:
+        document = self.collection.find_one({"created": {"$gt": 0}}, sort=[("created", -1)])
+        return (document["_id"], bytes(document["data"])) if document else None
+
+    def __str__(self) -> str: return f"the {self.collection.name} collection of the MongoDB database"
+
+
+class ZstdSerializer:
+    """
+    Compresses the blobs of another checkpoint serializer with zstd. Until a dictionary is trained from real checkpoints
+    blobs are compressed without one; afterwards every blob names the dictionary it was compressed with, and older
+    dictionaries stay in `dictionaries` (the checkpoint database) so any host can read any blob.
+    """
+    PREFIX = "zstd"
+
+    def __init__(
+        self, serde: SerializerProtocol | None = None, dictionaries: DictionaryStore | None = None,
+        level: int = 3, min_size: int = 256, legacy_directory: str | None = None
+    ) -> None:
+        self.serde = serde or JsonPlusSerializer()
+        self.store = dictionaries
+        self.level = level
+        self.min_size = min_size
+        self.dictionaries: dict[str, zstandard.ZstdCompressionDict] = {}
+        self.current: str | None = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {"dumps": 0, "loads": 0, "raw_bytes": 0, "stored_bytes": 0, "dumps_seconds": 0.0, "loads_seconds": 0.0}
+
+        if legacy_directory and self.store: self._import(pathlib.Path(legacy_directory))
+        if self.store and (latest := self.store.latest()): self.current = self._add(*latest)
+
+    def train(self, samples: list[bytes], size: int = 112640) -> str:
+        # Samples are uncompressed blobs; see raw_blob() for turning stored rows back into them
+        if self.store is None: raise ValueError("Training a dictionary needs a store to keep it in")
+        data = zstandard.train_dictionary(size, samples, level=self.level).as_bytes()
+        key = self._key(data)
+        self.store.save(key, data, time.time())
+        self.current = self._add(key, data)
+        return key
+
+    def dumps(self, obj: Any) -> bytes:
+        # Untyped payloads (e.g. Mongo checkpoint metadata) stay uncompressed so they remain queryable
+        return self.serde.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return self.serde.loads(data)
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        start = time.perf_counter()
+        type_, data = self.serde.dumps_typed(obj)
+        if data is None or len(data) < self.min_size:
+            self._record("dumps", start, len(data or b""), len(data or b""))
+            return type_, data
+
+        # An empty key marks a blob compressed without a dictionary
+        key = self.current or ""
+        compressed = self._compressor(key).compress(data)
+        self._record("dumps", start, len(data), len(compressed))
+        return f"{self.PREFIX}:{key}:{type_}", compressed
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, blob = data
+        if not type_.startswith(f"{self.PREFIX}:"): return self.serde.loads_typed(data)
+
+        start = time.perf_counter()
+        _, key, type_ = type_.split(":", 2)
+        value = self.serde.loads_typed((type_, self.raw_blob(key, blob)))
+        self._record("loads", start, 0, 0)
+        return value
+
+    def raw_blob(self, key: str, blob: bytes) -> bytes:
+        return self._decompressor(key).decompress(blob)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock: stats = dict(self._stats)
+        stats["ratio"] = stats["raw_bytes"] / stats["stored_bytes"] if stats["stored_bytes"] else None
+        stats["dictionary"] = self.current
+        return stats
+
+    def _record(self, operation: str, start: float, raw_bytes: int, stored_bytes: int) -> None:
+        with self._lock:
+            self._stats[operation] += 1
+            self._stats[f"{operation}_seconds"] += time.perf_counter() - start
+            self._stats["raw_bytes"] += raw_bytes
+            self._stats["stored_bytes"] += stored_bytes
+
+    def _compressor(self, key: str) -> zstandard.ZstdCompressor:
+        # zstd contexts are not thread safe, so every thread keeps its own
+        compressors = self._local.__dict__.setdefault("compressors", {})
+        if key not in compressors:
+            compressors[key] = zstandard.ZstdCompressor(level=self.level, dict_data=self._dictionary(key))
+        return compressors[key]
+
+    def _decompressor(self, key: str) -> zstandard.ZstdDecompressor:
+        decompressors = self._local.__dict__.setdefault("decompressors", {})
+        if key not in decompressors: decompressors[key] = zstandard.ZstdDecompressor(dict_data=self._dictionary(key))
+        return decompressors[key]
+
+    def _dictionary(self, key: str) -> zstandard.ZstdCompressionDict | None:
+        if not key: return None
+        if key not in self.dictionaries:
+            # Another host may have trained it since this one started
+            data = self.store.load(key) if self.store else None
+            if data is None:
+                raise ValueError(
+                    f"Checkpoint blob was compressed with zstd dictionary {key!r}, which is not in "
+                    f"{self.store or 'any dictionary store'}. Import the dictionary from the database or "
+                    "CHECKPOINT_DICTIONARY_DIR it was trained into before reading these checkpoints."
+                )
+            self._add(key, data)
+        return self.dictionaries[key]
+
+    def _add(self, key: str, data: bytes) -> str:
+        with self._lock: self.dictionaries[key] = zstandard.ZstdCompressionDict(data)
+        return key
+
+    def _import(self, directory: pathlib.Path) -> None:
+        # Dictionaries used to live only on the local disk. Raw-content ones (dict id 0, built from prompts) are
+        # imported for reading old blobs but never compress new ones
+        for path in directory.glob("*.zdict"):
+            data = path.read_bytes()
+            trained = zstandard.ZstdCompressionDict(data).dict_id() != 0
+            self.store.save(path.stem, data, path.stat().st_mtime if trained else 0)
+
+    @staticmethod
+    def _key(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()[:16]
+
+
+def checkpoint_serializer(database: str, dictionaries: Callable[[], DictionaryStore]) -> SerializerProtocol | None:
+    # One serializer per database and process, so its dictionaries and statistics are shared by every saver using it
+    compression = os.environ.get("CHECKPOINT_COMPRESSION", "").lower()
+    if compression in ("", "none"): return None
+    if compression != "zstd": raise ValueError(f"Unknown checkpoint compression {compression!r}")
+
+    with _checkpoint_serializer_lock:
+        if database not in _checkpoint_serializers:
+            _checkpoint_serializers[database] = ZstdSerializer(
+                dictionaries=dictionaries(), level=int(os.environ.get("CHECKPOINT_COMPRESSION_LEVEL", 3)),
+                legacy_directory=os.environ.get("CHECKPOINT_DICTIONARY_DIR", "checkpoint_dictionaries")
+            )
+        return _checkpoint_serializers[database]
+
+_checkpoint_serializers: dict[str, ZstdSerializer] = {}
+_checkpoint_serializer_lock = threading.Lock()
+
+
+class PooledPostgresSaver(PostgresSaver):
+    # Each checkpoint operation checks out its own connection, so the base class's single-connection lock would only
+    # serialise sessions
+    def __init__(self, pool: ConnectionPool, serde: SerializerProtocol | None = None) -> None:
+        super().__init__(pool, serde=serde)
+        self.lock = contextlib.nullcontext()
+
+class PooledAsyncPostgresSaver(AsyncPostgresSaver):
+    # Async pools belong to the event loop that opens them, so the pool is opened (and migrated) on first use
+    def __init__(self, pool: AsyncConnectionPool, serde: SerializerProtocol | None = None) -> None:
+        super().__init__(pool, serde=serde)
+        self.lock = contextlib.nullcontext()
+        self._opened = False
+        self._opening = asyncio.Lock()
+
+    async def _open(self) -> None:
+        async with self._opening:
+            if self._opened: return
+            await self.conn.open(wait=True)
+            self._opened = True
+            await self.setup()
+
+    @contextlib.asynccontextmanager
+    async def _cursor(self, *, pipeline: bool = False) -> AsyncIterator[Any]:
+        if not self._opened: await self._open()
+        async with super()._cursor(pipeline=pipeline) as cursor:
+            yield cursor
+
+
+class TunedMongoDBSaver(MongoDBSaver):
+    """
+    MongoDBSaver that makes sure its compound indexes exist, reads only the fields a checkpoint tuple needs and loads
+    the pending writes of a whole page of listed checkpoints in one query instead of one query per checkpoint
+    """
+    CHECKPOINT_FIELDS = {
+        "_id": 0, "thread_id": 1, "checkpoint_ns": 1, "checkpoint_id": 1, "parent_checkpoint_id": 1, "type": 1,
+        "checkpoint": 1, "metadata": 1
+    }
+    WRITE_FIELDS = {
+        "_id": 0, "thread_id": 1, "checkpoint_ns": 1, "checkpoint_id": 1, "task_id": 1, "channel": 1, "type": 1,
+        "value": 1
+    }
+
+    def __init__(self, client: MongoClient, page_size: int = 100, **kwargs: Any) -> None:
+        super().__init__(client, **kwargs)
+        self.page_size = page_size
+        self.ensure_indexes()
+
+    def ensure_indexes(self) -> None:
+        # The base class skips collections that already have other indexes; creating an existing index is a no-op
+        self.checkpoint_collection.create_index(
+            [("thread_id", 1), ("checkpoint_ns", 1), ("checkpoint_id", -1)], unique=True
+        )
+        self.writes_collection.create_index(
+            [("thread_id", 1), ("checkpoint_ns", 1), ("checkpoint_id", -1), ("task_id", 1), ("idx", 1)], unique=True
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        configurable = config["configurable"]
+        query = {"thread_id": configurable["thread_id"], "checkpoint_ns": configurable.get("checkpoint_ns", "")}
+        if checkpoint_id := get_checkpoint_id(config): query["checkpoint_id"] = checkpoint_id
+
+        documents = list(self.checkpoint_collection.find(
+            query, self.CHECKPOINT_FIELDS, sort=[("checkpoint_id", -1)], limit=1
+        ))
+        return next(iter(self._tuples(documents)), None)
+
+    def list(
+        self, config: RunnableConfig | None, *, filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None, limit: int | None = None
+    ) -> Iterator[CheckpointTuple]:
+        configurable = config["configurable"] if config else {}
+        query = {key: configurable[key] for key in ("thread_id", "checkpoint_ns") if key in configurable}
+        for key, value in (filter or {}).items(): query[f"metadata.{key}"] = dumps_metadata(value)
+        if before is not None: query["checkpoint_id"] = {"$lt": before["configurable"]["checkpoint_id"]}
+
+        documents = self.checkpoint_collection.find(
+            query, self.CHECKPOINT_FIELDS, sort=[("checkpoint_id", -1)], limit=limit or 0, batch_size=self.page_size
+        )
+        while page := list(itertools.islice(documents, self.page_size)):
+            yield from self._tuples(page)
+
+    def put_writes(
+        self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = ""
+    ) -> None:
+        # The base class's documents in one unordered bulk write, the server need not apply them one by one
+        configurable = config["configurable"]
+        # Existing writes are only replaced when they record errors or interrupts
+        set_method = "$set" if all(channel in WRITES_IDX_MAP for channel, _ in writes) else "$setOnInsert"
+        created_at = datetime.now()
+        operations = []
+
+        for idx, (channel, value) in enumerate(writes):
+            type_, serialized_value = self.serde.dumps_typed(value)
+            document = {"channel": channel, "type": type_, "value": serialized_value}
+            if self.ttl: document["created_at"] = created_at
+
+            operations.append(UpdateOne({
+                "thread_id": configurable["thread_id"], "checkpoint_ns": configurable["checkpoint_ns"],
+                "checkpoint_id": configurable["checkpoint_id"], "task_id": task_id, "task_path": task_path,
+                "idx": WRITES_IDX_MAP.get(channel, idx)
+            }, {set_method: document}, upsert=True))
+
+        if operations: self.writes_collection.bulk_write(operations, ordered=False)
+
+    def _tuples(self, documents: Sequence[dict[str, Any]]) -> Iterator[CheckpointTuple]:
+        if not documents: return
+        pending_writes = defaultdict(list)
+        writes = self.writes_collection.find({
+            "thread_id": {"$in": list({document["thread_id"] for document in documents})},
+            "checkpoint_id": {"$in": [document["checkpoint_id"] for document in documents]}
+        }, self.WRITE_FIELDS, sort=[("task_id", 1), ("idx", 1)])
+
+        for write in writes:
+            key = (write["thread_id"], write["checkpoint_ns"], write["checkpoint_id"])
+            value = self.serde.loads_typed((write["type"], write["value"]))
+            pending_writes[key].append((write["task_id"], write["channel"], value))
+
+        for document in documents:
+            configurable = {key: document[key] for key in ("thread_id", "checkpoint_ns", "checkpoint_id")}
+            parent_id = document.get("parent_checkpoint_id")
+            yield CheckpointTuple(
+                {"configurable": configurable},
+                self.serde.loads_typed((document["type"], document["checkpoint"])),
+                loads_metadata(document["metadata"]),
+                {"configurable": {**configurable, "checkpoint_id": parent_id}} if parent_id else None,
+                pending_writes[(document["thread_id"], document["checkpoint_ns"], document["checkpoint_id"])]
+            )
+
+
+def sqlite_settings() -> dict[str, Any]:
+    return {
+        "path": os.environ.get("SQLITE_DATABASE_PATH", "chatbot.db"),
+        "readers": int(os.environ.get("SQLITE_READ_POOL_SIZE", 4)),
+        "batch_size": int(os.environ.get("SQLITE_WRITE_BATCH_SIZE", 64)),
+        "busy_timeout": float(os.environ.get("SQLITE_BUSY_TIMEOUT", 5)),
+    }
+
+def sqlite_shard_paths(path: str) -> list[str]:
+    # chatbot.db stays a single file, SQLITE_SHARDS=4 spreads threads over chatbot-0.db ... chatbot-3.db
+    shards = int(os.environ.get("SQLITE_SHARDS", 1))
+    if shards <= 1: return [path]
+    database = pathlib.Path(path)
+    return [str(database.with_name(f"{database.stem}-{index}{database.suffix}")) for index in range(shards)]
+
+def postgres_shard_uris() -> list[str]:
+    # Several comma separated URIs (databases or servers) spread threads across them
+    return [uri.strip() for uri in os.environ.get("POSTGRES_CONNECTION_URI", "").split(",") if uri.strip()] or [None]
+
+
+def memory_settings() -> dict[str, Any]:
+    max_threads = os.environ.get("MEMORY_MAX_THREADS", "1000")
+    max_mb = os.environ.get("MEMORY_MAX_MB", "256")
+    ttl = os.environ.get("MEMORY_IDLE_TTL", "3600")
+    return {
+        "max_threads": int(max_threads) if max_threads else None,
+        "max_bytes": int(float(max_mb) * 1024 * 1024) if max_mb else None,
+        "ttl": float(ttl) if ttl else None,
+        "latest_only": os.environ.get("MEMORY_LATEST_ONLY", "false").lower() == "true",
+    }
+
+def retention_settings() -> dict[str, Any]:
+    keep_last = os.environ.get("CHECKPOINT_KEEP_LAST")
+    max_age_hours = os.environ.get("CHECKPOINT_MAX_AGE_HOURS")
+    return {
+        "keep_last": int(keep_last) if keep_last else None,
+        "max_age": float(max_age_hours) * 3600 if max_age_hours else None,
+    }
+
+def checkpoint_time(checkpoint_id: str) -> float:
+    # Checkpoint ids are version 6 UUIDs, whose leading bits are 100ns ticks since the Gregorian epoch
+    value = uuid.UUID(checkpoint_id).int
+    ticks = (value >> 96) << 28 | ((value >> 80) & 0xFFFF) << 12 | (value >> 64) & 0xFFF
+    return (ticks - 0x01B21DD213814000) / 1e7
+
+def database_size(cursor: sqlite3.Cursor) -> int:
+    return cursor.execute("PRAGMA page_count").fetchone()[0] * cursor.execute("PRAGMA page_size").fetchone()[0]
+
+
+class SqliteWriteBatch:
+    # Records the statements of one checkpoint operation so the writer thread can run them
+    def __init__(self) -> None:
+        self.statements: list[tuple[str, list[Any]]] = []
+
+    def execute(self, sql: str, parameters: Any = ()) -> None:
+        self.statements.append((sql, [parameters]))
+
+    def executemany(self, sql: str, parameters: Any) -> None:
+        self.statements.append((sql, list(parameters)))
+
+class SqliteWriter:
+    """Owns the only writable connection and commits queued operations in batches"""
+    def __init__(self, connection: sqlite3.Connection, batch_size: int) -> None:
+        self.connection = connection
+        self.batch_size = max(1, batch_size)
+        self.queue: queue.Queue = queue.Queue()
+        self.batches = self.operations = 0
+        self.thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, operation: list[tuple[str, list[Any]]] | Callable[[sqlite3.Connection], Any]) -> Any:
+        # Blocks until the batch holding these statements is committed, so a following read sees them. A callable is
+        # maintenance work (e.g. VACUUM) that runs on the writer connection between batches, outside any transaction
+        future = Future()
+        self.queue.put((operation, future))
+        return future.result()
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try: batch.append(self.queue.get_nowait())
+                except queue.Empty: break
+
+            closing = None in batch
+            batch = [operation for operation in batch if operation is not None]
+            writes = [operation for operation in batch if not callable(operation[0])]
+            if writes: self._commit(writes)
+            for function, future in (operation for operation in batch if callable(operation[0])):
+                try: future.set_result(function(self.connection))
+                except Exception as error: future.set_exception(error)
+            if closing:
+                self.connection.close()
+                return
+
+    def _commit(self, batch: list[tuple[list[tuple[str, list[Any]]], Future]]) -> None:
+        # Every operation runs in its own savepoint, so a failing write does not roll back the rest of the batch
+        cursor = self.connection.cursor()
+        try:
+            errors = []
+            cursor.execute("BEGIN IMMEDIATE")
+            for statements, _ in batch:
+                cursor.execute("SAVEPOINT operation")
+                try:
+                    for sql, parameters in statements: cursor.executemany(sql, parameters)
+                    errors.append(None)
+                except Exception as error:
+                    cursor.execute("ROLLBACK TO operation")
+                    errors.append(error)
+                cursor.execute("RELEASE operation")
+            cursor.execute("COMMIT")
+        except Exception as error:
+            if self.connection.in_transaction: self.connection.rollback()
+            errors = [error] * len(batch)
+        finally:
+            cursor.close()
+
+        self.batches += 1
+        self.operations += len(batch)
+        for (_, future), error in zip(batch, errors):
+            if error is None: future.set_result(None)
+            else: future.set_exception(error)
+
+
+# State channels whose messages are mirrored into the message log
+LOGGED_CHANNELS = ("messages", "queries")
+
+MESSAGE_LOG_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS message_log (
+        seq INTEGER PRIMARY KEY,
+        thread_id TEXT NOT NULL,
+        channel TEXT NOT NULL,
+        checkpoint_id TEXT NOT NULL DEFAULT '',
+        source TEXT NOT NULL,
+        message_id TEXT,
+        role TEXT NOT NULL,
+        content TEXT,
+        tool TEXT,
+        UNIQUE (thread_id, source)
+    );
+"""
+
+# Writes of consecutive steps reach the writer in any order, so history is ordered by checkpoint and then arrival
+MESSAGE_LOG_INDEX = """
+    DROP INDEX IF EXISTS message_log_history;
+    CREATE INDEX IF NOT EXISTS message_log_order ON message_log (thread_id, channel, checkpoint_id, seq);
+"""
+
+def message_log_statements(config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str) -> list[Any]:
+    # Every write is identified by its checkpoint, task and position, so a replayed write is not logged twice.
+    # Writes inside subgraphs are internal to one node and are left out
+    thread_id, checkpoint_ns = str(config["configurable"]["thread_id"]), config["configurable"].get("checkpoint_ns", "")
+    checkpoint_id = config["configurable"]["checkpoint_id"]
+    statements = []
+    if checkpoint_ns: return statements
+
+    for index, (channel, value) in enumerate(writes):
+        if channel not in LOGGED_CHANNELS or value is None: continue
+        values = value if isinstance(value, list) else [value]
+
+        for position, message in enumerate(convert_to_messages(values)):
+            if isinstance(message, RemoveMessage):
+                if message.id == REMOVE_ALL_MESSAGES:
+                    # Messages of later steps may already be logged
+                    statements.append((
+                        "DELETE FROM message_log WHERE thread_id = ? AND channel = ? AND checkpoint_id <= ?",
+                        [(thread_id, channel, checkpoint_id)]
+                    ))
+                else:
+                    statements.append((
+                        "DELETE FROM message_log WHERE thread_id = ? AND channel = ? AND message_id = ?",
+                        [(thread_id, channel, message.id)]
+                    ))
+                continue
+
+            if message.type == "ai" and message.tool_calls: tool = json.dumps(message.tool_calls)
+            elif message.type == "tool": tool = json.dumps({"name": message.name, "tool_call_id": message.tool_call_id})
+            else: tool = None
+            content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+            source = f"{checkpoint_id}:{task_id}:{index}:{position}"
+
+            statements.append((
+                "INSERT OR IGNORE INTO message_log "
+                "(thread_id, channel, checkpoint_id, source, message_id, role, content, tool) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(thread_id, channel, checkpoint_id, source, message.id, message.type, content, tool)]
+            ))
+
+    return statements
+
+
+class WalSqliteSaver(SqliteSaver):
+    """SqliteSaver in WAL mode that writes through a single writer thread and reads through read-only connections"""
+    def __init__(
+        self, path: str, readers: int = 4, batch_size: int = 64, busy_timeout: float = 5,
+        serde: SerializerProtocol | None = None
+    ) -> None:
+        self.path = path
+        self._reading = threading.local()
+        self._logging = threading.local()
+        connection = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        super().__init__(connection, serde=serde)
+        # The base setup switches the database to WAL, which has to happen before any reader connects
+        self.setup()
+        connection.execute("PRAGMA synchronous=NORMAL")
+        self.writer = SqliteWriter(connection, batch_size)
+        self.compactor: CheckpointCompactor | None = None
+
+        uri = pathlib.Path(path).resolve().as_uri() + "?mode=ro"
+        self.readers: queue.Queue = queue.Queue()
+        for _ in range(max(1, readers)):
+            self.readers.put(sqlite3.connect(uri, uri=True, timeout=busy_timeout, check_same_thread=False))
+
+    def setup(self) -> None:
+        if self.is_setup: return
+        super().setup()
+        self.conn.executescript(MESSAGE_LOG_SCHEMA)
+
+        # Logs created before checkpoint ordering take the id from the start of their source
+        if "checkpoint_id" not in {column[1] for column in self.conn.execute("PRAGMA table_info(message_log)")}:
+            self.conn.executescript(
+                "ALTER TABLE message_log ADD COLUMN checkpoint_id TEXT NOT NULL DEFAULT '';"
+                "UPDATE message_log SET checkpoint_id = substr(source, 1, instr(source, ':') - 1);"
+            )
+        self.conn.executescript(MESSAGE_LOG_INDEX)
+
+    def put_writes(
+        self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = ""
+    ) -> None:
+        # The log rows ride in the same operation as the writes, so a crash never commits one without the other
+        self._logging.statements = message_log_statements(config, writes, task_id)
+        try: super().put_writes(config, writes, task_id, task_path)
+        finally: self._logging.statements = []
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        self.writer.submit([("DELETE FROM message_log WHERE thread_id = ?", [(str(thread_id),)])])
+
+    def get_history(
+        self, thread_id: str, before: int | None = None, limit: int = 50, channel: str = "messages"
+    ) -> list[dict[str, Any]]:
+        """
+        Returns up to `limit` logged messages of a thread that precede the one with sequence number `before` (the newest
+        when None), oldest first. Each record holds its `seq`, `role` (the message type), `content` and `tool` payload.
+        """
+        older = "" if before is None else " AND (checkpoint_id, seq) < (SELECT checkpoint_id, seq FROM message_log WHERE seq = ?)"
+        with self.cursor(transaction=False) as cursor:
+            rows = cursor.execute(
+                f"SELECT seq, role, content, tool FROM message_log WHERE thread_id = ? AND channel = ?{older} "
+                "ORDER BY checkpoint_id DESC, seq DESC LIMIT ?",
+                (str(thread_id), channel, *([] if before is None else [before]), limit)
+            ).fetchall()
+
+        return [
+            {"seq": seq, "role": role, "content": content, "tool": json.loads(tool) if tool else None}
+            for seq, role, content, tool in reversed(rows)
+        ]
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # The base list() fetches pending writes through self.conn, so readers see their own connection here
+        return getattr(self._reading, "connection", None) or self._writer_connection
+
+    @conn.setter
+    def conn(self, connection: sqlite3.Connection) -> None:
+        self._writer_connection = connection
+
+    @contextlib.contextmanager
+    def cursor(self, transaction: bool = True) -> Iterator[Any]:
+        if transaction:
+            batch = SqliteWriteBatch()
+            yield batch
+            self.writer.submit(batch.statements + getattr(self._logging, "statements", []))
+            return
+
+        connection = self.readers.get()
+        previous = getattr(self._reading, "connection", None)
+        self._reading.connection = connection
+        cursor = connection.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+            self._reading.connection = previous
+            self.readers.put(connection)
+
+    def compact(self, keep_last: int | None = None, max_age: float | None = None, vacuum: bool = True) -> dict[str, Any]:
+        """
+        Drops checkpoints that are both beyond the last `keep_last` of their thread and older than `max_age` seconds
+        (a limit left as None does not restrict). A thread's newest checkpoint is always kept, and the oldest one kept
+        becomes the thread's root, so the dropped history collapses into it.
+        """
+        if keep_last is None and max_age is None: return {"deleted": 0, "threads": 0, "vacuumed": False}
+        cutoff = time.time() - max_age if max_age is not None else None
+
+        with self.cursor(transaction=False) as cursor:
+            size_before = database_size(cursor)
+            rows = cursor.execute(
+                "SELECT thread_id, checkpoint_ns, checkpoint_id, ROW_NUMBER() OVER "
+                "(PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) FROM checkpoints"
+            ).fetchall()
+
+        expired, roots = [], {}
+        for thread_id, checkpoint_ns, checkpoint_id, position in rows:
+            if position > 1 and (keep_last is None or position > keep_last) and \
+               (cutoff is None or checkpoint_time(checkpoint_id) < cutoff):
+                expired.append((thread_id, checkpoint_ns, checkpoint_id))
+            else:
+                root = roots.get((thread_id, checkpoint_ns))
+                roots[(thread_id, checkpoint_ns)] = min(root, checkpoint_id) if root else checkpoint_id
+
+        # Deleted in chunks, so chat writes queued meanwhile are not held behind one long transaction
+        for start in range(0, len(expired), 500):
+            chunk = expired[start:start + 500]
+            self.writer.submit([
+                ("DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", chunk),
+                ("DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", chunk),
+            ])
+
+        compacted = {(thread_id, checkpoint_ns) for thread_id, checkpoint_ns, _ in expired}
+        if compacted:
+            self.writer.submit([(
+                "UPDATE checkpoints SET parent_checkpoint_id = NULL "
+                "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                [(*thread, roots[thread]) for thread in compacted]
+            )])
+
+        if vacuum and expired:
+            def vacuum_database(connection: sqlite3.Connection) -> None:
+                connection.execute("VACUUM")
+                connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.writer.submit(vacuum_database)
+
+        with self.cursor(transaction=False) as cursor:
+            size_after = database_size(cursor)
+
+        return {
+            "deleted": len(expired), "threads": len(compacted), "vacuumed": bool(vacuum and expired),
+            "size_before": size_before, "size_after": size_after
+        }
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "batches": self.writer.batches,
+            "operations": self.writer.operations,
+            "queued_writes": self.writer.queue.qsize(),
+            "idle_readers": self.readers.qsize(),
+        }
+
+    def close(self) -> None:
+        if self.compactor: self.compactor.stop()
+        self.writer.close()
+        while not self.readers.empty(): self.readers.get_nowait().close()
+
+class CheckpointCompactor:
+    """Applies a saver's retention policy on an interval from a background thread while the app keeps serving"""
+    def __init__(self, saver: WalSqliteSaver, interval: float, **policy: Any) -> None:
+        self.saver = saver
+        self.interval = interval
+        self.policy = policy
+        self.last_result: dict[str, Any] | None = None
+        self._stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="checkpoint-compactor", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try: self.last_result = self.saver.compact(**self.policy)
+            except Exception as error: self.last_result = {"error": repr(error)}
+
+class WalAsyncSqliteSaver(AsyncSqliteSaver):
+    # aiosqlite runs every statement on the connection's own thread, which already makes it the single writer
+    async def setup(self) -> None:
+        if self.is_setup: return
+        await super().setup()
+        await self.conn.execute("PRAGMA synchronous=NORMAL")
+
+
+class BoundedMemorySaver(InMemorySaver):
+    """
+    InMemorySaver that evicts the least recently used threads beyond `max_threads` or `max_bytes` of serialized
+    checkpoints, and threads idle for longer than `ttl` seconds. With `latest_only` a thread keeps only its newest
+    checkpoint, which is all a graph needs to resume.
+    """
+    def __init__(
+        self, max_threads: int | None = None, max_bytes: int | None = None, ttl: float | None = None,
+        latest_only: bool = False, serde: SerializerProtocol | None = None
+    ) -> None:
+        super().__init__(serde=serde)
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.latest_only = latest_only
+        # thread_id -> {"bytes", "accessed", "blobs", "writes"}, least recently used first
+        self.threads: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self.bytes = 0
+        self.evicted = {"lru": 0, "ttl": 0}
+        self.lock = threading.RLock()
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        with self.lock:
+            thread_id = config["configurable"]["thread_id"]
+            self._expire()
+            saved = super().get_tuple(config)
+            # The base class's defaultdicts create entries for everything it looks up, so they are tracked as well
+            if thread_id not in self.threads: self.storage.pop(thread_id, None)
+            elif saved: self._track_reads([saved])
+            return saved
+
+    def list(self, config: RunnableConfig | None, **kwargs: Any) -> Iterator[CheckpointTuple]:
+        with self.lock:
+            saved = list(super().list(config, **kwargs))
+            self._track_reads(saved)
+        yield from saved
+
+    def put(
+        self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions
+    ) -> RunnableConfig:
+        with self.lock:
+            saved_config = super().put(config, checkpoint, metadata, new_versions)
+            thread_id, checkpoint_ns = config["configurable"]["thread_id"], config["configurable"]["checkpoint_ns"]
+            thread = self._touch(thread_id)
+
+            entry = self.storage[thread_id][checkpoint_ns][checkpoint["id"]]
+            added = len(entry[0][1]) + len(entry[1][1])
+            for channel, version in new_versions.items():
+                key = (thread_id, checkpoint_ns, channel, version)
+                thread["blobs"].add(key)
+                added += len(self.blobs[key][1] or b"")
+            self._resize(thread, added)
+
+            if self.latest_only: self._drop_history(thread_id, checkpoint_ns, checkpoint)
+            self._evict()
+            return saved_config
+
+    def put_writes(
+        self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = ""
+    ) -> None:
+        with self.lock:
+            thread_id = config["configurable"]["thread_id"]
+            key = (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+            before = self._writes_size(key)
+            super().put_writes(config, writes, task_id, task_path)
+
+            thread = self._touch(thread_id)
+            thread["writes"].add(key)
+            self._resize(thread, self._writes_size(key) - before)
+            self._evict()
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self.lock:
+            thread = self.threads.pop(thread_id, None)
+            if thread is None: return super().delete_thread(thread_id)
+
+            self.storage.pop(thread_id, None)
+            for key in thread["writes"]: self.writes.pop(key, None)
+            for key in thread["blobs"]: self.blobs.pop(key, None)
+            self.bytes -= thread["bytes"]
+
+    def stats(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                "threads": len(self.threads),
+                "checkpoints": sum(len(saved) for namespaces in self.storage.values() for saved in namespaces.values()),
+                "bytes": self.bytes,
+                "max_threads": self.max_threads,
+                "max_bytes": self.max_bytes,
+                "evicted_lru": self.evicted["lru"],
+                "evicted_ttl": self.evicted["ttl"],
+            }
+
+    def _touch(self, thread_id: str) -> dict[str, Any]:
+        thread = self.threads.get(thread_id)
+        if thread is None: thread = self.threads[thread_id] = {"bytes": 0, "blobs": set(), "writes": set()}
+        thread["accessed"] = time.monotonic()
+        self.threads.move_to_end(thread_id)
+        return thread
+
+    def _track_reads(self, saved: Sequence[CheckpointTuple]) -> None:
+        for checkpoint in saved:
+            configurable = checkpoint.config["configurable"]
+            thread = self.threads.get(configurable["thread_id"])
+            if thread is None: continue
+            thread["writes"].add((configurable["thread_id"], configurable["checkpoint_ns"], configurable["checkpoint_id"]))
+            self._touch(configurable["thread_id"])
+
+    def _resize(self, thread: dict[str, Any], change: int) -> None:
+        thread["bytes"] += change
+        self.bytes += change
+
+    def _writes_size(self, key: tuple[str, str, str]) -> int:
+        return sum(len(value[1] or b"") for _, _, value, _ in self.writes.get(key, {}).values())
+
+    def _drop_history(self, thread_id: str, checkpoint_ns: str, checkpoint: Checkpoint) -> None:
+        thread, checkpoints, removed = self.threads[thread_id], self.storage[thread_id][checkpoint_ns], 0
+        for checkpoint_id in [checkpoint_id for checkpoint_id in checkpoints if checkpoint_id != checkpoint["id"]]:
+            entry = checkpoints.pop(checkpoint_id)
+            removed += len(entry[0][1]) + len(entry[1][1])
+            key = (thread_id, checkpoint_ns, checkpoint_id)
+            removed += self._writes_size(key)
+            self.writes.pop(key, None)
+            thread["writes"].discard(key)
+
+        # Channel values the newest checkpoint still points at are kept, older versions are not
+        versions = checkpoint["channel_versions"]
+        for key in [key for key in thread["blobs"] if key[1] == checkpoint_ns and versions.get(key[2]) != key[3]]:
+            removed += len(self.blobs.pop(key)[1] or b"")
+            thread["blobs"].discard(key)
+        self._resize(thread, -removed)
+
+    def _expire(self) -> None:
+        if self.ttl is None: return
+        deadline = time.monotonic() - self.ttl
+        while self.threads and next(iter(self.threads.values()))["accessed"] < deadline:
+            self.delete_thread(next(iter(self.threads)))
+            self.evicted["ttl"] += 1
+
+    def _evict(self) -> None:
+        self._expire()
+        # The most recently used thread is never evicted, even when it alone is over the byte limit
+        while len(self.threads) > 1 and (
+            (self.max_threads is not None and len(self.threads) > self.max_threads) or
+            (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            self.delete_thread(next(iter(self.threads)))
+            self.evicted["lru"] += 1
+
+
+class ShardedSaver(BaseCheckpointSaver):
+    """
+    Routes every thread to one of several savers by a stable hash of its thread id, so concurrent sessions spread over
+    separate databases instead of contending on one. Changing the number of shards moves threads to other shards.
+    """
+    def __init__(self, shards: Sequence[BaseCheckpointSaver]) -> None:
+        super().__init__(serde=shards[0].serde)
+        self.shards = list(shards)
+
+    def shard(self, thread_id: str) -> BaseCheckpointSaver:
+        digest = hashlib.blake2b(str(thread_id).encode(), digest_size=8).digest()
+        return self.shards[int.from_bytes(digest, "big") % len(self.shards)]
+
+    def _route(self, config: RunnableConfig) -> BaseCheckpointSaver:
+        return self.shard(config["configurable"]["thread_id"])
+
+    def _routable(self, config: RunnableConfig | None) -> bool:
+        return bool(config) and "thread_id" in config.get("configurable", {})
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return self._route(config).get_tuple(config)
+
+    def list(self, config: RunnableConfig | None, *, limit: int | None = None, **kwargs: Any) -> Iterator[CheckpointTuple]:
+        if self._routable(config): yield from self._route(config).list(config, limit=limit, **kwargs)
+        else:
+            saved = itertools.chain.from_iterable(shard.list(config, limit=limit, **kwargs) for shard in self.shards)
+            yield from itertools.islice(saved, limit)
+
+    def put(
+        self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions
+    ) -> RunnableConfig:
+        return self._route(config).put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(
+        self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = ""
+    ) -> None:
+        self._route(config).put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        self.shard(thread_id).delete_thread(thread_id)
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return await self._route(config).aget_tuple(config)
+
+    async def alist(
+        self, config: RunnableConfig | None, *, limit: int | None = None, **kwargs: Any
+    ) -> AsyncIterator[CheckpointTuple]:
+        shards = [self._route(config)] if self._routable(config) else self.shards
+        count = 0
+        for shard in shards:
+            async for saved in shard.alist(config, limit=limit, **kwargs):
+                if limit is not None and count >= limit: return
+                count += 1
+                yield saved
+
+    async def aput(
+        self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions
+    ) -> RunnableConfig:
+        return await self._route(config).aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = ""
+    ) -> None:
+        await self._route(config).aput_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await self.shard(thread_id).adelete_thread(thread_id)
+
+    def get_next_version(self, current: Any, channel: None) -> Any:
+        return self.shards[0].get_next_version(current, channel)
+
+    def get_history(self, thread_id: str, *args: Any, **kwargs: Any) -> Sequence[dict[str, Any]]:
+        get_history = getattr(self.shard(thread_id), "get_history", None)
+        return get_history(thread_id, *args, **kwargs) if get_history else []
+
+    def compact(self, **policy: Any) -> dict[str, Any]:
+        results = [shard.compact(**policy) for shard in self.shards if isinstance(shard, WalSqliteSaver)]
+        return {
+            "deleted": sum(result["deleted"] for result in results),
+            "threads": sum(result["threads"] for result in results),
+            "vacuumed": any(result["vacuumed"] for result in results),
+            "shards": results
+        }
+
+    def stats(self) -> dict[str, Any]:
+        return {"shards": [shard.stats() if hasattr(shard, "stats") else {} for shard in self.shards]}
+
+    def close(self) -> None:
+        for shard in self.shards:
+            if hasattr(shard, "close"): shard.close()
 
 
 class Storage:
+    # Synchronous database savers are shared by every graph using the same database
+    _shared: dict[str, Any] = {}
+    _shared_lock = threading.Lock()
+
     def __init__(
         self,
         mode: Literal["memory", "database"],
-        database: Literal["sqlite", "mongo", "postgres"] = "sqlite"
+        database: Literal["sqlite", "mongo", "postgres"] = "sqlite",
+        asynchronous: bool = False
     ) -> None:
-        if mode == "memory": self.storage = InMemorySaver()
+        if mode == "memory": self.storage = BoundedMemorySaver(**memory_settings())
+        elif asynchronous:
+            # Async savers are bound to the running event loop, so every graph built inside it gets its own
+            if database == "postgres": self.storage = self._set_async_postgres_storage()
+            elif database == "sqlite": self.storage = self._set_async_sqlite_storage()
+            else: raise ValueError(f"No async checkpointer for {database!r}")
         else:
-            if database == "mongo": self.storage = self._set_mongo_storage()
-            elif database == "postgres": self.storage = self._set_postgres_storage()
-            else: self.storage = self._set_sqlite_storage()
-    
-    def _set_sqlite_storage(self) -> SqliteSaver:
-        connection = sqlite3.connect("chatbot.db", check_same_thread=False)
-        return SqliteSaver(connection)
-    
-    def _set_mongo_storage(self) -> MongoDBSaver:
-        connection = MongoClient(os.environ.get("MONGODB_CONNECTION_URI"))
-        return MongoDBSaver(client=connection)
-    
-    def _set_postgres_storage(self) -> PostgresSaver:
-        connection = psycopg.connect(os.environ.get("POSTGRES_CONNECTION_URI"))
-        return PostgresSaver(connection)
+            with self._shared_lock:
+                if database not in self._shared:
+                    if database == "mongo": self._shared[database] = self._set_mongo_storage()
+                    elif database == "postgres": self._shared[database] = self._set_postgres_storage()
+                    else: self._shared[database] = self._set_sqlite_storage()
+
+                self.storage = self._shared[database]
+
+    def stats(self) -> dict[str, Any]:
+        pool = getattr(self.storage, "conn", None)
+        if isinstance(self.storage, (WalSqliteSaver, BoundedMemorySaver, ShardedSaver)): stats = self.storage.stats()
+        elif isinstance(pool, (ConnectionPool, AsyncConnectionPool)): stats = pool.get_stats()
+        else: stats = {}
+
+        if isinstance(self.storage.serde, ZstdSerializer): stats["serializer"] = self.storage.serde.stats()
+        return stats
+
+    def compact(self, **policy: Any) -> dict[str, Any]:
+        # Falls back to the configured retention policy, only the sqlite saver supports compaction
+        if not isinstance(self.storage, (WalSqliteSaver, ShardedSaver)): return {}
+        return self.storage.compact(**(policy or retention_settings()))
+
+    def _set_sqlite_storage(self) -> WalSqliteSaver | ShardedSaver:
+        settings, policy = sqlite_settings(), retention_settings()
+        interval = float(os.environ.get("CHECKPOINT_COMPACTION_INTERVAL", 3600))
+        shards = []
+
+        paths = sqlite_shard_paths(settings["path"])
+        # Dictionaries of every shard live in the first one
+        serde = checkpoint_serializer(f"sqlite:{paths[0]}", lambda: SqliteDictionaryStore(paths[0]))
+
+        for path in paths:
+            storage = WalSqliteSaver(**{**settings, "path": path}, serde=serde)
+            if (policy["keep_last"] is not None or policy["max_age"] is not None) and interval > 0:
+                storage.compactor = CheckpointCompactor(storage, interval, **policy)
+            shards.append(storage)
+
+        return shards[0] if len(shards) == 1 else ShardedSaver(shards)
+
+    def _set_async_sqlite_storage(self) -> WalAsyncSqliteSaver | ShardedSaver:
+        settings = sqlite_settings()
+        paths = sqlite_shard_paths(settings["path"])
+        serde = checkpoint_serializer(f"sqlite:{paths[0]}", lambda: SqliteDictionaryStore(paths[0]))
+        shards = [
+            WalAsyncSqliteSaver(aiosqlite.connect(path, timeout=settings["busy_timeout"]), serde=serde) for path in paths
+        ]
+        return shards[0] if len(shards) == 1 else ShardedSaver(shards)
+
+    def _set_mongo_storage(self) -> TunedMongoDBSaver:
+        connection = MongoClient(uri := os.environ.get("MONGODB_CONNECTION_URI"), **mongo_client_settings())
+        storage = TunedMongoDBSaver(connection)
+        # MongoDBSaver takes no serde argument
+        dictionaries = lambda: MongoDictionaryStore(storage.db["checkpoint_dictionaries"])
+        if serde := checkpoint_serializer(f"mongo:{uri}", dictionaries): storage.serde = serde
+        return storage
+
+    def _set_postgres_storage(self) -> PooledPostgresSaver | ShardedSaver:
+        shards, uris = [], postgres_shard_uris()
+        serde = checkpoint_serializer(f"postgres:{uris[0]}", lambda: PostgresDictionaryStore(uris[0]))
+
+        for uri in uris:
+            # Connections are health checked on checkout and recycled when idle, replacing broken ones transparently
+            pool = ConnectionPool(
+                uri, kwargs=POSTGRES_CONNECTION_KWARGS,
+                check=ConnectionPool.check_connection, open=True, **postgres_pool_settings()
+            )
+            storage = PooledPostgresSaver(pool, serde)
+            storage.setup()
+            shards.append(storage)
+
+        return shards[0] if len(shards) == 1 else ShardedSaver(shards)
+
+    def _set_async_postgres_storage(self) -> PooledAsyncPostgresSaver | ShardedSaver:
+        uris = postgres_shard_uris()
+        serde = checkpoint_serializer(f"postgres:{uris[0]}", lambda: PostgresDictionaryStore(uris[0]))
+        shards = [
+            PooledAsyncPostgresSaver(AsyncConnectionPool(
+                uri, kwargs=POSTGRES_CONNECTION_KWARGS,
+                check=AsyncConnectionPool.check_connection, open=False, **postgres_pool_settings()
+            ), serde)
+            for uri in uris
+        ]
+        return shards[0] if len(shards) == 1 else ShardedSaver(shards)
+
+
+def main() -> None:
+    # python -m backend.storage compact --keep-last 20
+    # python -m backend.storage train-dictionary
+    parser = argparse.ArgumentParser(description="Maintain the sqlite checkpoint database")
+    parser.add_argument("command", choices=["compact", "train-dictionary"])
+    parser.add_argument("--keep-last", type=int, help="checkpoints kept per thread, defaults to CHECKPOINT_KEEP_LAST")
+    parser.add_argument("--max-age-hours", type=float, help="keep newer checkpoints, defaults to CHECKPOINT_MAX_AGE_HOURS")
+    parser.add_argument("--no-vacuum", action="store_true")
+    parser.add_argument("--dictionary-size", type=int, default=112640, help="bytes of the trained zstd dictionary")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.command == "train-dictionary": return train_dictionary(args.dictionary_size)
+
+    policy = retention_settings()
+    if args.keep_last is not None: policy["keep_last"] = args.keep_last
+    if args.max_age_hours is not None: policy["max_age"] = args.max_age_hours * 3600
+    if policy["keep_last"] is None and policy["max_age"] is None:
+        sys.exit("No retention policy, pass --keep-last/--max-age-hours or set CHECKPOINT_KEEP_LAST/MAX_AGE_HOURS")
+
+    settings = sqlite_settings()
+    for path in sqlite_shard_paths(settings["path"]):
+        storage = WalSqliteSaver(**{**settings, "path": path})
+        try: print(path, storage.compact(**policy, vacuum=not args.no_vacuum))
+        finally: storage.close()
+
+def train_dictionary(size: int) -> None:
+    # Trains on the checkpoints and writes already stored, new blobs are compressed with the result
+    settings, samples = sqlite_settings(), []
+    paths = sqlite_shard_paths(settings["path"])
+    serde = ZstdSerializer(
+        dictionaries=SqliteDictionaryStore(paths[0]),
+        legacy_directory=os.environ.get("CHECKPOINT_DICTIONARY_DIR", "checkpoint_dictionaries")
+    )
+    for path in paths:
+        storage = WalSqliteSaver(**{**settings, "path": path})
+        try:
+            with storage.cursor(transaction=False) as cursor:
+                rows = cursor.execute("SELECT type, checkpoint FROM checkpoints UNION ALL SELECT type, value FROM writes")
+                samples += [
+                    serde.raw_blob(type_.split(":")[1], blob) if (type_ or "").startswith(f"{serde.PREFIX}:") else blob
+                    for type_, blob in rows if blob
+                ]
+        finally: storage.close()
+
+    try: key = serde.train(samples, size)
+    except zstandard.ZstdError as error: sys.exit(f"Training failed on {len(samples)} samples: {error}")
+    print({"dictionary": key, "samples": len(samples), "store": str(serde.store)})
+
+
+if __name__ == "__main__":
+    main()
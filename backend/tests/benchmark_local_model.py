@@ -0,0 +1,104 @@
+"""
+Benchmarks LocalModel CPU modes against the float32 baseline. Every mode loads the model in a fresh process, so the
+reported peak RSS belongs to that mode alone.
+
+    python -m backend.tests.benchmark_local_model --model TinyLlama/TinyLlama-1.1B-Chat-v1.0 --threads 4
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+import multiprocessing
+
+# Mode name -> (dtype, environment)
+MODES = {
+    "fp32": (None, {}),
+    "bf16": ("bfloat16", {}),
+    "int8": (None, {"LLM_QUANTIZATION": "int8"}),
+    "fp32+compile": (None, {"LLM_COMPILE": "true"}),
+    "bf16+compile": ("bfloat16", {"LLM_COMPILE": "true"}),
+    "int8+compile": (None, {"LLM_QUANTIZATION": "int8", "LLM_COMPILE": "true"}),
+}
+
+PROMPTS = [
+    "Summarise today's top world news in three sentences.",
+    "Explain the difference between a process and a thread.",
+    "Write a short note about the history of the printing press.",
+]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_mode(model: str, mode: str, threads: int, max_new_tokens: int, results: multiprocessing.Queue) -> None:
+    dtype, environ = MODES[mode]
+    os.environ.update(environ, LLM_PREFIX_CACHE_MB="0", LLM_MAX_BATCH_SIZE="1")
+    if threads: os.environ["LLM_NUM_THREADS"] = str(threads)
+
+    from langchain_core.messages import HumanMessage
+    from backend.llms import LocalModel
+
+    start = time.perf_counter()
+    llm = LocalModel(model, dtype=dtype, device="cpu")
+    llm.max_new_tokens = max_new_tokens
+    load_seconds = time.perf_counter() - start
+
+    # One untimed generation so lazy initialisation does not count against the first prompt
+    llm.invoke([HumanMessage(content=PROMPTS[0])])
+    tokens = 0
+    start = time.perf_counter()
+
+    for prompt in PROMPTS:
+        input_ids, boundaries = llm._encode(llm._build_segments([HumanMessage(content=prompt)]))
+        tokens += llm._run_generation(input_ids, boundaries).shape[1] - input_ids.shape[1]
+
+    elapsed = time.perf_counter() - start
+    results.put({
+        "mode": mode,
+        "compiled": llm.compiled,
+        "load_seconds": load_seconds,
+        "tokens": tokens,
+        "tokens_per_second": tokens / elapsed,
+        "peak_rss_mb": peak_rss_mb()
+    })
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.environ.get("LLM_MODEL_NAME", "TinyLlama/TinyLlama-1.1B-Chat-v1.0"))
+    parser.add_argument("--modes", nargs="+", default=["fp32", "bf16", "int8", "int8+compile"], choices=list(MODES))
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads per worker, 0 keeps the default")
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    rows = []
+
+    for mode in ["fp32"] + [mode for mode in args.modes if mode != "fp32"]:
+        process = context.Process(target=run_mode, args=(args.model, mode, args.threads, args.max_new_tokens, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print(f"❌ {mode} failed with exit code {process.exitcode}")
+            continue
+        rows.append(results.get())
+
+    baseline = rows[0] if rows and rows[0]["mode"] == "fp32" else None
+    print(f"\n{'mode':<14}{'load s':>8}{'tokens':>8}{'tok/s':>9}{'speedup':>9}{'RSS MB':>9}{'RSS':>7}  compiled")
+
+    for row in rows:
+        speedup = row["tokens_per_second"] / baseline["tokens_per_second"] if baseline else float("nan")
+        rss_ratio = row["peak_rss_mb"] / baseline["peak_rss_mb"] if baseline else float("nan")
+        print(
+            f"{row['mode']:<14}{row['load_seconds']:>8.1f}{row['tokens']:>8}{row['tokens_per_second']:>9.1f}"
+            f"{speedup:>8.2f}x{row['peak_rss_mb']:>9.0f}{rss_ratio:>6.2f}x  {row['compiled']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import os
+import time
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+import sys
+
+# Create mock modules for dependencies that need system libraries
+mock_weasyprint = MagicMock()
+mock_weasyprint.__spec__ = MagicMock()
+sys.modules.setdefault("weasyprint", mock_weasyprint)
+
+from backend import tools
+from backend.artifacts import ArtifactStore, content_hash
+from backend.rendering import PdfRenderer, csv_chunks
+
+
+def thread(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+class TestArtifactStore(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def spilled(self) -> list:
+        return [file for _, _, files in os.walk(self.directory) for file in files]
+
+    def test_artifacts_are_content_addressed_per_session(self):
+        store = ArtifactStore(self.directory)
+
+        key = store.put("alice", b"a,b\n1,2\n")
+
+        self.assertEqual(key, content_hash(b"a,b\n1,2\n"))
+        self.assertEqual(store.put("alice", b"a,b\n1,2\n"), key)
+        self.assertEqual(store.get("alice", key), b"a,b\n1,2\n")
+        self.assertIsNone(store.get("bob", key))
+        self.assertEqual((store.exists("alice", key), store.exists("bob", key)), (True, False))
+        self.assertEqual((store.memory_size(), self.spilled()), (8, []))
+
+    def test_least_recently_used_artifacts_spill_to_disk(self):
+        store = ArtifactStore(self.directory, memory_bytes=10)
+        first, second = store.put("alice", b"first"), store.put("alice", b"second")
+
+        # Over the budget, the oldest artifact moved to disk and is still served from there
+        self.assertEqual(store.memory_size(), 6)
+        self.assertEqual(self.spilled(), [first])
+        self.assertEqual(store.get("alice", first), b"first")
+        self.assertEqual(store.get("alice", second), b"second")
+        self.assertLessEqual(store.memory_size(), 10)
+
+        large = store.put("alice", b"x" * 20)
+        self.assertEqual(store.get("alice", large), b"x" * 20)
+        self.assertLessEqual(store.memory_size(), 10)
+
+        # A restarted store still finds what was spilled
+        self.assertEqual(ArtifactStore(self.directory).get("alice", first), b"first")
+
+    def test_unread_artifacts_expire(self):
+        store = ArtifactStore(self.directory, memory_bytes=5, ttl=0.2)
+        key, spilled = store.put("alice", b"kept"), store.put("alice", b"spilled!")
+
+        time.sleep(0.3)
+        store.purge()
+
+        self.assertIsNone(store.get("alice", key))
+        self.assertIsNone(store.get("alice", spilled))
+        self.assertEqual((store.memory_size(), os.listdir(self.directory)), (0, []))
+
+    def test_discarding_a_session_keeps_the_others(self):
+        store = ArtifactStore(self.directory, memory_bytes=5)
+        key = store.put("alice", b"report")
+        store.put("bob", b"report")
+
+        store.discard("alice")
+
+        self.assertIsNone(store.get("alice", key))
+        self.assertEqual(store.get("bob", key), b"report")
+
+
+class TestCsvChunks(unittest.TestCase):
+
+    def test_columns_and_records_are_written_as_csv(self):
+        columns = {"Topic": ["Apples", "Bananas, ripe"], "Price": [1.0, 0.5], "Note": [None, 'say "hi"'], "Unit": "kg"}
+        records = [{"a": 1, "b": "x"}, {"b": "y", "c": True}]
+
+        self.assertEqual(
+            b"".join(csv_chunks(columns)),
+            b'Topic,Price,Note,Unit\nApples,1.0,,kg\n"Bananas, ripe",0.5,"say ""hi""",kg\n'
+        )
+        self.assertEqual(b"".join(csv_chunks(records)), b"a,b,c\n1,x,\n,y,True\n")
+        with self.assertRaises(ValueError): list(csv_chunks({"a": [1, 2], "b": [1]}))
+
+    def test_large_exports_stream_to_disk_in_chunks(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = ArtifactStore(directory.name, memory_bytes=2**16)
+        data = {"id": list(range(50000)), "name": [f"name {index}" for index in range(50000)]}
+
+        chunks = list(csv_chunks(data, chunk_size=2**12))
+        key = store.put_chunks("alice", iter(chunks))
+
+        self.assertGreater(len(chunks), 100)
+        self.assertLess(max(len(chunk) for chunk in chunks), 2**12 + 100)
+        # Larger than the memory budget, the export went to disk instead of memory
+        self.assertEqual(store.memory_size(), 0)
+        self.assertEqual(store.get("alice", key), b"".join(chunks))
+        self.assertEqual(key, content_hash(b"".join(chunks)))
+        self.assertEqual(store.get("alice", store.put_chunks("alice", iter([b"a\n", b"1\n"]))), b"a\n1\n")
+
+
+class TestFileTools(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = ArtifactStore(os.path.join(directory.name, "artifacts"))
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.renderer = PdfRenderer(self.store, executor=executor, render=lambda html: self.release.wait(5) and b"%PDF")
+        for name, value in (("artifact_store", self.store), ("pdf_renderer", self.renderer)):
+            patcher = patch.object(tools, name, lambda value=value: value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_concurrent_sessions_keep_their_own_csv(self):
+        alice = tools.generate_csv_tool.invoke({"data": {"name": ["ada"], "age": [36]}}, thread("alice"))
+        bob = tools.generate_csv_tool.invoke({"data": {"name": ["bo"]}}, thread("bob"))
+
+        self.assertEqual(tools.artifact_bytes(alice), b"name,age\nada,36\n")
+        self.assertEqual(tools.artifact_bytes(bob), b"name\nbo\n")
+        self.assertEqual((alice["session"], alice["mime"]), ("alice", "text/csv"))
+
+    def test_rendered_pdf_is_served_from_the_session_store(self):
+        result = tools.generate_pdf_tool.invoke({"template": "<p>report</p>"}, thread("alice"))
+
+        self.assertIsNone(tools.artifact_bytes(result))
+        self.release.set()
+        self.assertEqual(tools.artifact_bytes(result, 5), b"%PDF")
+
+        # Later reruns read the session's artifact, other sessions never see it
+        self.assertEqual(self.store.get("alice", result["artifact"]), b"%PDF")
+        self.assertEqual(tools.artifact_bytes(result), b"%PDF")
+        self.assertIsNone(tools.artifact_bytes({**result, "session": "bob"}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import sys
+
+# Create mock modules for dependencies that need system libraries
+mock_weasyprint = MagicMock()
+mock_weasyprint.__spec__ = MagicMock()
+sys.modules.setdefault("weasyprint", mock_weasyprint)
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph import StateGraph, START
+from backend import chat_server
+from backend.prompts import prompt_registry
+from backend.llms import token_counter, _remote_counters
+from backend.utilities import ContextWindow
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+def conversation(turns: int, words: int = 10) -> list:
+    messages = []
+
+    for turn in range(turns):
+        messages += [HumanMessage(f"question {turn} " + "word " * words), AIMessage(f"answer {turn} " + "word " * words)]
+
+    return messages
+
+
+class TestContextWindow(unittest.TestCase):
+
+    def setUp(self):
+        self.folded = []
+
+        def summarize(summary, messages):
+            self.folded.append(messages)
+            return (summary + " " if summary else "") + f"summary of {len(messages)}"
+
+        # Each message costs 12 words + 4 framing tokens = 16, the bare prompt 2 + 4 = 6
+        self.window = ContextWindow(count_words, 150, summarize, summary_tokens=20)
+
+    def test_history_within_budget_is_sent_whole(self):
+        history = conversation(3)
+        messages, update = self.window.fit("be helpful", history)
+
+        self.assertEqual(update, {})
+        self.assertEqual(messages[0].content, "be helpful")
+        self.assertEqual(messages[1:], history)
+        self.assertEqual(self.folded, [])
+
+    def test_older_turns_fold_into_the_summary_incrementally(self):
+        history = conversation(6)
+        messages, update = self.window.fit("be helpful", history)
+
+        # (150 - 6 - 20) // 2 = 62 tokens keep the last turn (32) but not the last two (64)
+        self.assertEqual(update, {"summary": "summary of 10", "summarized": 10})
+        self.assertEqual(messages[1:], history[10:])
+        self.assertIn("summary of 10", messages[0].content)
+        self.assertLessEqual(self.window.count(messages), 150)
+
+        # The next turns reuse the cached summary until they overflow again, then only the new drops are summarized
+        history += conversation(3)
+        messages, update = self.window.fit("be helpful", history, **update)
+        self.assertEqual(update, {})
+        self.assertEqual(messages[1:], history[10:])
+
+        history += conversation(2)
+        messages, update = self.window.fit("be helpful", history, "summary of 10", 10)
+        self.assertEqual(update["summarized"], len(history) - 2)
+        self.assertEqual(update["summary"], "summary of 10 summary of 10")
+        self.assertEqual(self.folded[-1], history[10:-2])
+
+    def test_tool_calls_stay_with_their_results(self):
+        tool_call = {"name": "search", "args": {"query": "news"}, "id": "call-1"}
+        latest = [
+            HumanMessage("latest " + "word " * 30), AIMessage("", tool_calls=[tool_call]),
+            ToolMessage("result " + "word " * 30, tool_call_id="call-1")
+        ]
+        history = conversation(3) + latest
+        messages, update = self.window.fit("be helpful", history)
+
+        self.assertEqual(update["summarized"], 6)
+        self.assertEqual(messages[1:], latest)
+
+    def test_tool_definitions_count_against_the_budget(self):
+        history = conversation(3)
+        window = ContextWindow(count_words, 150, self.window.summarize, summary_tokens=20, overhead="tool " * 60)
+
+        # 6 + 96 tokens fit 150 on their own, not with the 60 the tool definitions take
+        messages, update = window.fit("be helpful", history)
+
+        self.assertEqual(update["summarized"], 4)
+        self.assertLessEqual(window.count(messages) + 60, 150)
+
+    def test_oversized_latest_turn_is_truncated_to_fit(self):
+        history = conversation(2) + [HumanMessage("huge " * 400)]
+        messages, update = self.window.fit("be helpful", history)
+
+        self.assertEqual(update["summarized"], 4)
+        self.assertLessEqual(self.window.count(messages), 150)
+        self.assertTrue(messages[-1].content.startswith("huge huge"))
+        self.assertTrue(messages[-1].content.endswith("[truncated to fit the context window]"))
+        # Only the prompt is shortened, the history keeps the whole message
+        self.assertEqual(history[-1].content, "huge " * 400)
+
+    def test_turn_that_cannot_fit_is_rejected(self):
+        window = ContextWindow(count_words, 150, self.window.summarize, overhead="tool " * 200)
+
+        with self.assertRaises(ValueError): window.fit("be helpful", [HumanMessage("question")])
+
+    def test_legacy_system_prompt_in_history_is_dropped(self):
+        history = [SystemMessage("old prompt")] + conversation(6)
+        messages, update = self.window.fit("be helpful", history)
+
+        self.assertEqual([type(message) for message in messages].count(SystemMessage), 1)
+        self.assertNotIn(history[0], self.folded[0])
+        self.assertEqual(update["summarized"], 11)
+
+
+class TestChatFunction(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        prompt_registry.register("chat-test", 1, "be helpful")
+
+    def test_chat_function_sends_the_window_and_caches_the_summary(self):
+        fake_model = MagicMock()
+        fake_model.model.invoke.return_value = AIMessage("reply")
+        fake_model.llm.with_config.return_value.invoke.return_value = AIMessage(" rolled up ")
+        window = ContextWindow(count_words, 150, chat_server.summarize_turns, summary_tokens=20)
+
+        with patch.object(chat_server, "model", lambda: fake_model), \
+             patch.object(chat_server, "chat_context", lambda: window):
+            update = chat_server.chat_function({"messages": conversation(6), "prompt": "chat-test@1"})
+
+        self.assertEqual(update["messages"], [AIMessage("reply")])
+        self.assertEqual((update["summary"], update["summarized"]), ("rolled up", 10))
+        self.assertNotIn("prompt", update)
+
+        sent = fake_model.model.invoke.call_args.args[0]
+        self.assertEqual(len(sent), 3)
+        self.assertTrue(sent[0].content.endswith("rolled up"))
+        self.assertIn("human: question 0", fake_model.llm.with_config.return_value.invoke.call_args.args[0][1].content)
+
+    def test_summary_tokens_are_not_streamed_with_the_reply(self):
+        fake_model = MagicMock()
+        fake_model.llm = FakeListChatModel(responses=["SUMMARY-TEXT"])
+        fake_model.model = FakeListChatModel(responses=["real answer"])
+        window = ContextWindow(count_words, 150, chat_server.summarize_turns, summary_tokens=20)
+        graph = StateGraph(chat_server.ChatState)
+        graph.add_node("chat_node", chat_server.chat_function)
+        graph.add_edge(START, "chat_node")
+        chat = graph.compile(InMemorySaver())
+        config = {"configurable": {"thread_id": "summarized"}}
+
+        with patch.object(chat_server, "model", lambda: fake_model), \
+             patch.object(chat_server, "chat_context", lambda: window):
+            streamed = "".join(
+                chunk.content for chunk, _ in
+                chat.stream({"messages": conversation(6), "prompt": "chat-test@1"}, config, stream_mode="messages")
+            )
+
+        # The history was folded into a summary, but only the answer reached the stream (and the chat log)
+        self.assertEqual(chat.get_state(config).values["summary"], "SUMMARY-TEXT")
+        self.assertEqual(streamed, "real answer")
+
+
+class TestTokenCounter(unittest.TestCase):
+
+    def test_local_tokenizer_is_preferred(self):
+        tokenizer = MagicMock()
+        tokenizer.encode.return_value = [1, 2, 3]
+
+        self.assertEqual(token_counter("tiny-model", tokenizer)("hello"), 3)
+        tokenizer.encode.assert_called_with("hello", add_special_tokens=False)
+
+    def test_falls_back_to_a_character_estimate_without_an_encoding(self):
+        self.addCleanup(_remote_counters.pop, "gemini-2.5-flash", None)
+        with patch("backend.llms.tiktoken.encoding_for_model", side_effect=KeyError("gemini")), \
+             patch("backend.llms.tiktoken.get_encoding", side_effect=ConnectionError("offline")) as get_encoding:
+            count = token_counter("gemini-2.5-flash")
+
+            self.assertEqual(count("a" * 40), 11)
+            self.assertEqual(count("a" * 8), 3)
+
+        # The fallback is remembered, an offline server does not retry the download on every count
+        self.assertEqual(get_encoding.call_count, 1)
+
+    def test_encoding_is_resolved_on_the_first_count_and_shared(self):
+        self.addCleanup(_remote_counters.pop, "gpt-4.1-mini", None)
+        encoding = MagicMock()
+        encoding.encode.return_value = [1, 2]
+
+        with patch("backend.llms.tiktoken.encoding_for_model", return_value=encoding) as encoding_for_model:
+            counts = [token_counter("gpt-4.1-mini"), token_counter("gpt-4.1-mini")]
+            # Building agents does not touch tiktoken, which may block on a download
+            encoding_for_model.assert_not_called()
+
+            self.assertEqual([count("hello") for count in counts], [2, 2])
+            encoding_for_model.assert_called_once_with("gpt-4.1-mini")
+
+
+if __name__ == "__main__":
+    unittest.main()
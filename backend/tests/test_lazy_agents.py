@@ -0,0 +1,69 @@
+import unittest
+from unittest.mock import MagicMock
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Create mock modules for dependencies that need system libraries
+mock_weasyprint = MagicMock()
+mock_weasyprint.__spec__ = MagicMock()
+sys.modules.setdefault("weasyprint", mock_weasyprint)
+
+from backend.utilities import build_once, warm_up
+from backend import operators, news_server, chat_server, interview_server
+
+
+class TestBuildOnce(unittest.TestCase):
+
+    def test_concurrent_callers_share_one_instance(self):
+        calls = []
+        release = threading.Event()
+
+        def factory(name):
+            calls.append(name)
+            release.wait(1)
+            return object()
+
+        getter = build_once(factory, "agent")
+        self.assertFalse(getter.is_built())
+
+        with ThreadPoolExecutor(8) as executor:
+            futures = [executor.submit(getter) for _ in range(8)]
+            release.set()
+            instances = {id(future.result()) for future in futures}
+
+        self.assertEqual(calls, ["agent"])
+        self.assertEqual(len(instances), 1)
+        self.assertTrue(getter.is_built())
+
+    def test_warm_up_builds_in_background_once(self):
+        calls = []
+        getter = build_once(lambda: calls.append("built") or "agent")
+
+        thread = warm_up(getter)
+        thread.join(5)
+
+        self.assertEqual(calls, ["built"])
+        self.assertIsNone(warm_up(getter))
+        self.assertEqual(getter(), "agent")
+
+
+class TestLazyServers(unittest.TestCase):
+
+    def test_importing_servers_builds_no_models(self):
+        for getter in (
+            operators.reporter_model, operators.journalist_model, operators.anchor_model,
+            operators.questioner_model, operators.evaluator_model, operators.reporting_model, chat_server.model
+        ):
+            self.assertFalse(getter.is_built())
+
+    def test_newsbot_is_compiled_on_first_use_and_cached(self):
+        newsbot = news_server.get_newsbot()
+
+        self.assertIs(news_server.newsbot, newsbot)
+        self.assertIs(news_server.get_newsbot(), newsbot)
+        self.assertFalse(operators.reporter_model.is_built())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -51,8 +51,8 @@ def test_local_model_features(use_mock=True):
             # Instead of mocking _generate (which would bypass the parsing logic we want to test),
             # we should mock the client.generate and tokenizer.decode calls.
             
-            # 1. Mock tokenizer return for input encoding
-            mock_tokenizer.return_value.to.return_value = {"input_ids": torch.tensor([[1, 2, 3]])}
+            # 1. Mock tokenizer return for input encoding (each prompt segment is encoded and concatenated as tensors)
+            mock_tokenizer.return_value = {"input_ids": torch.tensor([[1, 2, 3]])}
             
             # 2. Mock client.generate to return some dummy token IDs
             mock_client.generate.return_value = torch.tensor([[1, 2, 3, 4, 5]])
@@ -98,9 +98,9 @@ def run_test_suite(llm):
         # which LangChain's internal parser should then turn into a Pydantic object
         # IF we mock the output to match the expected tool call for 'Joke'
         
-        # Adjust mock for Joke schema if in mock mode
-        if hasattr(llm.tokenizer, "decode"):
-             llm.tokenizer.decode.return_value = '```json\n{"tool": "Joke", "parameters": {"setup": "Why did the robot go to the doctor?", "punchline": "Because it had a virus!"}}\n```'
+        # Adjust mock for Joke schema if in mock mode (structured output decodes the bare JSON document)
+        if isinstance(llm.tokenizer, MagicMock):
+             llm.tokenizer.decode.return_value = '{"setup": "Why did the robot go to the doctor?", "punchline": "Because it had a virus!"}'
 
         joke_response = structured_llm.invoke("Tell me a funny joke about a robot.")
         
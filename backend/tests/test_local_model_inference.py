@@ -0,0 +1,561 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import sys
+import asyncio
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import os
+import json
+import string
+import torch
+
+# Create mock modules for dependencies that need system libraries
+mock_weasyprint = MagicMock()
+mock_weasyprint.__spec__ = MagicMock()
+sys.modules.setdefault("weasyprint", mock_weasyprint)
+
+from tokenizers import Tokenizer, models, pre_tokenizers, decoders
+from transformers import PreTrainedTokenizerFast, LlamaConfig, LlamaForCausalLM
+from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+from pydantic import BaseModel
+from langchain_core.tools import tool
+from backend.llms import LocalModel, Model, local_models
+from backend.inference import JsonSchemaConstraint, JsonSchemaLogitsProcessor, GenerationExecutor, GenerationRejected
+from backend.schemas import HeadlinesSchema, EvaluationSchema
+
+
+@tool
+def fake_search(query: str) -> str:
+    """Search the internet for a query"""
+    return f"Results for {query}"
+
+def build_tiny_tokenizer() -> PreTrainedTokenizerFast:
+    # Character level tokenizer so tests never need to download a vocabulary
+    vocab = {"<unk>": 0, "<s>": 1, "</s>": 2, "<pad>": 3}
+    for character in string.printable: vocab.setdefault(character, len(vocab))
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Split("", "isolated")
+    tokenizer.decoder = decoders.Fuse()
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, unk_token="<unk>", bos_token="<s>", eos_token="</s>", pad_token="<pad>"
+    )
+
+def build_tiny_model(vocab_size: int, seed: int = 0, num_hidden_layers: int = 2) -> LlamaForCausalLM:
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=vocab_size, hidden_size=32, intermediate_size=64, num_hidden_layers=num_hidden_layers,
+        num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=4096, bos_token_id=1, eos_token_id=2,
+        pad_token_id=3
+    )
+    return LlamaForCausalLM(config).eval()
+
+def build_local_model(client: LlamaForCausalLM = None, draft: LlamaForCausalLM = None, **environ: str) -> LocalModel:
+    tokenizer = build_tiny_tokenizer()
+    client = client or build_tiny_model(len(tokenizer))
+    loaded = {"tiny-model": client, "tiny-draft": draft}
+
+    with patch("backend.llms.AutoTokenizer") as mock_tokenizer_cls, \
+         patch("backend.llms.AutoModelForCausalLM") as mock_model_cls, \
+         patch("backend.llms.torch.backends.mps.is_available", return_value=False), \
+         patch.dict(os.environ, environ):
+        mock_tokenizer_cls.from_pretrained.return_value = tokenizer
+        mock_model_cls.from_pretrained.side_effect = lambda model, **kwargs: MagicMock(**{"to.return_value": loaded[model]})
+        return LocalModel(model="tiny-model", draft_model="tiny-draft" if draft else None)
+
+
+class TestPrefixCache(unittest.TestCase):
+
+    def setUp(self):
+        self.local_model = build_local_model()
+        self.messages = [SystemMessage(content="You are a terse assistant."), HumanMessage(content="Hello")]
+
+    def test_cached_generation_matches_uncached(self):
+        self.local_model.prefix_cache.max_bytes = 0
+        expected = self.local_model.invoke(self.messages).content
+
+        self.local_model.prefix_cache.max_bytes = 64 * 1024 * 1024
+        first = self.local_model.invoke(self.messages).content
+        second = self.local_model.invoke(self.messages).content
+
+        self.assertEqual(first, expected)
+        self.assertEqual(second, expected)
+        self.assertEqual(self.local_model.prefix_cache.stats()["hits"], 1)
+
+    def test_follow_up_turn_reuses_previous_prompt(self):
+        first = self.local_model.invoke(self.messages)
+        follow_up = self.messages + [AIMessage(content=first.content), HumanMessage(content="And again?")]
+        self.local_model.invoke(follow_up)
+        stats = self.local_model.prefix_cache.stats()
+
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["entries"], 3)
+
+    def test_eviction_respects_memory_budget(self):
+        self.local_model.invoke(self.messages)
+        budget = self.local_model.prefix_cache.used_bytes
+        self.local_model.prefix_cache.max_bytes = budget
+        self.local_model.invoke([SystemMessage(content="A different persona entirely."), HumanMessage(content="Hi")])
+
+        self.assertLessEqual(self.local_model.prefix_cache.used_bytes, budget)
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.local_model = build_local_model()
+        self.messages = [SystemMessage(content="You are a terse assistant."), HumanMessage(content="Hello")]
+
+    def test_stream_yields_same_text_as_invoke(self):
+        expected = self.local_model.invoke(self.messages).content
+        chunks = list(self.local_model.stream(self.messages))
+
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual("".join(chunk.content for chunk in chunks), expected)
+
+    def test_astream_yields_same_text_as_invoke(self):
+        expected = self.local_model.invoke(self.messages).content
+
+        async def collect():
+            return [chunk async for chunk in self.local_model.astream(self.messages)]
+
+        chunks = asyncio.run(collect())
+        self.assertEqual("".join(chunk.content for chunk in chunks), expected)
+
+    def test_trailing_tool_call_is_parsed_from_stream(self):
+        answer = 'Sure.\n```json\n{"tool": "get_weather", "parameters": {"location": "Paris"}}\n```'
+
+        def fake_generate(input_ids, streamer=None, **kwargs):
+            streamer.put(input_ids)
+            streamer.put(self.local_model.tokenizer(answer, return_tensors="pt", add_special_tokens=False)["input_ids"][0])
+            streamer.end()
+            return input_ids
+
+        with patch.object(self.local_model.client, "generate", side_effect=fake_generate):
+            chunks = list(self.local_model.stream(self.messages))
+
+        message = chunks[0]
+        for chunk in chunks[1:]: message += chunk
+
+        self.assertEqual(message.content, answer)
+        self.assertEqual(message.tool_calls[0]["name"], "get_weather")
+        self.assertEqual(message.tool_calls[0]["args"], {"location": "Paris"})
+
+    def test_generation_error_is_raised_to_consumer(self):
+        with patch.object(self.local_model.client, "generate", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                list(self.local_model.stream(self.messages))
+
+
+class TestBatchScheduler(unittest.TestCase):
+
+    def test_concurrent_requests_match_sequential_generation(self):
+        conversations = [
+            [SystemMessage(content="You are a terse assistant."), HumanMessage(content="Hello")],
+            [HumanMessage(content="A much longer question that needs more prompt tokens?")],
+            [HumanMessage(content="Hi")],
+        ]
+        sequential_model = build_local_model()
+        expected = [sequential_model.invoke(messages).content for messages in conversations]
+
+        batched_model = build_local_model(LLM_MAX_BATCH_SIZE="4")
+        with ThreadPoolExecutor(len(conversations)) as executor:
+            results = list(executor.map(lambda messages: batched_model.invoke(messages).content, conversations))
+
+        self.assertEqual(results, expected)
+        stats = batched_model.stats()["scheduler"]
+        self.assertEqual(stats["completed"], len(conversations))
+        self.assertEqual(stats["queue_depth"], 0)
+
+    def test_models_sharing_weights_share_a_scheduler(self):
+        first = build_local_model(LLM_MAX_BATCH_SIZE="2")
+        second = build_local_model(first.client, LLM_MAX_BATCH_SIZE="2")
+
+        self.assertIs(first.scheduler, second.scheduler)
+
+    def test_batched_generation_streams_tokens(self):
+        local_model = build_local_model(LLM_MAX_BATCH_SIZE="2")
+        messages = [HumanMessage(content="Hello")]
+        expected = local_model.invoke(messages).content
+
+        self.assertEqual("".join(chunk.content for chunk in local_model.stream(messages)), expected)
+
+
+class TestConstrainedDecoding(unittest.TestCase):
+
+    def setUp(self):
+        self.messages = [SystemMessage(content="You are a news reporter."), HumanMessage(content="Headlines please")]
+
+    def test_constraint_accepts_only_schema_documents(self):
+        constraint = JsonSchemaConstraint(HeadlinesSchema.model_json_schema())
+        document = {"headlines": [{"location": "Paris", "text": "Rain \"again\"", "date": "Today"}]}
+        state = constraint.advance(constraint.initial_state(), json.dumps(document))
+
+        self.assertTrue(constraint.is_complete(state))
+        self.assertIsNone(constraint.advance(state, " "))
+        self.assertIsNone(constraint.advance(constraint.initial_state(), '{"stories": '))
+        self.assertIsNone(constraint.advance(constraint.initial_state(), '{"headlines": [{"text": '))
+
+    def test_search_widens_until_a_token_fits(self):
+        tokenizer = build_tiny_tokenizer()
+        constraint = JsonSchemaConstraint(HeadlinesSchema.model_json_schema())
+        processor = JsonSchemaLogitsProcessor(constraint, tokenizer, {tokenizer.eos_token_id}, 100, top_k=4)
+        opening = tokenizer.convert_tokens_to_ids("{")
+        # The opening brace is the least likely token, far outside the first candidates checked
+        scores = torch.arange(len(tokenizer), dtype=torch.float).unsqueeze(0)
+        scores[0, opening] = -1
+
+        masked = processor(torch.tensor([[1]]), scores.clone())
+
+        self.assertEqual(masked[0].isfinite().nonzero().flatten().tolist(), [opening])
+        self.assertFalse(processor.released)
+
+    def test_unsatisfiable_constraint_decodes_unconstrained_instead_of_ending(self):
+        tokenizer = build_tiny_tokenizer()
+        constraint = JsonSchemaConstraint(HeadlinesSchema.model_json_schema())
+        processor = JsonSchemaLogitsProcessor(constraint, tokenizer, {tokenizer.eos_token_id}, 100)
+        scores = torch.randn(1, len(tokenizer))
+
+        with patch.object(constraint, "advance", return_value=None), self.assertWarns(UserWarning):
+            masked = processor(torch.tensor([[1]]), scores.clone())
+
+        self.assertTrue(torch.equal(masked, scores))
+        self.assertEqual(processor.released, {0})
+
+    def test_structured_output_parses_and_stops_when_object_closes(self):
+        local_model = build_local_model()
+
+        for schema in (HeadlinesSchema, EvaluationSchema):
+            result = local_model.with_structured_output(schema, include_raw=True).invoke(self.messages)
+            self.assertIsInstance(result["parsed"], schema)
+            self.assertIsNone(result["parsing_error"])
+            self.assertTrue(result["raw"].content.endswith("}"))
+
+    def test_document_is_closed_within_token_budget(self):
+        local_model = build_local_model()
+        local_model.max_new_tokens = 100
+        result = local_model.with_structured_output(EvaluationSchema, include_raw=True).invoke(self.messages)
+
+        self.assertIsInstance(result["parsed"], EvaluationSchema)
+        self.assertLessEqual(len(local_model.tokenizer(result["raw"].content, add_special_tokens=False)["input_ids"]), 100)
+
+    def test_batched_structured_output_matches_sequential(self):
+        expected = build_local_model().with_structured_output(EvaluationSchema).invoke(self.messages)
+        batched_model = build_local_model(LLM_MAX_BATCH_SIZE="2")
+
+        with ThreadPoolExecutor(2) as executor:
+            results = list(executor.map(
+                lambda schema: batched_model.with_structured_output(schema).invoke(self.messages),
+                (EvaluationSchema, HeadlinesSchema)
+            ))
+
+        self.assertEqual(results[0], expected)
+        self.assertIsInstance(results[1], HeadlinesSchema)
+
+
+class TestSpeculativeDecoding(unittest.TestCase):
+
+    def setUp(self):
+        self.messages = [SystemMessage(content="You are a terse assistant."), HumanMessage(content="Hello")]
+        self.expected = build_local_model().invoke(self.messages).content
+
+    def test_identical_draft_accepts_every_proposal(self):
+        tokenizer = build_tiny_tokenizer()
+        local_model = build_local_model(draft=build_tiny_model(len(tokenizer)))
+        response = local_model.invoke(self.messages)
+        speculative = response.response_metadata["speculative"]
+
+        self.assertEqual(response.content, self.expected)
+        self.assertGreater(speculative["drafted_tokens"], 0)
+        self.assertEqual(speculative["acceptance_rate"], 1.0)
+        self.assertLess(speculative["target_forward_passes"], speculative["generated_tokens"])
+
+    def test_weaker_draft_keeps_greedy_output(self):
+        tokenizer = build_tiny_tokenizer()
+        local_model = build_local_model(draft=build_tiny_model(len(tokenizer), seed=1, num_hidden_layers=1))
+        first = local_model.invoke(self.messages)
+        streamed = "".join(chunk.content for chunk in local_model.stream(self.messages))
+
+        self.assertEqual(first.content, self.expected)
+        self.assertEqual(streamed, self.expected)
+        self.assertLess(first.response_metadata["speculative"]["acceptance_rate"], 1.0)
+        self.assertEqual(local_model.stats()["speculative"]["calls"], 2)
+
+    def test_concurrent_generations_keep_their_own_counts(self):
+        tokenizer = build_tiny_tokenizer()
+        local_model = build_local_model(draft=build_tiny_model(len(tokenizer), seed=1, num_hidden_layers=1))
+        alone = local_model.invoke(self.messages).response_metadata["speculative"]
+
+        with ThreadPoolExecutor(3) as pool:
+            responses = list(pool.map(lambda _: local_model.invoke(self.messages), range(3)))
+
+        # Sharing the draft and target modules, every generation still reports exactly its own passes
+        self.assertEqual([response.response_metadata["speculative"] for response in responses], [alone] * 3)
+        self.assertEqual(local_model.stats()["speculative"]["calls"], 4)
+
+    def test_constrained_output_with_draft(self):
+        tokenizer = build_tiny_tokenizer()
+        local_model = build_local_model(draft=build_tiny_model(len(tokenizer), seed=1, num_hidden_layers=1))
+        expected = build_local_model().with_structured_output(EvaluationSchema).invoke(self.messages)
+
+        self.assertEqual(local_model.with_structured_output(EvaluationSchema).invoke(self.messages), expected)
+
+
+class TestAsyncGeneration(unittest.TestCase):
+
+    def setUp(self):
+        self.local_model = build_local_model()
+        self.messages = [SystemMessage(content="You are a terse assistant."), HumanMessage(content="Hello")]
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def blocking_generate(self, input_ids, stopping_criteria=None, **kwargs):
+        # Holds its slot until released or cancelled, like a long generation would
+        while not self.release.is_set() and not stopping_criteria(input_ids, None).all(): time.sleep(0.01)
+        return input_ids
+
+    def test_ainvoke_matches_invoke_without_blocking_the_loop(self):
+        expected = self.local_model.invoke(self.messages).content
+
+        async def run():
+            ticks = 0
+            generation = asyncio.ensure_future(self.local_model.ainvoke(self.messages))
+            while not generation.done():
+                ticks += 1
+                await asyncio.sleep(0)
+            return ticks, generation.result()
+
+        ticks, response = asyncio.run(run())
+        self.assertEqual(response.content, expected)
+        self.assertGreater(ticks, 1)
+        self.assertEqual(self.local_model.executor.stats()["completed"], 1)
+
+    def test_overload_is_rejected_when_queue_is_full_or_times_out(self):
+        self.local_model.executor = GenerationExecutor(max_in_flight=1, max_queued=1, queue_timeout=0.2)
+
+        async def run():
+            first = asyncio.ensure_future(self.local_model.ainvoke(self.messages))
+            await asyncio.sleep(0.05)
+            second = asyncio.ensure_future(self.local_model.ainvoke(self.messages))
+            await asyncio.sleep(0.05)
+
+            with self.assertRaises(GenerationRejected): await self.local_model.ainvoke(self.messages)
+            with self.assertRaises(GenerationRejected): await second
+            self.release.set()
+            await first
+
+        with patch.object(self.local_model.client, "generate", side_effect=self.blocking_generate):
+            asyncio.run(run())
+
+        stats = self.local_model.executor.stats()
+        self.assertEqual((stats["rejected"], stats["completed"], stats["in_flight"]), (2, 1, 0))
+
+    def test_cancelling_stops_generation_and_frees_its_slot(self):
+        self.local_model.executor = GenerationExecutor(max_in_flight=1, max_queued=1, queue_timeout=5)
+
+        async def run():
+            first = asyncio.ensure_future(self.local_model.ainvoke(self.messages))
+            await asyncio.sleep(0.05)
+            first.cancel()
+            with self.assertRaises(asyncio.CancelledError): await first
+            self.release.set()
+            return await self.local_model.ainvoke(self.messages)
+
+        with patch.object(self.local_model.client, "generate", side_effect=self.blocking_generate):
+            asyncio.run(run())
+
+        stats = self.local_model.executor.stats()
+        self.assertEqual((stats["cancelled"], stats["completed"], stats["in_flight"]), (1, 1, 0))
+
+    def test_closing_a_stream_stops_its_generation(self):
+        stopped = threading.Event()
+
+        def streaming_generate(input_ids, streamer=None, stopping_criteria=None, **kwargs):
+            # Streams one line, then keeps decoding until a stopping criterion ends it
+            streamer.put(input_ids[0])
+            streamer.put(torch.tensor(self.local_model.tokenizer("Hello\n", add_special_tokens=False)["input_ids"]))
+            while not self.release.is_set():
+                if stopping_criteria(input_ids, None).all():
+                    stopped.set()
+                    break
+                time.sleep(0.01)
+            streamer.end()
+            return input_ids
+
+        with patch.object(self.local_model.client, "generate", side_effect=streaming_generate):
+            stream = self.local_model.stream(self.messages)
+            self.assertEqual(next(stream).content, "Hello\n")
+            stream.close()
+
+            self.assertTrue(stopped.wait(5))
+
+    def test_rejected_astream_raises_instead_of_hanging(self):
+        self.local_model.executor = GenerationExecutor(max_in_flight=1, max_queued=0, queue_timeout=5)
+
+        async def run():
+            first = asyncio.ensure_future(self.local_model.ainvoke(self.messages))
+            await asyncio.sleep(0.05)
+            with self.assertRaises(GenerationRejected):
+                async for _ in self.local_model.astream(self.messages): pass
+            self.release.set()
+            await first
+
+        with patch.object(self.local_model.client, "generate", side_effect=self.blocking_generate):
+            asyncio.run(asyncio.wait_for(run(), 10))
+
+
+class TestCpuModes(unittest.TestCase):
+
+    def setUp(self):
+        self.messages = [HumanMessage(content="Hello")]
+        threads = torch.get_num_threads()
+        self.addCleanup(torch.set_num_threads, threads)
+
+    def test_int8_quantizes_linear_layers_and_generates(self):
+        local_model = build_local_model(LLM_QUANTIZATION="int8", LLM_NUM_THREADS="1")
+
+        self.assertIsInstance(local_model.client.model.layers[0].mlp.down_proj, torch.ao.nn.quantized.dynamic.Linear)
+        self.assertIsInstance(local_model.invoke(self.messages).content, str)
+        self.assertEqual(local_model.stats()["runtime"], {"quantization": "int8", "compiled": False, "threads": 1})
+
+    def test_compiled_forward_is_warmed_up_on_load(self):
+        warm_up_calls = []
+
+        def fake_compile(forward, **kwargs):
+            def compiled(*args, **kwargs):
+                warm_up_calls.append(1)
+                return forward(*args, **kwargs)
+            return compiled
+
+        with patch("backend.inference.torch.compile", side_effect=fake_compile):
+            local_model = build_local_model(LLM_COMPILE="true")
+
+        self.assertTrue(local_model.compiled)
+        self.assertTrue(warm_up_calls)
+        self.assertEqual(local_model.invoke(self.messages).content, build_local_model().invoke(self.messages).content)
+
+    def test_failed_compile_falls_back_to_eager(self):
+        def broken_compile(forward, **kwargs):
+            def compiled(*args, **kwargs): raise RuntimeError("no compiler")
+            return compiled
+
+        with patch("backend.inference.torch.compile", side_effect=broken_compile), self.assertWarns(UserWarning):
+            local_model = build_local_model(LLM_COMPILE="true")
+
+        self.assertFalse(local_model.compiled)
+        self.assertEqual(local_model.invoke(self.messages).content, build_local_model().invoke(self.messages).content)
+
+
+class TestStoppingCriteria(unittest.TestCase):
+
+    def setUp(self):
+        self.local_model = build_local_model()
+        self.messages = [SystemMessage(content="You are a terse assistant."), HumanMessage(content="Weather?")]
+        self.generate_kwargs = {}
+        self.decoded = 0
+
+    def scripted_generate(self, answer):
+        # Emits `answer` one token at a time and honours the stopping criteria like `generate` does
+        answer_ids = self.local_model.tokenizer(answer, return_tensors="pt", add_special_tokens=False)["input_ids"]
+
+        def generate(input_ids, streamer=None, stopping_criteria=None, **kwargs):
+            self.generate_kwargs = kwargs
+            if streamer: streamer.put(input_ids)
+            for token in answer_ids[0, :kwargs["max_new_tokens"]]:
+                input_ids = torch.cat([input_ids, token.view(1, 1)], dim=1)
+                self.decoded += 1
+                if streamer: streamer.put(token.view(1))
+                if stopping_criteria and stopping_criteria(input_ids, None).all(): break
+            if streamer: streamer.end()
+            return input_ids
+
+        return patch.object(self.local_model.client, "generate", side_effect=generate)
+
+    def test_generation_ends_when_fenced_tool_call_closes(self):
+        call = '```json\n{"tool": "fake_search", "parameters": {"query": "Paris"}}\n```'
+
+        with self.scripted_generate(call + "\nAnything after the call is wasted work."):
+            response = self.local_model.bind_tools([fake_search]).invoke(self.messages)
+
+        self.assertEqual(response.content, call)
+        self.assertEqual(response.tool_calls[0]["args"], {"query": "Paris"})
+        self.assertEqual(self.decoded, len(call))
+
+    def test_stop_sequences_end_and_trim_the_answer(self):
+        with self.scripted_generate("Sunny today.\nUser: and tomorrow?"):
+            response = self.local_model.invoke(self.messages, stop=["\nUser:"])
+            streamed = "".join(chunk.content for chunk in self.local_model.stream(self.messages, stop=["\nUser:"]))
+
+        self.assertEqual(response.content, "Sunny today.")
+        self.assertEqual(streamed, "Sunny today.")
+
+    def test_stop_sequences_apply_to_structured_output(self):
+        document = '{"score": 1}'
+        response_format = {"type": "json_schema", "json_schema": EvaluationSchema.model_json_schema()}
+
+        with self.scripted_generate(document + "\nUser: and tomorrow?"):
+            response = self.local_model.bind(response_format=response_format).invoke(self.messages, stop=["\nUser:"])
+
+        self.assertEqual(response.content, document)
+        self.assertEqual(self.decoded, len(document + "\nUser:"))
+
+    def test_bound_token_budget_is_capped_by_context_window(self):
+        with self.scripted_generate("Sunny"):
+            self.local_model.bind(max_new_tokens=32).invoke(self.messages)
+            self.assertEqual(self.generate_kwargs["max_new_tokens"], 32)
+
+            input_ids, _ = self.local_model._encode(self.local_model._build_segments(self.messages))
+            self.local_model.client.config.max_position_embeddings = input_ids.shape[1] + 8
+            self.local_model.bind(max_new_tokens=32).invoke(self.messages)
+            self.assertEqual(self.generate_kwargs["max_new_tokens"], 8)
+
+    def test_models_bind_per_node_budgets(self):
+        local_models.clear()
+        self.addCleanup(local_models.clear)
+        environ = {"OPENAI_API_KEY": "", "GOOGLE_API_KEY": "", "LLM_MODEL_NAME": "tiny-model"}
+
+        with patch("backend.llms.local_models.get", return_value=self.local_model), \
+             patch("backend.llms.agent_tools", [fake_search]), patch.dict(os.environ, environ):
+            chat, evaluator = Model(None, 512), Model(EvaluationSchema, 1024)
+
+        self.assertEqual(chat.model.kwargs["max_new_tokens"], 512)
+        self.assertEqual(evaluator.model.first.kwargs["max_new_tokens"], 1024)
+
+
+class TestLocalModelRegistry(unittest.TestCase):
+
+    def setUp(self):
+        local_models.clear()
+        self.addCleanup(local_models.clear)
+
+    def test_models_share_one_set_of_weights(self):
+        class Answer(BaseModel):
+            answer: str
+
+        tokenizer = build_tiny_tokenizer()
+        client = build_tiny_model(len(tokenizer))
+        environ = {"OPENAI_API_KEY": "", "GOOGLE_API_KEY": "", "LLM_MODEL_NAME": "tiny-model"}
+
+        with patch("backend.llms.AutoTokenizer") as mock_tokenizer_cls, \
+             patch("backend.llms.AutoModelForCausalLM") as mock_model_cls, \
+             patch("backend.llms.agent_tools", [fake_search]), \
+             patch.dict(os.environ, environ):
+            mock_tokenizer_cls.from_pretrained.return_value = tokenizer
+            mock_model_cls.from_pretrained.return_value.to.return_value = client
+            models = [Model(), Model(Answer), Model()]
+
+        self.assertEqual(mock_model_cls.from_pretrained.call_count, 1)
+        self.assertEqual(len({id(model.model) for model in models}), len(models))
+        self.assertIs(local_models.get("tiny-model").client, client)
+
+    def test_distinct_dtypes_load_separately(self):
+        with patch("backend.llms.AutoTokenizer"), patch("backend.llms.AutoModelForCausalLM") as mock_model_cls:
+            default = local_models.get("tiny-model", device="cpu")
+            bfloat16 = local_models.get("tiny-model", "bfloat16", "cpu")
+
+        self.assertIsNot(default, bfloat16)
+        self.assertEqual(mock_model_cls.from_pretrained.call_args.kwargs["dtype"], "bfloat16")
+
+
+if __name__ == "__main__":
+    unittest.main()
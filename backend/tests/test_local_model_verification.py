@@ -3,6 +3,7 @@ from unittest.mock import MagicMock, patch
 import sys
 import os
 import torch
+from transformers import BatchEncoding
 
 # Create mock modules for likely missing dependencies (tools etc)
 mock_pandas = MagicMock()
@@ -16,6 +17,9 @@ mock_langchain_community.__spec__ = MagicMock()
 sys.modules["pandas"] = mock_pandas
 sys.modules["weasyprint"] = mock_weasyprint
 sys.modules["langchain_community.tools"] = mock_langchain_community
+# The search tool is wrapped when backend.tools is imported, the wrapper keeps its name and description
+search_tool = mock_langchain_community.DuckDuckGoSearchResults.return_value
+search_tool.name, search_tool.description = "duckduckgo_results_json", "Search the internet."
 
 # Patch env vars
 patch_env = patch.dict(os.environ, {"LLM_MODEL_NAME": "dummy-model", "OPENAI_API_KEY": "", "GOOGLE_API_KEY": ""})
@@ -39,11 +43,13 @@ class TestLocalModelVerification(unittest.TestCase):
         
         mock_tokenizer_cls.from_pretrained.return_value = mock_tokenizer
         mock_model_cls.from_pretrained.return_value = mock_model
+        # The loaded model is moved to the device, keep generating through the same mock
+        mock_model.to.return_value = mock_model
 
         # Mock tokenizer behavior
         # Return real tensor for "input_ids"
         # Shape (1, 3) -> [1, 2, 3]
-        mock_tokenizer.return_value = {"input_ids": torch.tensor([[1, 2, 3]])}
+        mock_tokenizer.return_value = BatchEncoding({"input_ids": torch.tensor([[1, 2, 3]])})
         
         # Mock generate behavior
         # Return real tensor containing [1, 2, 3, 4, 5]
@@ -0,0 +1,134 @@
+import os
+import time
+import tempfile
+import threading
+import unittest
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from unittest.mock import MagicMock, patch
+import sys
+
+# Create mock modules for dependencies that need system libraries
+mock_weasyprint = MagicMock()
+mock_weasyprint.__spec__ = MagicMock()
+sys.modules.setdefault("weasyprint", mock_weasyprint)
+
+from backend import tools
+from backend.artifacts import ArtifactStore
+from backend.rendering import PdfRenderer, template_hash
+
+
+class LocalRender:
+    # Stand-in for WeasyPrint that records every template it renders and can hold or fail a job
+    def __init__(self, release: threading.Event | None = None, error: Exception | None = None):
+        self.templates, self.release, self.error = [], release, error
+
+    def __call__(self, template: str) -> bytes:
+        self.templates.append(template)
+        if self.release: self.release.wait(5)
+        if self.error: raise self.error
+        return f"%PDF {template}".encode()
+
+
+class TestPdfRenderer(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.store = ArtifactStore(self.directory)
+        self.executor = ThreadPoolExecutor(2)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_submit_returns_a_handle_before_the_pdf_is_rendered(self):
+        release = threading.Event()
+        render = LocalRender(release)
+        renderer = PdfRenderer(self.store, executor=self.executor, render=render)
+
+        job = renderer.submit("alice", "<h1>report</h1>")
+
+        self.assertEqual(job, template_hash("<h1>report</h1>"))
+        self.assertEqual(renderer.status("alice", job), "rendering")
+        # The same report submitted again while rendering joins the running job
+        self.assertEqual(renderer.submit("alice", "<h1>report</h1>"), job)
+        release.set()
+
+        self.assertEqual(renderer.wait("alice", job, 5), b"%PDF <h1>report</h1>")
+        self.assertEqual(renderer.status("alice", job), "ready")
+        self.assertEqual(render.templates, ["<h1>report</h1>"])
+
+    def test_pdfs_are_written_into_the_session_store(self):
+        render = LocalRender()
+        renderer = PdfRenderer(self.store, executor=self.executor, render=render)
+        job = renderer.submit("alice", "<p>a</p>")
+        renderer.wait("alice", job, 5)
+
+        # Stored once, in the session's artifacts, and served from there on the next submit
+        self.assertEqual(self.store.get("alice", job), b"%PDF <p>a</p>")
+        self.assertEqual(renderer.submit("alice", "<p>a</p>"), job)
+        self.assertEqual(render.templates, ["<p>a</p>"])
+        self.assertEqual(renderer.status("bob", job), "missing")
+        self.assertIsNone(self.store.get("bob", job))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_finished_pdfs_expire_with_the_store(self):
+        store = ArtifactStore(self.directory, memory_bytes=4, ttl=0.2)
+        renderer = PdfRenderer(store, executor=self.executor, render=LocalRender())
+        job = renderer.submit("alice", "<p>a</p>")
+        renderer.wait("alice", job, 5)
+
+        time.sleep(0.3)
+        store.purge()
+
+        self.assertEqual(renderer.status("alice", job), "missing")
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_failed_jobs_are_reported_and_retried(self):
+        renderer = PdfRenderer(self.store, executor=self.executor, render=LocalRender(error=ValueError("bad css")))
+        job = renderer.submit("alice", "<p>broken</p>")
+
+        with self.assertRaises(ValueError): renderer.wait("alice", job, 5)
+        self.assertEqual(renderer.status("alice", job), "failed")
+        self.assertIsInstance(renderer.error("alice", job), ValueError)
+        self.assertIsNone(self.store.get("alice", job))
+
+        renderer.render = LocalRender()
+        renderer.wait("alice", renderer.submit("alice", "<p>broken</p>"), 5)
+        self.assertEqual(renderer.status("alice", job), "ready")
+
+    def test_failed_jobs_are_retried_by_their_handle(self):
+        renderer = PdfRenderer(self.store, executor=self.executor, render=LocalRender(error=ValueError("bad css")))
+        job = renderer.submit("alice", "<p>broken</p>")
+        with self.assertRaises(ValueError): renderer.wait("alice", job, 5)
+
+        renderer.render = LocalRender()
+        self.assertTrue(renderer.retry("alice", job))
+        self.assertEqual(renderer.wait("alice", job, 5), b"%PDF <p>broken</p>")
+        # Nothing is left to retry once the PDF is in the store, or for a job this renderer never saw
+        self.assertFalse(renderer.retry("alice", job))
+        self.assertFalse(renderer.retry("bob", job))
+
+    def test_jobs_render_on_worker_processes(self):
+        executor = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"))
+        self.addCleanup(executor.shutdown)
+        renderer = PdfRenderer(self.store, executor=executor, render=str.encode)
+
+        pdf = renderer.wait("alice", renderer.submit("alice", "<p>from a worker</p>"), 60)
+
+        self.assertEqual(pdf, b"<p>from a worker</p>")
+
+    def test_pdf_tool_returns_the_handle(self):
+        release = threading.Event()
+        renderer = PdfRenderer(self.store, executor=self.executor, render=LocalRender(release))
+        self.addCleanup(release.set)
+
+        with patch.object(tools, "pdf_renderer", lambda: renderer):
+            result = tools.generate_pdf_tool.invoke({"template": "<p>news</p>"}, {"configurable": {"thread_id": "t1"}})
+
+        self.assertEqual(result["job"], template_hash("<p>news</p>"))
+        self.assertEqual((result["artifact"], result["session"]), (result["job"], "t1"))
+        self.assertEqual(renderer.status("t1", result["job"]), "rendering")
+
+
+if __name__ == "__main__":
+    unittest.main()
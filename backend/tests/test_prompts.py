@@ -0,0 +1,90 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+import sys
+
+# Create mock modules for dependencies that need system libraries
+mock_weasyprint = MagicMock()
+mock_weasyprint.__spec__ = MagicMock()
+sys.modules.setdefault("weasyprint", mock_weasyprint)
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph import StateGraph, START
+from backend import chat_server, operators
+from backend.prompts import (
+    PromptRegistry, prompt_registry, CHATBOT_PROMPT, CHATBOT_PROMPT_ID, NEWSBOT_ANCHOR_PROMPT, INTERVIEWBOT_PROMPT_ID
+)
+from backend.utilities import ContextWindow
+
+
+class TestPromptRegistry(unittest.TestCase):
+
+    def test_versions_resolve_and_retired_ones_fall_back_to_latest(self):
+        registry = PromptRegistry()
+        first = registry.register("persona", 1, "Be brief about {topic}.")
+        second = registry.register("persona", 2, "Be thorough about {topic}.")
+
+        self.assertEqual((first, second, registry.latest("persona")), ("persona@1", "persona@2", "persona@2"))
+        self.assertEqual(registry.render(first, topic="news"), "Be brief about news.")
+        self.assertEqual(registry.render("persona@7", topic="news"), "Be thorough about news.")
+        self.assertEqual(registry.render("persona@1"), "Be brief about {topic}.")
+
+    def test_builtin_prompts_are_registered(self):
+        self.assertEqual(prompt_registry.render(CHATBOT_PROMPT_ID), CHATBOT_PROMPT)
+
+
+class TestPromptsStayOutOfState(unittest.TestCase):
+
+    def test_chat_thread_stores_only_the_prompt_id(self):
+        fake_model = MagicMock()
+        fake_model.model.invoke.side_effect = lambda messages: AIMessage(f"sent {len(messages)}")
+        window = ContextWindow(lambda text: len(text.split()), 100000, chat_server.summarize_turns)
+        graph = StateGraph(chat_server.ChatState)
+        graph.add_node("chat_node", chat_server.chat_function)
+        graph.add_edge(START, "chat_node")
+        chatbot = graph.compile(InMemorySaver())
+        config = {"configurable": {"thread_id": "chat"}}
+
+        with patch.object(chat_server, "model", lambda: fake_model), \
+             patch.object(chat_server, "chat_context", lambda: window):
+            chatbot.invoke({"messages": [HumanMessage("hi")]}, config)
+            # Legacy threads persisted the prompt in their history, it is not sent twice
+            chatbot.update_state(config, {"messages": [SystemMessage(CHATBOT_PROMPT)]})
+            chatbot.invoke({"messages": [HumanMessage("again")]}, config)
+
+        values = chatbot.get_state(config).values
+        self.assertEqual(values["prompt"], CHATBOT_PROMPT_ID)
+        self.assertEqual(values["messages"][-1].content, "sent 4")
+        sent = fake_model.model.invoke.call_args.args[0]
+        self.assertEqual([type(message) for message in sent].count(SystemMessage), 1)
+        self.assertEqual(sent[0].content, CHATBOT_PROMPT)
+
+    def test_news_perception_selects_a_prompt_id(self):
+        tool_message = ToolMessage("results", tool_call_id="call-1")
+        state = {"messages": [HumanMessage("latest news"), tool_message], "segment": "summary", "queries": ["query"]}
+        update = operators.news_perception_function(state)
+
+        self.assertEqual(update, {"prompt": "newsbot-anchor@1", "queries": [tool_message]})
+        self.assertEqual(operators.news_messages({**state, **update})[0].content, NEWSBOT_ANCHOR_PROMPT)
+
+    def test_interview_prompt_is_rendered_from_state(self):
+        user_information = {"name": "Sam", "role": "Data Engineer", "companies": "Acme"}
+        state = {
+            "messages": [HumanMessage("start"), HumanMessage(json.dumps(user_information))],
+            "rules": {"format": "short"}
+        }
+
+        with patch.object(operators, "load_interview_rules", return_value={}):
+            update = operators.interview_perception_function(state)
+
+        self.assertEqual(update["prompt"], INTERVIEWBOT_PROMPT_ID)
+        messages = operators.interview_messages({**state, **update})
+        self.assertIsInstance(messages[0], SystemMessage)
+        self.assertIn("**Data Engineer** role", messages[0].content)
+        self.assertIn("5 of these questions", messages[0].content)
+        self.assertEqual(messages[1:], state["messages"])
+
+
+if __name__ == "__main__":
+    unittest.main()
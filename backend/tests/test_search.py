@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# Create mock modules for dependencies that need system libraries
+mock_weasyprint = MagicMock()
+mock_weasyprint.__spec__ = MagicMock()
+sys.modules.setdefault("weasyprint", mock_weasyprint)
+
+from langchain_core.messages import AIMessage
+from langgraph.graph import StateGraph, START
+from langgraph.prebuilt import ToolNode
+from backend.schemas import QueryState
+from backend.search import SearchCache, CachedSearch, cached_search_tool, normalize_query
+from backend.tools import web_search
+
+
+class LocalSearchProvider:
+    # Stand-in for the DuckDuckGo tool that records every query reaching the "network"
+    def __init__(self, release: threading.Event | None = None, error: Exception | None = None):
+        self.queries, self.release, self.error = [], release, error
+
+    def __call__(self, query: str) -> str:
+        self.queries.append(query)
+        if self.release: self.release.wait(5)
+        if self.error: raise self.error
+        return f"results for {query}"
+
+
+class TestCachedSearch(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "search_cache.db")
+        self.cache = SearchCache(self.path)
+        self.addCleanup(self.cache.close)
+        self.ttls = {"headlines": 600, "stories": 3600, "summary": 1800, "default": 1800}
+
+    def age(self, seconds):
+        # Backdates every cached result as if it had been fetched `seconds` ago
+        with sqlite3.connect(self.path) as connection:
+            connection.execute("UPDATE search_cache SET fetched = fetched - ?", (seconds,))
+        connection.close()
+
+    def test_queries_are_normalized(self):
+        self.assertEqual(normalize_query("  Latest   NEWS: India!? "), "latest news: india!?")
+        self.assertEqual(normalize_query("C++ vs C#"), "c++ vs c#")
+        # Punctuation stays part of the key, it can change what the query means
+        self.assertNotEqual(normalize_query("node.js"), normalize_query("node js"))
+        self.assertNotEqual(normalize_query("$100 laptops"), normalize_query("100 laptops"))
+
+    def test_repeated_queries_are_served_from_the_cache_per_segment_ttl(self):
+        provider = LocalSearchProvider()
+        search = CachedSearch(provider, self.cache, self.ttls)
+
+        first = search.search("Latest news India", "headlines")
+        self.assertEqual(search.search("  latest NEWS india ", "stories"), first)
+        self.assertEqual(provider.queries, ["Latest news India"])
+
+        # Twenty minutes later headlines want fresher results while stories still reuse them
+        self.age(1200)
+        search.search("latest news india", "stories")
+        self.assertEqual(len(provider.queries), 1)
+        search.search("latest news india", "headlines")
+        self.assertEqual(len(provider.queries), 2)
+
+        stats = search.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (2, 2, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_results_persist_across_processes(self):
+        CachedSearch(LocalSearchProvider(), self.cache, self.ttls).search("weather in paris")
+        provider = LocalSearchProvider()
+        reopened = SearchCache(self.path)
+        self.addCleanup(reopened.close)
+
+        result = CachedSearch(provider, reopened, self.ttls).search("Weather in Paris")
+
+        self.assertEqual(result, "results for weather in paris")
+        self.assertEqual(provider.queries, [])
+
+    def test_identical_searches_in_flight_share_one_request(self):
+        release = threading.Event()
+        provider = LocalSearchProvider(release)
+        search = CachedSearch(provider, self.cache, self.ttls)
+
+        with ThreadPoolExecutor(5) as executor:
+            futures = [executor.submit(search.search, "election results") for _ in range(5)]
+            while search.stats()["misses"] + search.stats()["coalesced"] < 5: threading.Event().wait(0.01)
+            release.set()
+            results = {future.result() for future in futures}
+
+        self.assertEqual(results, {"results for election results"})
+        self.assertEqual(provider.queries, ["election results"])
+        self.assertEqual(search.stats()["coalesced"], 4)
+
+    def test_failures_are_raised_and_not_cached(self):
+        search = CachedSearch(LocalSearchProvider(error=RuntimeError("rate limited")), self.cache, self.ttls)
+
+        with self.assertRaises(RuntimeError): search.search("markets today")
+        self.assertEqual((search.stats()["errors"], len(self.cache)), (1, 0))
+
+    def test_tool_node_injects_the_segment(self):
+        provider = LocalSearchProvider()
+        search = CachedSearch(provider, self.cache, {**self.ttls, "headlines": 0})
+        tool = cached_search_tool(web_search, lambda: search)
+        tool_call = {"name": web_search.name, "args": {"query": "space launch"}, "id": "call-1", "type": "tool_call"}
+        graph = StateGraph(QueryState)
+        graph.add_node("tools", ToolNode([tool]))
+        graph.add_edge(START, "tools")
+        news = graph.compile()
+
+        self.assertEqual(tool.tool_call_schema.model_json_schema()["required"], ["query"])
+        for segment in ("headlines", "headlines", "stories", "stories"):
+            result = news.invoke({"messages": [AIMessage("", tool_calls=[tool_call])], "segment": segment})
+
+        self.assertEqual(result["messages"][-1].content, "results for space launch")
+        # A zero TTL bypasses the cache for headlines, the first stories search reuses what they fetched
+        self.assertEqual(len(provider.queries), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,708 @@
+import unittest
+from unittest.mock import MagicMock, AsyncMock, patch
+import os
+import asyncio
+import time
+import sqlite3
+import tempfile
+import threading
+import contextlib
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from langgraph.checkpoint.base import empty_checkpoint, create_checkpoint
+from langgraph.checkpoint.base.id import uuid6
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+import operator
+from typing import Annotated, TypedDict
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage, RemoveMessage
+from langgraph.graph.message import add_messages, REMOVE_ALL_MESSAGES
+from langgraph.graph import StateGraph, START, END
+from backend.prompts import CHATBOT_PROMPT
+from backend import storage as storage_module
+from backend.storage import (
+    Storage, PooledPostgresSaver, PooledAsyncPostgresSaver, WalSqliteSaver, WalAsyncSqliteSaver, ZstdSerializer,
+    DictionaryStore, SqliteDictionaryStore, BoundedMemorySaver, ShardedSaver, TunedMongoDBSaver
+)
+from langgraph.checkpoint.mongodb import MongoDBSaver
+
+
+class TestPostgresStorage(unittest.TestCase):
+
+    def setUp(self):
+        Storage._shared.clear()
+        self.addCleanup(Storage._shared.clear)
+        self.environ = {"POSTGRES_CONNECTION_URI": "postgresql://localhost/chat", "POSTGRES_POOL_MAX_SIZE": "4"}
+
+    def test_graphs_share_one_health_checked_pool(self):
+        with patch("backend.storage.ConnectionPool") as mock_pool_cls, \
+             patch.object(PooledPostgresSaver, "setup") as mock_setup, \
+             patch.dict(os.environ, self.environ):
+            chat_storage = Storage("database", "postgres").storage
+            interview_storage = Storage("database", "postgres").storage
+
+        self.assertIs(chat_storage, interview_storage)
+        self.assertEqual(mock_pool_cls.call_count, 1)
+        self.assertEqual(mock_setup.call_count, 1)
+
+        kwargs = mock_pool_cls.call_args.kwargs
+        self.assertEqual((kwargs["min_size"], kwargs["max_size"]), (1, 4))
+        self.assertIs(kwargs["check"], mock_pool_cls.check_connection)
+        self.assertTrue(kwargs["kwargs"]["autocommit"])
+        self.assertEqual(kwargs["kwargs"]["prepare_threshold"], 0)
+
+    def test_pooled_saver_does_not_serialise_sessions(self):
+        with patch("backend.storage.ConnectionPool"), patch.object(PooledPostgresSaver, "setup"):
+            storage = Storage("database", "postgres").storage
+
+        self.assertIsInstance(storage.lock, contextlib.nullcontext)
+
+    def test_async_saver_opens_its_pool_once_on_first_use(self):
+        cursors = []
+
+        @contextlib.asynccontextmanager
+        async def fake_cursor(self, *, pipeline=False):
+            cursors.append(pipeline)
+            yield MagicMock()
+
+        async def run():
+            with patch("backend.storage.AsyncConnectionPool") as mock_pool_cls, patch.dict(os.environ, self.environ):
+                mock_pool_cls.return_value.open = AsyncMock()
+                storage = Storage("database", "postgres", asynchronous=True).storage
+
+            async def use():
+                async with storage._cursor(): pass
+
+            with patch.object(AsyncPostgresSaver, "_cursor", fake_cursor), \
+                 patch.object(PooledAsyncPostgresSaver, "setup", AsyncMock()) as mock_setup:
+                await asyncio.gather(*(use() for _ in range(5)))
+
+            self.assertIsInstance(storage, PooledAsyncPostgresSaver)
+            self.assertFalse(mock_pool_cls.call_args.kwargs["open"])
+            mock_pool_cls.return_value.open.assert_awaited_once()
+            mock_setup.assert_awaited_once()
+            self.assertEqual(len(cursors), 5)
+
+        asyncio.run(run())
+
+
+def save_checkpoint(storage, thread_id, step=0, parent=None):
+    config = parent or {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+    checkpoint = create_checkpoint(empty_checkpoint(), {}, step)
+    return storage.put(config, checkpoint, {"step": step}, {})
+
+def save_history(storage, thread_id, steps):
+    config = None
+    for step in range(steps):
+        config = save_checkpoint(storage, thread_id, step, config)
+        storage.put_writes(config, [("messages", f"write {step}")], "task")
+    return config
+
+
+class TestSqliteStorage(unittest.TestCase):
+
+    def setUp(self):
+        Storage._shared.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "chatbot.db")
+
+    def build(self, **kwargs):
+        storage = WalSqliteSaver(self.path, **kwargs)
+        self.addCleanup(storage.close)
+        return storage
+
+    def test_graphs_share_one_wal_saver(self):
+        with patch.dict(os.environ, {"SQLITE_DATABASE_PATH": self.path, "SQLITE_READ_POOL_SIZE": "2"}):
+            chat_storage = Storage("database").storage
+            interview_storage = Storage("database").storage
+        self.addCleanup(chat_storage.close)
+
+        self.assertIs(chat_storage, interview_storage)
+        self.assertIsInstance(chat_storage, WalSqliteSaver)
+        self.assertEqual(chat_storage.stats()["idle_readers"], 2)
+        with contextlib.closing(sqlite3.connect(self.path)) as connection:
+            self.assertEqual(connection.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_concurrent_writes_are_committed_and_readable(self):
+        storage = self.build(readers=2)
+
+        with ThreadPoolExecutor(8) as executor:
+            configs = list(executor.map(lambda index: save_checkpoint(storage, f"thread-{index}"), range(32)))
+
+        for index, config in enumerate(configs):
+            saved = storage.get_tuple({"configurable": {"thread_id": f"thread-{index}"}})
+            self.assertEqual(saved.config["configurable"]["checkpoint_id"], config["configurable"]["checkpoint_id"])
+
+        stats = storage.stats()
+        self.assertEqual(stats["operations"], 32)
+        self.assertLessEqual(stats["batches"], 32)
+        self.assertEqual(stats["idle_readers"], 2)
+
+    def test_reads_never_use_the_writer_connection(self):
+        storage = self.build(readers=1)
+        save_checkpoint(storage, "chat")
+
+        with storage.cursor(transaction=False) as cursor:
+            self.assertIsNot(storage.conn, storage.writer.connection)
+            with self.assertRaises(sqlite3.OperationalError):
+                cursor.execute("DELETE FROM checkpoints")
+
+        self.assertIs(storage.conn, storage.writer.connection)
+        self.assertEqual(len(list(storage.list({"configurable": {"thread_id": "chat"}}))), 1)
+
+    def test_failing_write_does_not_roll_back_its_batch(self):
+        storage = self.build()
+        started, release = threading.Event(), threading.Event()
+        storage.writer.connection.create_function("pause", 0, lambda: started.set() or release.wait(5))
+
+        # Hold the writer inside one batch so the next two operations are queued and committed together
+        blocker = threading.Thread(target=storage.writer.submit, args=([("INSERT INTO checkpoints (thread_id, checkpoint_id) SELECT 'held', pause()", [()])],))
+        blocker.start()
+        started.wait(5)
+
+        good, bad = Future(), Future()
+        storage.writer.queue.put(([("INSERT INTO writes VALUES ('t', '', 'c', 'task', 0, 'x', NULL, NULL)", [()])], good))
+        storage.writer.queue.put(([("INSERT INTO missing VALUES (1)", [()])], bad))
+        release.set()
+        blocker.join(5)
+
+        self.assertIsNone(good.result(5))
+        self.assertIsInstance(bad.exception(5), sqlite3.OperationalError)
+        self.assertEqual((storage.stats()["batches"], storage.stats()["operations"]), (2, 3))
+        with storage.cursor(transaction=False) as cursor:
+            self.assertEqual(cursor.execute("SELECT COUNT(*) FROM writes").fetchone()[0], 1)
+
+    def test_compaction_keeps_last_checkpoints_and_reroots_history(self):
+        storage = self.build()
+        latest = save_history(storage, "chat", 5)
+        save_history(storage, "interview", 2)
+
+        result = storage.compact(keep_last=2)
+
+        self.assertEqual((result["deleted"], result["threads"], result["vacuumed"]), (3, 1, True))
+        history = list(storage.list({"configurable": {"thread_id": "chat"}}))
+        self.assertEqual([saved.metadata["step"] for saved in history], [4, 3])
+        self.assertEqual(history[0].config, latest)
+        self.assertIsNone(history[-1].parent_config)
+        self.assertEqual(len(list(storage.list({"configurable": {"thread_id": "interview"}}))), 2)
+        with storage.cursor(transaction=False) as cursor:
+            self.assertEqual(cursor.execute("SELECT COUNT(*) FROM writes WHERE thread_id = 'chat'").fetchone()[0], 2)
+
+    def test_compaction_by_age_always_keeps_the_newest_checkpoint(self):
+        storage = self.build()
+        save_history(storage, "chat", 3)
+
+        self.assertEqual(storage.compact(max_age=3600)["deleted"], 0)
+        with patch("backend.storage.time.time", return_value=time.time() + 7200):
+            result = storage.compact(max_age=3600, vacuum=False)
+
+        self.assertEqual((result["deleted"], result["vacuumed"]), (2, False))
+        self.assertEqual(len(list(storage.list({"configurable": {"thread_id": "chat"}}))), 1)
+        self.assertEqual(storage.compact()["deleted"], 0)
+
+    def test_storage_schedules_compaction_when_a_policy_is_set(self):
+        environ = {"SQLITE_DATABASE_PATH": self.path, "CHECKPOINT_KEEP_LAST": "1", "CHECKPOINT_COMPACTION_INTERVAL": "0.05"}
+        with patch.dict(os.environ, environ):
+            storage = Storage("database")
+            save_history(storage.storage, "chat", 3)
+        self.addCleanup(storage.storage.close)
+
+        compactor = storage.storage.compactor
+        history = lambda: list(storage.storage.list({"configurable": {"thread_id": "chat"}}))
+        for _ in range(100):
+            if len(history()) == 1 and compactor.last_result: break
+            time.sleep(0.05)
+
+        self.assertEqual([saved.metadata["step"] for saved in history()], [2])
+        self.assertIn("deleted", compactor.last_result)
+
+    def test_async_saver_uses_wal(self):
+        async def run():
+            with patch.dict(os.environ, {"SQLITE_DATABASE_PATH": self.path}):
+                storage = Storage("database", "sqlite", asynchronous=True).storage
+
+            config = {"configurable": {"thread_id": "chat", "checkpoint_ns": ""}}
+            await storage.aput(config, create_checkpoint(empty_checkpoint(), {}, 0), {"step": 0}, {})
+            saved = await storage.aget_tuple({"configurable": {"thread_id": "chat"}})
+            async with storage.conn.execute("PRAGMA journal_mode") as cursor:
+                journal_mode = (await cursor.fetchone())[0]
+            await storage.conn.close()
+            return storage, saved, journal_mode
+
+        storage, saved, journal_mode = asyncio.run(run())
+        self.assertIsInstance(storage, WalAsyncSqliteSaver)
+        self.assertIsNotNone(saved)
+        self.assertEqual(journal_mode, "wal")
+
+
+class TestZstdSerializer(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.messages = [SystemMessage(CHATBOT_PROMPT), HumanMessage("What happened today?"), AIMessage("Not much.")]
+        self.path = os.path.join(self.directory, "chatbot.db")
+
+    def train(self, serde):
+        samples = [serde.serde.dumps_typed([HumanMessage(f"question {index}"), AIMessage(f"answer {index} " * 8)])[1]
+                   for index in range(400)]
+        return serde.train(samples, size=4096)
+
+    def test_round_trips_without_a_dictionary_until_one_is_trained(self):
+        serde = ZstdSerializer(dictionaries=SqliteDictionaryStore(self.path))
+
+        type_, blob = serde.dumps_typed(self.messages)
+        small = serde.dumps_typed("hi")
+
+        self.assertTrue(type_.startswith("zstd::"))
+        self.assertEqual(serde.loads_typed((type_, blob)), self.messages)
+        self.assertFalse(small[0].startswith("zstd:"))
+        self.assertEqual(serde.loads_typed(small), "hi")
+
+        stats = serde.stats()
+        self.assertEqual((stats["dumps"], stats["loads"], stats["dictionary"]), (2, 1, None))
+        self.assertGreater(stats["ratio"], 1)
+        self.assertGreater(stats["dumps_seconds"], 0)
+
+    def test_dictionaries_are_shared_through_the_database(self):
+        # Two hosts on one database: the one started before training still reads what the other compresses
+        first = ZstdSerializer(dictionaries=SqliteDictionaryStore(self.path))
+        second = ZstdSerializer(dictionaries=SqliteDictionaryStore(self.path))
+        old = first.dumps_typed(self.messages)
+
+        key = self.train(first)
+        new = first.dumps_typed(self.messages)
+
+        self.assertTrue(new[0].startswith(f"zstd:{key}:"))
+        self.assertEqual(second.loads_typed(new), self.messages)
+        restarted = ZstdSerializer(dictionaries=SqliteDictionaryStore(self.path))
+        self.assertEqual(restarted.current, key)
+        self.assertEqual(restarted.loads_typed(old), self.messages)
+
+    def test_unknown_dictionary_fails_with_a_migration_error(self):
+        serde = ZstdSerializer(dictionaries=SqliteDictionaryStore(self.path))
+        blob = serde.dumps_typed(self.messages)[1]
+
+        with self.assertRaisesRegex(ValueError, "'0123456789abcdef'.*checkpoint_dictionaries table"):
+            serde.loads_typed(("zstd:0123456789abcdef:json", blob))
+
+    def test_incomplete_dictionary_store_fails_on_creation(self):
+        class WriteOnlyStore(DictionaryStore):
+            def save(self, key, data, created): pass
+
+        with self.assertRaisesRegex(TypeError, "latest, load"): WriteOnlyStore()
+
+    def test_dictionaries_from_the_local_directory_are_imported(self):
+        legacy = os.path.join(self.directory, "checkpoint_dictionaries")
+        trainer = ZstdSerializer(dictionaries=SqliteDictionaryStore(os.path.join(self.directory, "old.db")))
+        key = self.train(trainer)
+        blob = trainer.dumps_typed(self.messages)
+        os.makedirs(legacy)
+        with open(os.path.join(legacy, f"{key}.zdict"), "wb") as file:
+            file.write(trainer.dictionaries[key].as_bytes())
+        # Raw-content dictionaries of older versions stay readable but never compress new blobs
+        with open(os.path.join(legacy, "fedcba9876543210.zdict"), "wb") as file: file.write(b"prompt text " * 100)
+
+        serde = ZstdSerializer(dictionaries=SqliteDictionaryStore(self.path), legacy_directory=legacy)
+
+        self.assertEqual(serde.current, key)
+        self.assertEqual(serde.loads_typed(blob), self.messages)
+        self.assertIsNotNone(SqliteDictionaryStore(self.path).load("fedcba9876543210"))
+
+    def test_storage_uses_the_serializer_when_enabled(self):
+        environ = {
+            "SQLITE_DATABASE_PATH": self.path, "CHECKPOINT_COMPRESSION": "zstd",
+            "CHECKPOINT_DICTIONARY_DIR": os.path.join(self.directory, "checkpoint_dictionaries")
+        }
+        Storage._shared.clear()
+        self.addCleanup(Storage._shared.clear)
+
+        with patch.dict(os.environ, environ), patch.dict(storage_module._checkpoint_serializers, clear=True):
+            storage = Storage("database")
+        self.addCleanup(storage.storage.close)
+
+        checkpoint = empty_checkpoint()
+        checkpoint["channel_values"] = {"messages": self.messages}
+        config = storage.storage.put(
+            {"configurable": {"thread_id": "chat", "checkpoint_ns": ""}}, create_checkpoint(checkpoint, None, 0), {}, {}
+        )
+
+        saved = storage.storage.get_tuple(config)
+        self.assertEqual(saved.checkpoint["channel_values"]["messages"], self.messages)
+        self.assertGreater(storage.stats()["serializer"]["ratio"], 1)
+        self.assertIsInstance(storage.storage.serde.store, SqliteDictionaryStore)
+        with storage.storage.cursor(transaction=False) as cursor:
+            self.assertTrue(cursor.execute("SELECT type FROM checkpoints").fetchone()[0].startswith("zstd:"))
+
+
+class NotesState(TypedDict):
+    notes: Annotated[list[str], operator.add]
+
+def build_notes_graph(checkpointer):
+    graph = StateGraph(NotesState)
+    graph.add_node("draft", lambda state: {"notes": ["draft " * 50]})
+    graph.add_node("review", lambda state: {"notes": ["review " * 50]})
+    graph.add_edge(START, "draft")
+    graph.add_edge("draft", "review")
+    graph.add_edge("review", END)
+    return graph.compile(checkpointer)
+
+
+class TestBoundedMemorySaver(unittest.TestCase):
+
+    def run_threads(self, saver, *thread_ids):
+        graph = build_notes_graph(saver)
+        for thread_id in thread_ids: graph.invoke({"notes": []}, {"configurable": {"thread_id": thread_id}})
+        return graph
+
+    def test_evicts_least_recently_used_threads(self):
+        saver = BoundedMemorySaver(max_threads=2)
+        graph = self.run_threads(saver, "a", "b")
+        graph.get_state({"configurable": {"thread_id": "a"}})
+        self.run_threads(saver, "c")
+
+        self.assertEqual(list(saver.threads), ["a", "c"])
+        self.assertIsNone(saver.get_tuple({"configurable": {"thread_id": "b"}}))
+        self.assertEqual(saver.stats()["evicted_lru"], 1)
+
+    def test_byte_limit_and_counters(self):
+        saver = BoundedMemorySaver()
+        self.run_threads(saver, "a")
+        thread_bytes = saver.stats()["bytes"]
+        self.assertGreater(thread_bytes, 0)
+
+        saver.max_bytes = int(thread_bytes * 2.5)
+        self.run_threads(saver, "b", "c", "d")
+
+        self.assertEqual(list(saver.threads), ["c", "d"])
+        self.assertLessEqual(saver.stats()["bytes"], saver.max_bytes)
+        for thread_id in ("c", "d"): saver.delete_thread(thread_id)
+        self.assertEqual((saver.stats()["bytes"], len(saver.blobs), len(saver.writes)), (0, 0, 0))
+
+    def test_idle_threads_expire(self):
+        saver = BoundedMemorySaver(ttl=60)
+        self.run_threads(saver, "idle")
+
+        with patch("backend.storage.time.monotonic", return_value=time.monotonic() + 120):
+            self.run_threads(saver, "active")
+
+        self.assertEqual(list(saver.threads), ["active"])
+        self.assertEqual(saver.stats()["evicted_ttl"], 1)
+
+    def test_latest_only_keeps_resumable_state(self):
+        saver = BoundedMemorySaver(latest_only=True)
+        graph = self.run_threads(saver, "news", "news")
+
+        state = graph.get_state({"configurable": {"thread_id": "news"}})
+        self.assertEqual(len(state.values["notes"]), 4)
+        self.assertEqual(saver.stats()["checkpoints"], 1)
+        self.assertEqual(len(list(graph.get_state_history({"configurable": {"thread_id": "news"}}))), 1)
+
+    def test_memory_storage_is_bounded_from_the_environment(self):
+        environ = {"MEMORY_MAX_THREADS": "5", "MEMORY_MAX_MB": "1", "MEMORY_IDLE_TTL": "", "MEMORY_LATEST_ONLY": "true"}
+        with patch.dict(os.environ, environ):
+            storage = Storage("memory")
+
+        self.assertIsInstance(storage.storage, BoundedMemorySaver)
+        self.assertEqual((storage.storage.max_threads, storage.storage.max_bytes), (5, 1024 * 1024))
+        self.assertIsNone(storage.storage.ttl)
+        self.assertTrue(storage.storage.latest_only)
+        self.assertEqual(storage.stats()["threads"], 0)
+
+
+class ChatState(TypedDict):
+    messages: Annotated[list, add_messages]
+
+
+class TestMessageLog(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = WalSqliteSaver(os.path.join(directory.name, "chatbot.db"))
+        self.addCleanup(self.storage.close)
+
+    def build_chat(self, node):
+        graph = StateGraph(ChatState)
+        graph.add_node("chat", node)
+        graph.add_edge(START, "chat")
+        graph.add_edge("chat", END)
+        return graph.compile(self.storage)
+
+    def test_logs_every_turn_with_roles_and_tool_payloads(self):
+        tool_call = {"name": "generate_csv_tool", "args": {}, "id": "call-1"}
+        chat = self.build_chat(lambda state: {"messages": [
+            AIMessage("", tool_calls=[tool_call]),
+            ToolMessage('{"file_path": "report.csv"}', tool_call_id="call-1", name="generate_csv_tool"),
+            AIMessage("Here is your report"),
+        ]})
+
+        chat.invoke({"messages": [HumanMessage("Make a report")]}, {"configurable": {"thread_id": 1}})
+        history = self.storage.get_history(1)
+
+        self.assertEqual([record["role"] for record in history], ["human", "ai", "tool", "ai"])
+        self.assertEqual(history[0]["content"], "Make a report")
+        self.assertEqual(history[1]["tool"][0]["id"], "call-1")
+        self.assertEqual(history[2]["tool"], {"name": "generate_csv_tool", "tool_call_id": "call-1"})
+
+    def test_writes_arriving_out_of_order_keep_checkpoint_order(self):
+        # The graph submits put_writes in the background, so a later step's writes can reach the writer first
+        first, second, third = (str(uuid6(clock_seq=step)) for step in range(3))
+        config = lambda checkpoint_id: {"configurable": {"thread_id": 1, "checkpoint_ns": "", "checkpoint_id": checkpoint_id}}
+
+        self.storage.put_writes(config(third), [("messages", [AIMessage("answer 1")])], "chat")
+        self.storage.put_writes(config(second), [("messages", [HumanMessage("question 1")])], "__start__")
+        self.storage.put_writes(config(first), [("messages", [HumanMessage("question 0")])], "__start__")
+
+        history = self.storage.get_history(1)
+        self.assertEqual([record["content"] for record in history], ["question 0", "question 1", "answer 1"])
+        self.assertEqual([record["content"] for record in self.storage.get_history(1, before=history[1]["seq"])], ["question 0"])
+
+        self.storage.put_writes(config(second), [("messages", [RemoveMessage(REMOVE_ALL_MESSAGES)])], "chat")
+        self.assertEqual([record["content"] for record in self.storage.get_history(1)], ["answer 1"])
+
+    def test_log_rows_commit_with_their_writes(self):
+        config = {"configurable": {"thread_id": 1, "checkpoint_ns": "", "checkpoint_id": str(uuid6(clock_seq=0))}}
+        self.storage.writer.submit(lambda connection: connection.execute(
+            "CREATE TRIGGER broken_log BEFORE INSERT ON message_log BEGIN SELECT RAISE(ABORT, 'disk full'); END"
+        ))
+
+        # A log that cannot be written takes the checkpoint writes down with it, the log never lags behind them
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.storage.put_writes(config, [("messages", [HumanMessage("question 0")])], "__start__")
+        with self.storage.cursor(transaction=False) as cursor:
+            self.assertEqual(cursor.execute("SELECT count(*) FROM writes").fetchone(), (0,))
+
+        self.storage.writer.submit(lambda connection: connection.execute("DROP TRIGGER broken_log"))
+        self.storage.put_writes(config, [("messages", [HumanMessage("question 0")])], "__start__")
+        with self.storage.cursor(transaction=False) as cursor:
+            self.assertEqual(cursor.execute("SELECT count(*) FROM writes").fetchone(), (1,))
+        self.assertEqual([record["content"] for record in self.storage.get_history(1)], ["question 0"])
+        # One operation per put_writes, holding both the writes and their log rows
+        self.assertEqual(self.storage.writer.operations, 2)
+
+    def test_existing_logs_gain_checkpoint_order(self):
+        path = os.path.join(os.path.dirname(self.storage.path), "legacy.db")
+        with sqlite3.connect(path) as connection:
+            connection.executescript(
+                "CREATE TABLE message_log (seq INTEGER PRIMARY KEY, thread_id TEXT NOT NULL, channel TEXT NOT NULL, "
+                "source TEXT NOT NULL, message_id TEXT, role TEXT NOT NULL, content TEXT, tool TEXT, "
+                "UNIQUE (thread_id, source));"
+                "INSERT INTO message_log (thread_id, channel, source, role, content) "
+                "VALUES ('1', 'messages', 'b:chat:0:0', 'ai', 'late'), ('1', 'messages', 'a:__start__:0:0', 'human', 'early');"
+            )
+        connection.close()
+
+        storage = WalSqliteSaver(path)
+        self.addCleanup(storage.close)
+        self.assertEqual([record["content"] for record in storage.get_history(1)], ["early", "late"])
+
+    def test_history_pages_back_from_the_newest_message(self):
+        chat = self.build_chat(lambda state: {"messages": [AIMessage(f"answer {len(state['messages'])}")]})
+        for turn in range(5): chat.invoke({"messages": [HumanMessage(f"question {turn}")]}, {"configurable": {"thread_id": 1}})
+
+        latest = self.storage.get_history(1, limit=4)
+        older = self.storage.get_history(1, before=latest[0]["seq"], limit=4)
+        oldest = self.storage.get_history(1, before=older[0]["seq"], limit=4)
+
+        self.assertEqual([record["content"] for record in latest], ["question 3", "answer 7", "question 4", "answer 9"])
+        self.assertEqual(older[0]["content"], "question 1")
+        self.assertEqual([record["content"] for record in oldest], ["question 0", "answer 1"])
+        self.assertEqual(self.storage.get_history(2), [])
+
+    def test_removed_and_deleted_messages_leave_the_log(self):
+        chat = self.build_chat(lambda state: {"messages": [RemoveMessage(REMOVE_ALL_MESSAGES), AIMessage("fresh start")]})
+        chat.invoke({"messages": [HumanMessage("forget everything")]}, {"configurable": {"thread_id": 1}})
+
+        self.assertEqual([record["content"] for record in self.storage.get_history(1)], ["fresh start"])
+        self.storage.delete_thread(1)
+        self.assertEqual(self.storage.get_history(1), [])
+
+
+class TestShardedStorage(unittest.TestCase):
+
+    def setUp(self):
+        Storage._shared.clear()
+        self.addCleanup(Storage._shared.clear)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def build(self, shards=3):
+        environ = {"SQLITE_DATABASE_PATH": os.path.join(self.directory, "chatbot.db"), "SQLITE_SHARDS": str(shards)}
+        with patch.dict(os.environ, environ):
+            storage = Storage("database").storage
+        self.addCleanup(storage.close)
+        return storage
+
+    def test_sessions_are_spread_over_shard_files(self):
+        storage = self.build()
+        graph = StateGraph(ChatState)
+        graph.add_node("chat", lambda state: {"messages": [AIMessage("hello")]})
+        graph.add_edge(START, "chat")
+        chat = graph.compile(storage)
+        sessions = [f"session-{index}" for index in range(12)]
+
+        with ThreadPoolExecutor(6) as executor:
+            list(executor.map(
+                lambda thread_id: chat.invoke({"messages": [HumanMessage("hi")]}, {"configurable": {"thread_id": thread_id}}),
+                sessions
+            ))
+
+        self.assertIsInstance(storage, ShardedSaver)
+        self.assertEqual([os.path.basename(shard.path) for shard in storage.shards], ["chatbot-0.db", "chatbot-1.db", "chatbot-2.db"])
+        self.assertGreater(len({id(storage.shard(thread_id)) for thread_id in sessions}), 1)
+
+        for thread_id in sessions:
+            owner = storage.shard(thread_id)
+            for shard in storage.shards:
+                saved = shard.get_tuple({"configurable": {"thread_id": thread_id}})
+                self.assertEqual(saved is not None, shard is owner)
+            self.assertEqual(len(chat.get_state({"configurable": {"thread_id": thread_id}}).values["messages"]), 2)
+            self.assertEqual([record["role"] for record in storage.get_history(thread_id)], ["human", "ai"])
+
+        self.assertEqual(len(list(storage.list(None, limit=5))), 5)
+        self.assertEqual(len(list(storage.list(None))), 12 * 3)
+
+    def test_threads_map_to_the_same_shard_across_processes(self):
+        first = ShardedSaver([MagicMock(), MagicMock(), MagicMock(), MagicMock()])
+        second = ShardedSaver([MagicMock(), MagicMock(), MagicMock(), MagicMock()])
+
+        for thread_id in ("a", "b", "c", 42):
+            self.assertEqual(first.shards.index(first.shard(thread_id)), second.shards.index(second.shard(thread_id)))
+
+    def test_postgres_uris_become_shards(self):
+        environ = {"POSTGRES_CONNECTION_URI": "postgresql://one/chat, postgresql://two/chat"}
+        with patch("backend.storage.ConnectionPool") as mock_pool_cls, patch.object(PooledPostgresSaver, "setup"), \
+             patch.dict(os.environ, environ):
+            storage = Storage("database", "postgres").storage
+
+        self.assertIsInstance(storage, ShardedSaver)
+        self.assertEqual([call.args[0] for call in mock_pool_cls.call_args_list], ["postgresql://one/chat", "postgresql://two/chat"])
+
+
+class FakeMongoCollection:
+    # Local stand-in for a mongod collection, covering the queries the checkpointer issues
+    def __init__(self):
+        self.documents, self.indexes, self.finds, self.bulk_writes = [], [], [], []
+
+    def list_indexes(self):
+        return MagicMock(to_list=lambda: [{"key": [("_id", 1)]}, *self.indexes])
+
+    def create_index(self, keys, **options):
+        if all(index["key"] != keys for index in self.indexes): self.indexes.append({"key": keys, **options})
+
+    def find(self, query, projection=None, sort=None, limit=0, batch_size=None):
+        self.finds.append((query, projection))
+        found = [document for document in self.documents if all(
+            self.matches(document.get(key), condition) for key, condition in query.items()
+        )]
+        for key, direction in reversed(sort or []): found.sort(key=lambda document: document[key], reverse=direction < 0)
+        if projection:
+            found = [
+                {key: value for key, value in document.items() if projection.get(key, key == "_id")} for document in found
+            ]
+        return iter(found[:limit] if limit else found)
+
+    def find_one(self, query, projection=None, sort=None):
+        return next(self.find(query, projection, sort), None)
+
+    @staticmethod
+    def matches(value, condition):
+        if isinstance(condition, dict) and "$in" in condition: return value in condition["$in"]
+        if isinstance(condition, dict) and "$gt" in condition: return value is not None and value > condition["$gt"]
+        if isinstance(condition, dict) and "$lt" in condition: return value is not None and value < condition["$lt"]
+        return value == condition
+
+    def update_one(self, query, update, upsert=False):
+        (operator_, fields), = update.items()
+        for document in self.documents:
+            if all(document.get(key) == value for key, value in query.items()):
+                if operator_ == "$set": document.update(fields)
+                return
+        self.documents.append({"_id": len(self.documents), **query, **fields})
+
+    def bulk_write(self, operations, ordered=True):
+        self.bulk_writes.append((len(operations), ordered))
+        for operation in operations: self.update_one(operation._filter, operation._doc, operation._upsert)
+
+    def delete_many(self, query):
+        self.documents = [document for document in self.documents if document.get("thread_id") != query["thread_id"]]
+
+
+class TestMongoStorage(unittest.TestCase):
+
+    def setUp(self):
+        Storage._shared.clear()
+        self.addCleanup(Storage._shared.clear)
+        self.client = defaultdict(lambda: defaultdict(FakeMongoCollection))
+
+    def test_client_is_pooled_and_indexes_exist_on_existing_collections(self):
+        # Collections with other indexes made the base class skip its own
+        checkpoints = self.client["checkpointing_db"]["checkpoints"]
+        checkpoints.create_index([("created_at", 1)])
+        environ = {
+            "MONGODB_CONNECTION_URI": "mongodb://localhost", "MONGODB_POOL_MAX_SIZE": "8", "MONGODB_WRITE_CONCERN": "1"
+        }
+
+        with patch("backend.storage.MongoClient", return_value=self.client) as mock_client_cls, \
+             patch.dict(os.environ, environ):
+            storage = Storage("database", "mongo").storage
+
+        self.assertIsInstance(storage, TunedMongoDBSaver)
+        kwargs = mock_client_cls.call_args.kwargs
+        self.assertEqual((kwargs["maxPoolSize"], kwargs["w"], kwargs["serverSelectionTimeoutMS"]), (8, 1, 10000))
+        self.assertIn(
+            [("thread_id", 1), ("checkpoint_ns", 1), ("checkpoint_id", -1)], [index["key"] for index in checkpoints.indexes]
+        )
+        self.assertEqual(len(storage.writes_collection.indexes), 1)
+
+    def test_compression_dictionaries_live_in_the_database(self):
+        environ = {"MONGODB_CONNECTION_URI": "mongodb://localhost", "CHECKPOINT_COMPRESSION": "zstd"}
+
+        with patch("backend.storage.MongoClient", return_value=self.client), patch.dict(os.environ, environ), \
+             patch.dict(storage_module._checkpoint_serializers, clear=True):
+            serde = Storage("database", "mongo").storage.serde
+        samples = [serde.serde.dumps_typed([AIMessage(f"answer {index} " * 8)])[1] for index in range(400)]
+        key = serde.train(samples, size=4096)
+        blob = serde.dumps_typed([AIMessage("answer 1 " * 40)])
+
+        # A host started on a fresh disk finds the dictionary in the database
+        other = ZstdSerializer(dictionaries=storage_module.MongoDictionaryStore(
+            self.client["checkpointing_db"]["checkpoint_dictionaries"]
+        ))
+        self.assertEqual(other.current, key)
+        self.assertEqual(other.loads_typed(blob), [AIMessage("answer 1 " * 40)])
+
+    def test_graph_state_matches_the_base_saver_with_fewer_fields_and_queries(self):
+        storage = TunedMongoDBSaver(self.client)
+        graph = StateGraph(ChatState)
+        graph.add_node("chat", lambda state: {"messages": [AIMessage(f"answer {len(state['messages'])}")]})
+        graph.add_edge(START, "chat")
+        chat = graph.compile(storage)
+        config = {"configurable": {"thread_id": "1"}}
+
+        for turn in range(3): chat.invoke({"messages": [HumanMessage(f"question {turn}")]}, config)
+        self.assertEqual(len(chat.get_state(config).values["messages"]), 6)
+        self.assertTrue(all(ordered is False for _, ordered in storage.writes_collection.bulk_writes))
+
+        # One writes query for the page of checkpoints, and every read is projected
+        storage.checkpoint_collection.finds.clear()
+        storage.writes_collection.finds.clear()
+        history, latest = list(storage.list(config)), storage.get_tuple(config)
+        finds = storage.checkpoint_collection.finds + storage.writes_collection.finds
+
+        self.assertEqual(len(storage.writes_collection.finds), 2)
+        self.assertTrue(all(projection for _, projection in finds))
+        self.assertEqual(history, list(MongoDBSaver.list(storage, config)))
+        self.assertEqual(latest, MongoDBSaver.get_tuple(storage, config))
+        self.assertEqual(len(list(storage.list(config, limit=2))), 2)
+
+        # The base class fails on a task without writes
+        storage.put_writes(latest.config, [], "empty")
+
+
+if __name__ == "__main__":
+    unittest.main()
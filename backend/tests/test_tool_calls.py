@@ -0,0 +1,171 @@
+import os
+import time
+import asyncio
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+import sys
+
+# Create mock modules for dependencies that need system libraries
+mock_weasyprint = MagicMock()
+mock_weasyprint.__spec__ = MagicMock()
+sys.modules.setdefault("weasyprint", mock_weasyprint)
+
+from langchain_core.messages import AIMessage
+from langchain_core.tools import tool
+from langgraph.graph import StateGraph, START
+from backend.schemas import QueryState
+from backend.utilities import ToolCallRunner, timed_tool_node, tool_settings
+
+
+@tool
+def lookup(query: str, delay: float) -> str:
+    """Looks a query up after `delay` seconds."""
+    time.sleep(delay)
+    return f"found {query}"
+
+@tool
+def slow_lookup(query: str) -> str:
+    """Looks a query up, slowly."""
+    time.sleep(1)
+    return f"found {query}"
+
+@tool
+def blocking_lookup(query: str) -> str:
+    """Looks a query up once the test releases it."""
+    released.wait(5)
+    started.append(query)
+    return f"found {query}"
+
+@tool
+async def async_lookup(query: str, delay: float) -> str:
+    """Looks a query up after `delay` seconds without blocking the event loop."""
+    await asyncio.sleep(delay)
+    return f"found {query}"
+
+
+released, started = threading.Event(), []
+
+def tool_call(name: str, call_id: str, **args) -> dict:
+    return {"name": name, "args": args, "id": call_id, "type": "tool_call"}
+
+def tool_graph(tools, runner, messages_key="messages"):
+    graph = StateGraph(QueryState)
+    graph.add_node("tools", timed_tool_node(tools, lambda: runner, messages_key=messages_key))
+    graph.add_edge(START, "tools")
+    return graph.compile()
+
+
+class TestToolCallRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = ToolCallRunner(max_workers=4, timeout=5, timeouts={"slow_lookup": 0.2})
+        self.addCleanup(self.runner.shutdown, wait=False)
+
+    def test_calls_run_concurrently_and_keep_their_order(self):
+        graph = tool_graph([lookup], self.runner, messages_key="queries")
+        calls = [tool_call("lookup", f"call-{index}", query=f"q{index}", delay=delay)
+                 for index, delay in enumerate((0.4, 0.1, 0.25))]
+
+        start = time.perf_counter()
+        result = graph.invoke({"messages": [], "queries": [AIMessage("", tool_calls=calls)]})
+        elapsed = time.perf_counter() - start
+
+        messages = result["queries"][1:]
+        self.assertLess(elapsed, 0.7)
+        self.assertEqual([message.tool_call_id for message in messages], ["call-0", "call-1", "call-2"])
+        self.assertEqual([message.content for message in messages], ["found q0", "found q1", "found q2"])
+        self.assertGreaterEqual(messages[0].response_metadata["latency_seconds"], 0.4)
+        self.assertEqual(self.runner.stats()["lookup"]["calls"], 3)
+
+    def test_pool_bounds_concurrent_tools(self):
+        runner = ToolCallRunner(max_workers=2, timeout=5)
+        self.addCleanup(runner.shutdown, wait=False)
+        calls = [tool_call("lookup", f"call-{index}", query="q", delay=0.2) for index in range(4)]
+
+        start = time.perf_counter()
+        tool_graph([lookup], runner).invoke({"messages": [AIMessage("", tool_calls=calls)]})
+
+        # Two workers need two rounds for four calls
+        self.assertGreaterEqual(time.perf_counter() - start, 0.4)
+
+    def test_timeout_counts_from_when_the_call_starts(self):
+        runner = ToolCallRunner(max_workers=1, timeout=0.3)
+        self.addCleanup(runner.shutdown, wait=False)
+        calls = [tool_call("lookup", f"call-{index}", query=f"q{index}", delay=0.2) for index in range(2)]
+
+        messages = tool_graph([lookup], runner).invoke({"messages": [AIMessage("", tool_calls=calls)]})["messages"][1:]
+
+        # The second call queued behind the first for longer than the timeout, but ran within it
+        self.assertEqual([message.content for message in messages], ["found q0", "found q1"])
+        self.assertGreaterEqual(max(message.response_metadata.get("queued_seconds", 0) for message in messages), 0.15)
+
+    def test_calls_that_never_start_are_cancelled(self):
+        released.clear()
+        started.clear()
+        self.addCleanup(released.set)
+        runner = ToolCallRunner(max_workers=1, timeout=5, queue_timeout=0.2)
+        self.addCleanup(runner.shutdown, wait=False)
+        calls = [tool_call("blocking_lookup", f"call-{index}", query=f"q{index}") for index in range(2)]
+        graph = tool_graph([blocking_lookup, lookup], runner)
+
+        thread = threading.Thread(target=lambda: graph.invoke({"messages": [AIMessage("", tool_calls=calls[:1])]}))
+        thread.start()
+        time.sleep(0.1)
+        message = graph.invoke({"messages": [AIMessage("", tool_calls=calls[1:])]})["messages"][-1]
+        # Other tools have their own workers and still run while blocking_lookup holds its only one
+        other_call = tool_call("lookup", "call-2", query="q2", delay=0)
+        other = graph.invoke({"messages": [AIMessage("", tool_calls=[other_call])]})
+        released.set()
+        thread.join(5)
+
+        self.assertEqual(message.status, "error")
+        self.assertIn("did not start within 0.2 seconds", message.content)
+        self.assertEqual(other["messages"][-1].content, "found q2")
+        # The cancelled call did not run once the worker was free again
+        time.sleep(0.1)
+        self.assertEqual(started, ["q0"])
+
+    def test_slow_tool_times_out_without_holding_the_others(self):
+        graph = tool_graph([lookup, slow_lookup], self.runner)
+        calls = [tool_call("slow_lookup", "call-0", query="q0"), tool_call("lookup", "call-1", query="q1", delay=0)]
+
+        start = time.perf_counter()
+        messages = graph.invoke({"messages": [AIMessage("", tool_calls=calls)]})["messages"][1:]
+
+        self.assertLess(time.perf_counter() - start, 0.8)
+        self.assertEqual((messages[0].status, messages[0].tool_call_id), ("error", "call-0"))
+        self.assertIn("did not finish within 0.2 seconds", messages[0].content)
+        self.assertEqual(messages[1].content, "found q1")
+        stats = self.runner.stats()
+        self.assertEqual((stats["slow_lookup"]["timeouts"], stats["slow_lookup"]["errors"]), (1, 1))
+        self.assertEqual(stats["lookup"]["timeouts"], 0)
+
+    def test_async_calls_are_gathered_with_timeouts(self):
+        runner = ToolCallRunner(max_workers=1, timeout=5, timeouts={"async_lookup": 0.3})
+        self.addCleanup(runner.shutdown, wait=False)
+        graph = tool_graph([async_lookup], runner)
+        calls = [tool_call("async_lookup", f"call-{index}", query=f"q{index}", delay=delay)
+                 for index, delay in enumerate((0.2, 0.2, 1))]
+
+        start = time.perf_counter()
+        messages = asyncio.run(graph.ainvoke({"messages": [AIMessage("", tool_calls=calls)]}))["messages"][1:]
+
+        self.assertLess(time.perf_counter() - start, 0.6)
+        self.assertEqual([message.status for message in messages], ["success", "success", "error"])
+        self.assertEqual(runner.stats()["async_lookup"]["calls"], 3)
+
+    def test_settings_read_per_tool_timeouts(self):
+        environment = {"TOOL_MAX_WORKERS": "3", "TOOL_TIMEOUT": "30", "TOOL_TIMEOUT_GENERATE_PDF_FILE": "120"}
+
+        with patch.dict(os.environ, environment):
+            runner = ToolCallRunner(**tool_settings())
+        self.addCleanup(runner.shutdown, wait=False)
+
+        self.assertEqual((runner.timeout_for("generate_pdf_file"), runner.timeout_for("lookup")), (120, 30))
+        self.assertEqual((runner.executor_for("lookup")._max_workers, runner.queue_timeout), (3, 30))
+        self.assertIsNot(runner.executor_for("lookup"), runner.executor_for("generate_pdf_file"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,29 +1,73 @@
-import pandas
-from weasyprint import HTML
+import os
 from .prompts import CSV_PROMPT, PDF_PROMPT
+from .search import SearchCache, CachedSearch, cached_search_tool, search_ttls
+from .rendering import PdfRenderer, csv_chunks
+from .artifacts import ArtifactStore
+from .utilities import build_once
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import StructuredTool
 from langchain_community.tools import DuckDuckGoSearchRun, DuckDuckGoSearchResults
 
 
-def generate_csv_file(data: dict) -> dict:
-    pandas.DataFrame(data).to_csv('chatbot.csv', index=False)
+# Generated files are kept per session (the graph's thread) and addressed by content, the UI downloads them from here
+artifact_store = build_once(lambda: ArtifactStore(
+    os.environ.get("ARTIFACT_DIR", "artifacts"), int(float(os.environ.get("ARTIFACT_MEMORY_MB", 64)) * 2**20),
+    float(os.environ.get("ARTIFACT_TTL", 86400))
+))
+
+# PDFs render on worker processes (started on the first PDF) into the artifact store, named by their template's hash
+pdf_renderer = build_once(lambda: PdfRenderer(artifact_store(), int(os.environ.get("PDF_WORKERS", 2))))
+
+def session_of(config: RunnableConfig | None) -> str:
+    return str(((config or {}).get("configurable") or {}).get("thread_id", "default"))
+
+def generate_csv_file(data: dict, config: RunnableConfig) -> dict:
+    # Rows are written out as they are encoded, large exports never hold a DataFrame or the whole file as a string
+    session = session_of(config)
     return {
         "label": "Download CSV File",
-        "file_path":'chatbot.csv',
+        "artifact": artifact_store().put_chunks(session, csv_chunks(data)),
+        "session": session,
         "file_name":"data.csv",
         "mime":"text/csv"
     }
 
-def generate_pdf_file(template: str) -> dict:
-    HTML(string = template).write_pdf("chatbot.pdf")
+def generate_pdf_file(template: str, config: RunnableConfig) -> dict:
+    # Returns at once, the PDF joins the session's artifacts (under its job id) once it has rendered
+    session = session_of(config)
+    job = pdf_renderer().submit(session, template)
     return {
         "label": "Download PDF File",
-        "file_path":'chatbot.pdf',
+        "artifact": job,
+        "session": session,
         "file_name":"data.pdf",
-        "mime":"application/pdf"
+        "mime":"application/pdf",
+        "job": job
     }
 
+def artifact_bytes(tool_data: dict, timeout: float | None = 0) -> bytes | None:
+    # Contents of a generated file, waiting up to `timeout` seconds for a PDF that is still rendering
+    if "artifact" not in tool_data:
+        # Messages from before the artifact store point at a file in the working directory
+        if not os.path.exists(tool_data.get("file_path", "")): return None
+        with open(tool_data["file_path"], "rb") as file: return file.read()
+
+    session, key = tool_data["session"], tool_data["artifact"]
+    if (data := artifact_store().get(session, key)) is not None or "job" not in tool_data: return data
+
+    # A PDF still rendering is written into the store under its job once done
+    try: return pdf_renderer().wait(session, tool_data["job"], timeout)
+    except Exception: return None
+
+# Search results are cached in SQLite (opened on the first search) and identical searches in flight share one request
+web_search = DuckDuckGoSearchResults()
+search_cache = build_once(lambda: CachedSearch(
+    lambda query: web_search.invoke({"query": query}),
+    SearchCache(os.environ.get("SEARCH_CACHE_PATH", "search_cache.db")), search_ttls()
+))
+
 # Tools
-search_internet = DuckDuckGoSearchResults()
+search_internet = cached_search_tool(web_search, search_cache)
 generate_csv_tool = StructuredTool.from_function(generate_csv_file, description = CSV_PROMPT)
 generate_pdf_tool = StructuredTool.from_function(generate_pdf_file, description = PDF_PROMPT)
+agent_tools = [search_internet, generate_csv_tool, generate_pdf_tool]
@@ -1,8 +1,287 @@
-import os, json
+import os, json, time, asyncio, threading, contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, Sequence
 from dotenv import load_dotenv
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.tools import BaseTool
+from langgraph.prebuilt import ToolNode
+from langgraph.prebuilt.tool_node import ToolCallRequest
 from .schemas import QueryState, InterviewState
 
 
+# Lazy Construction Utilities
+def build_once(factory: Callable, *args: Any) -> Callable[[], Any]:
+    # Returns a getter that builds `factory(*args)` on first call and hands out the same instance afterwards
+    lock = threading.Lock()
+    instance = []
+
+    def getter() -> Any:
+        if not instance:
+            with lock:
+                if not instance: instance.append(factory(*args))
+
+        return instance[0]
+
+    getter.is_built = lambda: bool(instance)
+    return getter
+
+_warm_up_started = set()
+_warm_up_lock = threading.Lock()
+
+def warm_up(*getters: Callable[[], Any]) -> threading.Thread | None:
+    # Builds the given agents on a background thread so the first request does not pay for construction
+    with _warm_up_lock:
+        pending = [getter for getter in getters if getter not in _warm_up_started and not getter.is_built()]
+        _warm_up_started.update(pending)
+
+    if not pending: return None
+    thread = threading.Thread(target=lambda: [getter() for getter in pending], daemon=True)
+    thread.start()
+    return thread
+
+
+# Prompt Utilities
+def with_system_prompt(prompt: str, messages: Sequence[BaseMessage]) -> list[BaseMessage]:
+    # The persona is applied at call time; system prompts that older checkpoints persisted in the history are dropped
+    return [SystemMessage(prompt), *(message for message in messages if not isinstance(message, SystemMessage))]
+
+
+# Chat Context Utilities
+class ContextWindow:
+    """
+    Fits a conversation into a prompt token budget: the system prompt, a rolling summary of the turns that no longer
+    fit and the most recent whole turns. The summary and the number of history messages it covers are kept in the
+    graph state, so each fold only summarizes the messages that dropped out since the previous one. `overhead` is text
+    the model receives with every conversation besides its messages (the tool definitions) and is counted too. A latest
+    turn that cannot fit on its own has its longest messages truncated rather than overflowing the model's window.
+    """
+    def __init__(
+        self, count_tokens: Callable[[str], int], budget: int,
+        summarize: Callable[[str, list[BaseMessage]], str], summary_tokens: int = 512, overhead: str = ""
+    ) -> None:
+        self.count_tokens = count_tokens
+        self.budget = budget
+        self.summarize = summarize
+        self.summary_tokens = summary_tokens
+        self.overhead = overhead
+        self._overhead_tokens: int | None = None
+
+    def count(self, messages: Sequence[BaseMessage]) -> int:
+        # Content, tool call arguments and a few tokens of per-message framing
+        total = 0
+
+        for message in messages:
+            content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+            total += self.count_tokens(content) + 4
+            if getattr(message, "tool_calls", None): total += self.count_tokens(json.dumps(message.tool_calls))
+
+        return total
+
+    def overhead_tokens(self) -> int:
+        # Counted on the first fit rather than when the window is built, a remote counter may download its encoding
+        if self._overhead_tokens is None:
+            self._overhead_tokens = self.count_tokens(self.overhead) if self.overhead else 0
+        return self._overhead_tokens
+
+    def system_message(self, prompt: str, summary: str = "") -> SystemMessage:
+        if summary: prompt = f"{prompt}\n\nSummary of the earlier conversation:\n{summary}"
+        return SystemMessage(prompt)
+
+    def fit(
+        self, prompt: str, messages: Sequence[BaseMessage], summary: str = "", summarized: int = 0
+    ) -> tuple[list[BaseMessage], dict]:
+        # Returns the messages to send and the state update ({} unless older turns were folded into the summary)
+        history = list(messages)
+        summarized = min(summarized, len(history))
+        room = self.budget - self.overhead_tokens() - self.count([self.system_message(prompt, summary)])
+        update = {}
+
+        if self.count(history[summarized:]) > room:
+            # Turns start at a human message, so a tool-calling reply always stays with its results. The latest turn is
+            # always kept and older ones only while they fit half of what the grown summary leaves, so the next few
+            # turns fit without folding again
+            target = max(room - self.summary_tokens, 0) // 2
+            cut, kept = len(history), 0
+
+            for index in reversed(range(summarized, len(history))):
+                kept += self.count(history[index:index + 1])
+                if not isinstance(history[index], HumanMessage): continue
+                if cut < len(history) and kept > target: break
+                cut = index
+
+            if summarized < cut < len(history):
+                # Older checkpoints may still hold the system prompt that used to be inserted into the history
+                folded = [message for message in history[summarized:cut] if not isinstance(message, SystemMessage)]
+                summary = self.summarize(summary, folded) if folded else summary
+                summarized = cut
+                update = {"summary": summary, "summarized": summarized}
+
+        system = self.system_message(prompt, summary)
+        recent = [message for message in history[summarized:] if not isinstance(message, SystemMessage)]
+        room = self.budget - self.overhead_tokens() - self.count([system])
+        if self.count(recent) > room: recent = self._truncate(recent, room)
+        return [system, *recent], update
+
+    def _truncate(self, messages: list[BaseMessage], room: int) -> list[BaseMessage]:
+        # Shortens the longest texts until the turn fits (the state keeps them whole), raises once nothing can give
+        messages, marker = list(messages), "\n[truncated to fit the context window]"
+        length = lambda message: len(message.content) if isinstance(message.content, str) else 0
+
+        while (excess := self.count(messages) - room) > 0:
+            index = max(range(len(messages)), key=lambda index: length(messages[index]))
+            content = messages[index].content
+            if length(messages[index]) <= len(marker):
+                raise ValueError(
+                    f"The latest turn needs {self.count(messages)} tokens, only {max(room, 0)} fit the context window"
+                )
+            tokens = max(self.count_tokens(content), 1)
+            keep = max(int(len(content) * (tokens - excess) / tokens) - len(marker), 0)
+            messages[index] = messages[index].model_copy(update={"content": content[:keep] + marker})
+
+        return messages
+
+
+# Tool Execution Utilities
+def tool_settings() -> dict[str, Any]:
+    # TOOL_TIMEOUT_<TOOL NAME> overrides TOOL_TIMEOUT for one tool, e.g. TOOL_TIMEOUT_GENERATE_PDF_FILE=120
+    prefix = "TOOL_TIMEOUT_"
+    return {
+        "max_workers": int(os.environ.get("TOOL_MAX_WORKERS", 8)),
+        "timeout": float(os.environ.get("TOOL_TIMEOUT", 60)),
+        "queue_timeout": float(os.environ.get("TOOL_QUEUE_TIMEOUT", 30)),
+        "timeouts": {
+            name[len(prefix):].lower(): float(value) for name, value in os.environ.items() if name.startswith(prefix)
+        }
+    }
+
+
+class ToolCallRunner:
+    """
+    ToolNode wrapper (`wrap_tool_call` / `awrap_tool_call`) that gives every tool call a per-tool timeout and records
+    its latency. ToolNode already runs the calls of one message concurrently and returns them in tool call order;
+    sync calls execute on a bounded pool per tool, so concurrent graphs cannot start more than `max_workers` calls of
+    one tool at once and a hung tool only holds its own threads. The timeout counts from when the call starts running,
+    a call still queued after `queue_timeout` is cancelled without running. A timed out call is answered with an error
+    ToolMessage; its thread cannot be killed and finishes in the background.
+    """
+    def __init__(
+        self, max_workers: int = 8, timeout: float = 60, timeouts: dict[str, float] | None = None,
+        queue_timeout: float = 30
+    ) -> None:
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.queue_timeout = queue_timeout
+        self._executors: dict[str, ThreadPoolExecutor] = {}
+        self._latency: dict[str, dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def timeout_for(self, name: str) -> float:
+        return self.timeouts.get(name.lower(), self.timeout)
+
+    def executor_for(self, name: str) -> ThreadPoolExecutor:
+        with self._lock:
+            if name not in self._executors:
+                self._executors[name] = ThreadPoolExecutor(self.max_workers, thread_name_prefix=f"tool-{name}")
+            return self._executors[name]
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock: executors, self._executors = list(self._executors.values()), {}
+        for executor in executors: executor.shutdown(wait=wait, cancel_futures=True)
+
+    def __call__(self, request: ToolCallRequest, execute: Callable[[ToolCallRequest], Any]) -> Any:
+        name = request.tool_call["name"]
+        timeout, queued = self.timeout_for(name), time.perf_counter()
+        started, start = threading.Event(), [queued]
+
+        def run(request: ToolCallRequest) -> Any:
+            start[0] = time.perf_counter()
+            started.set()
+            return execute(request)
+
+        # The graph config travels in context variables, the pool thread needs them for callbacks and interrupts
+        future = self.executor_for(name).submit(contextvars.copy_context().run, run, request)
+
+        # A call that never left the queue is cancelled, it must not run after its error was already answered
+        if not started.wait(self.queue_timeout) and future.cancel():
+            return self._record(name, self._queue_full(request), 0.0, time.perf_counter() - queued)
+
+        started.wait()
+        try:
+            result = future.result(max(timeout - (time.perf_counter() - start[0]), 0))
+        except FutureTimeoutError:
+            future.cancel()
+            result = self._timed_out(request, timeout)
+
+        return self._record(name, result, time.perf_counter() - start[0], start[0] - queued)
+
+    async def acall(self, request: ToolCallRequest, execute: Callable[[ToolCallRequest], Awaitable[Any]]) -> Any:
+        name = request.tool_call["name"]
+        timeout, start = self.timeout_for(name), time.perf_counter()
+
+        try:
+            result = await asyncio.wait_for(execute(request), timeout)
+        except asyncio.TimeoutError:
+            result = self._timed_out(request, timeout)
+
+        return self._record(name, result, time.perf_counter() - start)
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            return {
+                name: {**latency, "mean_seconds": latency["seconds"] / latency["calls"]}
+                for name, latency in self._latency.items()
+            }
+
+    def _timed_out(self, request: ToolCallRequest, timeout: float) -> ToolMessage:
+        name = request.tool_call["name"]
+        return ToolMessage(
+            f"Error: {name} did not finish within {timeout:g} seconds, try again or continue without it.",
+            name=name, tool_call_id=request.tool_call["id"], status="error", additional_kwargs={"timed_out": True}
+        )
+
+    def _queue_full(self, request: ToolCallRequest) -> ToolMessage:
+        name = request.tool_call["name"]
+        return ToolMessage(
+            f"Error: {name} is busy and did not start within {self.queue_timeout:g} seconds, try again later or "
+            "continue without it.",
+            name=name, tool_call_id=request.tool_call["id"], status="error", additional_kwargs={"timed_out": True}
+        )
+
+    def _record(self, name: str, result: Any, seconds: float, queued: float = 0.0) -> Any:
+        if isinstance(result, ToolMessage):
+            result.response_metadata["latency_seconds"] = round(seconds, 3)
+            if queued: result.response_metadata["queued_seconds"] = round(queued, 3)
+
+        with self._lock:
+            latency = self._latency.setdefault(
+                name,
+                {"calls": 0, "errors": 0, "timeouts": 0, "seconds": 0.0, "max_seconds": 0.0, "queued_seconds": 0.0}
+            )
+            latency["calls"] += 1
+            latency["seconds"] += seconds
+            latency["max_seconds"] = max(latency["max_seconds"], seconds)
+            latency["queued_seconds"] += queued
+            if isinstance(result, ToolMessage) and result.status == "error": latency["errors"] += 1
+            if isinstance(result, ToolMessage) and result.additional_kwargs.get("timed_out"): latency["timeouts"] += 1
+
+        return result
+
+
+tool_runner = build_once(lambda: ToolCallRunner(**tool_settings()))
+
+def timed_tool_node(
+    tools: Sequence[BaseTool], runner: Callable[[], ToolCallRunner] = tool_runner, **kwargs: Any
+) -> ToolNode:
+    # The runner is resolved on the first tool call, after the servers have loaded their .env
+    return ToolNode(
+        tools,
+        wrap_tool_call=lambda request, execute: runner()(request, execute),
+        awrap_tool_call=lambda request, execute: runner().acall(request, execute),
+        **kwargs
+    )
+
+
 # Graph Node Utilities(Planning Modules)
 
 # NewsBot Utilities
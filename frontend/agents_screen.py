@@ -10,12 +10,20 @@ from chat_screen import render_chat
 from news_screen import render_news
 from interview_screen import render_interview
 from interview_layout import interview_report, start_new_interview
-from backend.chat_server import chatbot
-from backend.news_server import newsbot
-from backend.interview_server import interviewbot
+from backend.chat_server import get_chatbot
+from backend.news_server import get_newsbot
+from backend.interview_server import get_interviewbot
+from backend.utilities import warm_up
 from utilities import set_state, publish_messages, clear_chat_history, set_multi_states
 from langchain_core.messages import HumanMessage
 
+# Agents are built on first use; AGENTS_WARM_UP (e.g. "newsbot,interviewbot") builds others in the background
+agent_factories = {"chatbot": get_chatbot, "newsbot": get_newsbot, "interviewbot": get_interviewbot}
+warm_up(*[
+    agent_factories[name.strip()] for name in os.environ.get("AGENTS_WARM_UP", "").split(",")
+    if name.strip() in agent_factories
+])
+
 # States and Options
 screen = st.session_state.get("screen", "chatbot")
 segment = st.session_state.get("segment", "headlines")
@@ -28,6 +36,8 @@ with st.sidebar:
     st.divider(width="stretch")
 
     if screen == "newsbot":
+        newsbot = get_newsbot()
+
         if segment == "stories":
             st.button("Headlines", width="stretch", on_click=set_state, args=("segment", "headlines"))
         elif segment == "summary":
@@ -37,15 +47,16 @@ with st.sidebar:
                 "Create PDF Report",
                 width="stretch",
                 on_click=publish_messages,
-                args=(newsbot, True, "assistant", "Generate a pdf with all the data", 2, "news")
+                args=(newsbot, True, "assistant", "Generate a pdf with all the data", None, "news")
             )
             st.button(
                 "Create CSV Report",
                 width="stretch",
                 on_click=publish_messages,
-                args=(newsbot, True, "assistant", "Generate a csv with all the data", 2, "news")
+                args=(newsbot, True, "assistant", "Generate a csv with all the data", None, "news")
             )
     elif screen == "chatbot":
+        chatbot = get_chatbot()
         st.button("New Chat", width="stretch", on_click=clear_chat_history, args=(chatbot,))
         st.button(
             "Create PDF Report",
@@ -1,10 +1,11 @@
 import streamlit as st
-from backend.chat_server import chatbot
+from backend.chat_server import get_chatbot
 from utilities import load_messages, publish_messages
 
 
 # Flow
 def render_chat():
+    chatbot = get_chatbot()
     load_messages(chatbot)
     publish_messages(chatbot)
 
@@ -2,7 +2,7 @@ import uuid, time, json
 from langgraph.types import Command
 from langchain_core.messages import HumanMessage
 import streamlit as st
-from backend.interview_server import interviewbot
+from backend.interview_server import get_interviewbot
 from backend.utilities import load_interview_rules
 from utilities import set_multi_states, set_state, _render_tool_message, read_message_text_aloud, record_audio_messages, stop_audio_recording
 
@@ -30,7 +30,7 @@ def start_new_interview():
 
 def interview_report():
     with st.spinner(":hourglass: :blue[Loading Data] - :grey[Building PDF Report...] *Please wait patiently* :gear:"):
-        report_response = interviewbot.invoke(
+        report_response = get_interviewbot().invoke(
             {"messages": [HumanMessage("Generate a PDF report of the conversion and evaluation of the interview. Keep the evaluation intact and don't try to summarise it")], "phase": "reporting"},
             st.session_state["q&a_config"]
         )
@@ -85,7 +85,7 @@ def submit_answer(
     with st.spinner("Submitting Answer..."):
         stop_audio_recording()
         answer = st.session_state.get(question, "")
-        bot_response = interviewbot.invoke(Command(resume=answer), config)
+        bot_response = get_interviewbot().invoke(Command(resume=answer), config)
     st.session_state["bot_response"] = bot_response
     if "clock_ends_at" in st.session_state:
         del st.session_state["clock_ends_at"]
@@ -142,7 +142,7 @@ def render_q_n_a():
             interview_thread_id = str(uuid.uuid4())
             st.session_state["q&a_config"] = {"configurable": {"thread_id": interview_thread_id}}
             st.query_params["thread_id"] = interview_thread_id
-            st.session_state["bot_response"] = interviewbot.invoke({
+            st.session_state["bot_response"] = get_interviewbot().invoke({
                 "messages": [{"role": "user", "content": "Start Interview"}],
                 "phase": "q&a",
                 "rules": {"format": st.session_state["format"]}
@@ -158,17 +158,17 @@ def render_q_n_a():
             # Auto-fill info logic
             if "full name" in interrupt_message.lower():
                 with st.spinner("Loading Question..."):
-                    bot_response = interviewbot.invoke(
+                    bot_response = get_interviewbot().invoke(
                         Command(resume=st.session_state["candidate_info"]["name"]), config
                     )
             elif "job role" in interrupt_message.lower():
                 with st.spinner("Loading Question..."):
-                    bot_response = interviewbot.invoke(
+                    bot_response = get_interviewbot().invoke(
                         Command(resume=st.session_state["candidate_info"]["desired_role"]), config
                     )
             elif "names of companies" in interrupt_message.lower():
                 with st.spinner("Loading Question..."):
-                    bot_response = interviewbot.invoke(
+                    bot_response = get_interviewbot().invoke(
                         Command(resume=st.session_state["candidate_info"]["preferred_companies"]), config
                     )
             
@@ -2,7 +2,7 @@ import streamlit as st
 import json
 from langchain_core.messages import HumanMessage
 from langgraph.types import Command
-from backend.interview_server import interviewbot
+from backend.interview_server import get_interviewbot
 from frontend.interview_layout import (
     render_format_selection,
     render_candidate_info,
@@ -18,7 +18,7 @@ def restore_session_state():
         if interview_thread_id and "format" not in st.session_state:
             with st.spinner("Restoring Session State..."):
                 st.session_state["q&a_config"] = {"configurable": {"thread_id": interview_thread_id}}
-                snapshot = interviewbot.get_state(
+                snapshot = get_interviewbot().get_state(
                     config=st.session_state["q&a_config"]
                 )
                 state_values = convert_state_snapshot(snapshot)
@@ -39,7 +39,7 @@ def restore_session_state():
 
                 if "__interrupt__" in state_values:
                     stop_audio_recording()
-                    st.session_state["bot_response"] = interviewbot.invoke(
+                    st.session_state["bot_response"] = get_interviewbot().invoke(
                         Command(resume=""), st.session_state["q&a_config"]
                     )
                 else:
@@ -1,7 +1,7 @@
 import json
 import streamlit as st
 from langchain_core.messages import HumanMessage
-from utilities import load_messages, publish_messages, set_multi_states, add_remove_state, set_state
+from utilities import load_messages, publish_messages, set_multi_states, add_remove_state, set_state, session_thread
 
 
 def render_headlines(newsbot):
@@ -19,7 +19,7 @@ def render_headlines(newsbot):
         with st.spinner(":hourglass: :blue[Loading Data] - :grey[Building UI Skeleton...] *Please wait patiently* :gear:"):
             headlines_response = newsbot.invoke(
                 {"messages": [HumanMessage(headlines_input)], "segment": "headlines"},
-                {"configurable": {"thread_id": 2}}
+                {"configurable": {"thread_id": session_thread("news")}}
             )
 
     for index, headline in enumerate(json.loads(headlines_response["messages"][-1].content)["headlines"]):
@@ -63,7 +63,7 @@ def render_stories(newsbot):
             stories_selected = []
             stories_response = newsbot.invoke(
                 {"messages": [HumanMessage(stories_input)], "segment": "stories"},
-                {"configurable": {"thread_id": 2}}
+                {"configurable": {"thread_id": session_thread("news")}}
             )
 
     with st.container(horizontal=True):
@@ -136,23 +136,23 @@ def render_summary(newsbot):
         with st.spinner(":hourglass: :blue[Loading Data] - :grey[Building UI Skeleton...] *Please wait patiently* :gear:"):
             summary_response = newsbot.invoke(
                 {"messages": [HumanMessage(f"Summarize these articles: {stories_to_summarize}")], "segment": "summary"},
-                {"configurable": {"thread_id": 2}}
+                {"configurable": {"thread_id": session_thread("news")}}
             )
 
     st.text(summary_response["messages"][-1].content)
-    load_messages(newsbot, thread=2, log_type="news")
+    load_messages(newsbot, log_type="news")
 
     if len(summary_response["messages"]) < len(st.session_state["news_logs"]):
-        publish_messages(newsbot, thread=2, log_type="news")
+        publish_messages(newsbot, log_type="news")
     
     query_input = st.chat_input("Type here...", )
 
     if query_input:
-        load_messages(newsbot, True, "user", query_input, 2, "news")
-        publish_messages(newsbot, True, "user", query_input, 2, "news")
+        load_messages(newsbot, True, "user", query_input, log_type="news")
+        publish_messages(newsbot, True, "user", query_input, log_type="news")
 
-        assistant_message = publish_messages(newsbot, True, "assistant", query_input, 2, "news")
-        load_messages(newsbot, True, "assistant", assistant_message, 2, "news")
+        assistant_message = publish_messages(newsbot, True, "assistant", query_input, log_type="news")
+        load_messages(newsbot, True, "assistant", assistant_message, log_type="news")
     
     set_multi_states({
         "summary_response": summary_response,
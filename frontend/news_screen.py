@@ -1,11 +1,12 @@
 import streamlit as st
-from backend.news_server import newsbot
+from backend.news_server import get_newsbot
 from news_layouts import render_headlines, render_stories, render_summary
 
 
 def render_news():
     # States and Options
     segment = st.session_state.get("segment", "headlines")
+    newsbot = get_newsbot()
 
     # Flow
     if segment == "headlines":
@@ -1,9 +1,11 @@
 import json
+import uuid
 import streamlit as st
 import speech_recognition as sr
 from gtts import gTTS
 from playsound import playsound
 from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+from backend.tools import pdf_renderer, artifact_store, artifact_bytes
 
 
 from typing import Any
@@ -21,6 +23,17 @@ def convert_state_snapshot(snapshot: Any) -> dict:
         state_dict["__interrupt__"] = snapshot.interrupts
     return state_dict
 
+def session_thread(log_type: str = "chat") -> str:
+    """
+    Thread ID of this browser session for a bot. The chat thread is kept in the URL, so a refresh reopens it.
+    """
+    key = f"{log_type}_thread_id"
+    if key not in st.session_state:
+        st.session_state[key] = (log_type == "chat" and st.query_params.get(key)) or str(uuid.uuid4())
+    if log_type == "chat":
+        st.query_params[key] = st.session_state[key]
+    return st.session_state[key]
+
 def set_multi_states(state_data: dict):
     """Update multiple session state values at once."""
     for key, value in state_data.items():
@@ -39,10 +52,13 @@ def add_remove_state(key: str, value: str):
     else: 
         st.session_state[key].append(value)
 
-def clear_chat_history(bot, thread: int = 1, log_type: str = "chat") -> None:
+def clear_chat_history(bot, thread: str = None, log_type: str = "chat") -> None:
     """Clear chat history from both the bot's checkpointer and session state."""
+    thread = thread or session_thread(log_type)
     bot.checkpointer.delete_thread(thread)
+    artifact_store().discard(thread)
     st.session_state[f"{log_type}_logs"] = []
+    st.session_state[f"{log_type}_logs_before"] = None
 
 
 # ============================================================================
@@ -59,16 +75,44 @@ def _render_assistant_message(content: str):
     with st.chat_message("assistant"):
         st.text(content)
 
+# Seconds a download waits for its PDF to finish rendering
+PDF_RENDER_WAIT = 120
+
 def _render_tool_message(tool_data: dict, index: int):
-    """Render a tool message (file download button) in the chat interface."""
-    with open(tool_data["file_path"]) as file:
-        st.download_button(
-            tool_data["label"],
-            file.buffer,
-            tool_data["file_name"],
-            tool_data["mime"],
-            f"{tool_data['label']}-{index}"
+    """Render a tool message (file download button) in the chat interface, once its file is ready."""
+    data = artifact_bytes(tool_data)
+    job = tool_data.get("job")
+    status = lambda: pdf_renderer().status(tool_data["session"], job) if job else "missing"
+
+    if data is None and status() == "rendering":
+        with st.spinner("Rendering PDF..."):
+            data = artifact_bytes(tool_data, PDF_RENDER_WAIT)
+
+    if data is None and (state := status()) == "failed":
+        st.error(f"{tool_data['label']}: rendering the PDF failed: {pdf_renderer().error(tool_data['session'], job)}")
+        st.button(
+            "Retry", key=f"retry-{tool_data['label']}-{index}", on_click=pdf_renderer().retry,
+            args=(tool_data["session"], job)
         )
+        return
+
+    if data is None:
+        # Missing files have expired with the session's other artifacts (or were lost on a restart)
+        state = "is still rendering" if state == "rendering" else "has expired"
+        st.warning(f"{tool_data['label']}: the file {state}")
+        return
+
+    st.download_button(
+        tool_data["label"],
+        data,
+        tool_data["file_name"],
+        tool_data["mime"],
+        f"{tool_data['label']}-{index}"
+    )
+
+def _is_download(content: str) -> bool:
+    """Whether a tool message offers a generated file, older messages point at a file path instead of an artifact."""
+    return '"artifact"' in content or "file_path" in content
 
 def read_message_text_aloud(message: str) -> None:
     tts = gTTS(text=message, lang='en')
@@ -125,12 +169,15 @@ def stop_audio_recording():
 # Message Loading (State Sync)
 # ============================================================================
 
+# Messages loaded per page when the checkpointer keeps a message log
+HISTORY_PAGE_SIZE = 50
+
 def load_messages(
     bot, 
     instant: bool = False, 
     type: str = None, 
     input: str = None, 
-    thread: int = 1,
+    thread: str = None,
     log_type: str = "chat"
 ) -> None:
     """
@@ -141,10 +188,11 @@ def load_messages(
         instant: If True, immediately append a single message to logs
         type: Message type ("user" or "assistant") when instant=True
         input: Message content when instant=True
-        thread: Thread ID for the bot conversation
+        thread: Thread ID for the bot conversation, defaults to this session's thread
         log_type: Type of log ("chat" or "news")
     """
     bot_state_attribute = "queries" if log_type == "news" else "messages"
+    thread = thread or session_thread(log_type)
     
     if instant:
         # Instant mode: append a single message to logs
@@ -153,9 +201,17 @@ def load_messages(
         else:
             st.session_state[f"{log_type}_logs"].append({"assistant": input})
     else:
-        # Initialization mode: load all messages from bot state
+        # Initialization mode: load the latest page of the message log, or all messages from bot state
         if f"{log_type}_logs" not in st.session_state:
             st.session_state[f"{log_type}_logs"] = []
+            st.session_state[f"{log_type}_logs_before"] = None
+            records = _load_history(bot, thread, bot_state_attribute)
+
+            if records:
+                st.session_state[f"{log_type}_logs"] = _history_logs(records)
+                st.session_state[f"{log_type}_logs_before"] = _older_page(records)
+                return
+
             messages = bot.get_state({"configurable": {"thread_id": thread}}).values.get(
                 bot_state_attribute, []
             )
@@ -165,10 +221,39 @@ def load_messages(
                     st.session_state[f"{log_type}_logs"].append({"user": message.content})
                 elif isinstance(message, AIMessage) and message.content:
                     st.session_state[f"{log_type}_logs"].append({"assistant": message.content})
-                elif isinstance(message, ToolMessage) and "file_path" in message.content:
+                elif isinstance(message, ToolMessage) and _is_download(message.content):
                     message_content = json.loads(message.content)
                     st.session_state[f"{log_type}_logs"].append({"tool": message_content})
 
+def load_older_messages(bot, thread: str, log_type: str = "chat") -> None:
+    """Prepend the page of logged messages preceding the oldest one shown."""
+    bot_state_attribute = "queries" if log_type == "news" else "messages"
+    records = _load_history(bot, thread, bot_state_attribute, st.session_state.get(f"{log_type}_logs_before"))
+
+    st.session_state[f"{log_type}_logs"] = _history_logs(records) + st.session_state[f"{log_type}_logs"]
+    st.session_state[f"{log_type}_logs_before"] = _older_page(records)
+
+def _load_history(bot, thread: str, channel: str, before: int = None) -> list:
+    """Read a page of the checkpointer's message log, empty when the checkpointer keeps none."""
+    get_history = getattr(bot.checkpointer, "get_history", None)
+    return get_history(thread, before, HISTORY_PAGE_SIZE, channel) if get_history else []
+
+def _older_page(records: list) -> int | None:
+    """Sequence number to load the previous page from, None once the first message is loaded."""
+    return records[0]["seq"] if len(records) == HISTORY_PAGE_SIZE else None
+
+def _history_logs(records: list) -> list:
+    """Convert message log records into session state logs."""
+    logs = []
+    for record in records:
+        if record["role"] == "human":
+            logs.append({"user": record["content"]})
+        elif record["role"] == "ai" and record["content"]:
+            logs.append({"assistant": record["content"]})
+        elif record["role"] == "tool" and _is_download(record["content"]):
+            logs.append({"tool": json.loads(record["content"])})
+    return logs
+
 
 # ============================================================================
 # Message Publishing (UI Rendering)
@@ -179,7 +264,7 @@ def publish_messages(
     instant: bool = False, 
     type: str = None, 
     input: str = None, 
-    thread: int = 1,
+    thread: str = None,
     log_type: str = "chat"
 ) -> str:
     """
@@ -190,13 +275,14 @@ def publish_messages(
         instant: If True, stream a new message; if False, render from logs
         type: Message type ("user" or "assistant") when instant=True
         input: User input to send to the bot when instant=True
-        thread: Thread ID for the bot conversation
+        thread: Thread ID for the bot conversation, defaults to this session's thread
         log_type: Type of log ("chat" or "news")
     
     Returns:
         The assistant's response content (only when instant=True and type="assistant")
     """
     bot_state_attribute = "queries" if log_type == "news" else "messages"
+    thread = thread or session_thread(log_type)
     
     if instant:
         if type == "user":
@@ -207,6 +293,8 @@ def publish_messages(
                 message_placeholder = st.empty()
                 full_response = ""
                 index = 0
+                # Downloads keep their place and are filled in after the reply, a PDF still rendering does not stall it
+                pending_files = []
                 
                 for message, _ in bot.stream(
                     {bot_state_attribute: [HumanMessage(input)]},
@@ -216,14 +304,26 @@ def publish_messages(
                     if isinstance(message, AIMessage) and message.content:
                         full_response += message.content
                         message_placeholder.markdown(full_response)
-                    elif isinstance(message, ToolMessage) and "file_path" in message.content:
+                    elif isinstance(message, ToolMessage) and _is_download(message.content):
                         message_content = json.loads(message.content.replace("'", '"'))
-                        _render_tool_message(message_content, index)
+                        pending_files.append((st.empty(), message_content, index))
                     
                     index += 1
+
+                for placeholder, message_content, index in pending_files:
+                    with placeholder.container(): _render_tool_message(message_content, index)
                 
             return full_response
     else:
+        if st.session_state.get(f"{log_type}_logs_before"):
+            st.button(
+                "Load older messages",
+                on_click=load_older_messages,
+                args=(bot, thread, log_type),
+                type="tertiary",
+                icon=":material/history:"
+            )
+
         # Render all messages from logs
         for index, message in enumerate(st.session_state[f"{log_type}_logs"]):
             if "user" in message: